@@ -1,23 +1,28 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.future import select
-from sqlalchemy import desc
+from sqlalchemy import desc, insert
+from sqlalchemy.engine import Row
 from app.models import Observation
 from app.filters import apply_filters, apply_time_range
 from fastapi import HTTPException
-from uuid import UUID
+from uuid import UUID, uuid4
 from typing import List, Optional, Any
 from datetime import datetime
 from schemas.observation_schemas import ObservationUpdate
 from logger.logging_config import logger
+from streams.observation_streams import STREAM_MAXLEN, STREAM_TTL, stream_entry, stream_key
+from app.metrics import STREAM_ENTRIES, STREAM_PUBLISH_SECONDS
 
 # Redis
-import json
+import time
 import redis.asyncio as aioredis
 from typing import Optional
 import os
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Rows per multi-row INSERT (8 bind parameters each; asyncpg allows 32767 per statement)
+BULK_INSERT_CHUNK_SIZE = 1000
 _redis_client: Optional[aioredis.Redis] = None
 
 async def get_redis_client():
@@ -27,6 +32,46 @@ async def get_redis_client():
     return _redis_client
 
 
+def observation_stream_entry(obs) -> dict:
+    """Redis stream fields for one observation (ORM instance or inserted row)"""
+    return stream_entry(
+        obs.id, obs.datastream_id, obs.result_time, obs.result_complex,
+        obs.result_numeric, obs.result_text, obs.result_boolean, obs.parameters,
+    )
+
+
+async def publish_observations(observations: list):
+    """
+    Add observations to their per-datastream Redis streams (consumed by WebSocket
+    clients and the Notifier).
+
+    Every XADD of the batch goes out in one pipeline, with one EXPIRE per distinct
+    datastream: a single Redis round trip however many rows were written. Failures
+    are logged, not raised - the observations are already in the database.
+    """
+    if not observations:
+        return
+    started = time.perf_counter()
+    try:
+        redis = await get_redis_client()
+        pipe = redis.pipeline(transaction=False)
+        streams = set()
+        for obs in observations:
+            channel = stream_key(obs.datastream_id)
+            pipe.xadd(channel, observation_stream_entry(obs), maxlen=STREAM_MAXLEN, approximate=True)
+            streams.add(channel)
+        for channel in streams:
+            pipe.expire(channel, STREAM_TTL)
+        await pipe.execute()
+    except Exception as e:
+        STREAM_ENTRIES.labels("failed").inc(len(observations))
+        logger.warning(f"Warning: Failed to write {len(observations)} observations to Redis: {str(e)}")
+        return
+    finally:
+        STREAM_PUBLISH_SECONDS.observe(time.perf_counter() - started)
+    STREAM_ENTRIES.labels("published").inc(len(observations))
+
+
 async def get_observation(db: AsyncSession, observation_id: UUID) -> Observation:
     statement = (
         select(Observation)
@@ -70,27 +115,7 @@ async def create_observation(db: AsyncSession, observation_in) -> Observation:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
-        # Add to datastream-specific Redis stream (for WebSocket subscribers and Notifier)
-        try:
-            redis = await get_redis_client()
-            channel = f"datastream:{str(new_observation.datastream_id)}"
-            data = {
-                "id": str(new_observation.id),
-                "datastream_id": str(new_observation.datastream_id),
-                "result_time": new_observation.result_time.isoformat(),
-                "result_complex": str(new_observation.result_complex) if new_observation.result_complex is not None else "",
-                "result_numeric": str(new_observation.result_numeric) if new_observation.result_numeric is not None else "",
-                "result_text": new_observation.result_text or "",
-                "result_boolean": str(new_observation.result_boolean) if new_observation.result_boolean is not None else "",
-                "parameters": json.dumps(new_observation.parameters) if new_observation.parameters else "{}"
-            }
-            # Add to per-datastream stream (consumed by WebSocket clients and Notifier)
-            await redis.xadd(channel, data, maxlen=1000, approximate=True)
-            # Set TTL to 7 days (604800 seconds)
-            await redis.expire(channel, 604800)
-        except Exception as e:
-            logger.warning(f"Warning: Failed to write observation to Redis: {str(e)}")
-            # Don't raise - observation is already created in DB
+    await publish_observations([new_observation])
 
     return new_observation
 
@@ -98,20 +123,35 @@ async def create_observation(db: AsyncSession, observation_in) -> Observation:
 async def create_observations_bulk(
     db: AsyncSession, 
     observations_in: list
-) -> List[Observation]:
+) -> List[Row]:
     """
     Create multiple observations in bulk.
+
+    Rows are written with multi-row INSERT ... RETURNING statements (one per
+    BULK_INSERT_CHUNK_SIZE rows) in a single transaction, bypassing the ORM
+    unit of work: no per-row refresh, no Observation instances. The returned
+    rows carry the inserted columns as attributes.
     
     Args:
         db: Database session
         observations_in: List of observations to create
     """
-    new_observations = [Observation(**obs.model_dump()) for obs in observations_in]
+    if not observations_in:
+        return []
+    rows = [obs.model_dump() for obs in observations_in]
+    for row in rows:
+        if row.get("id") is None:
+            row["id"] = uuid4()  # Client-side default, as the ORM would apply it
+    table = Observation.__table__
+    new_observations: List[Row] = []
     try:
-        db.add_all(new_observations)
+        for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+            chunk = rows[start:start + BULK_INSERT_CHUNK_SIZE]
+            result = await db.execute(insert(table).values(chunk).returning(*table.c))
+            # RETURNING order is not guaranteed: put the rows back in request order by their id
+            inserted = {row.id: row for row in result.all()}
+            new_observations.extend(inserted[row["id"]] for row in chunk)
         await db.commit()
-        for obs in new_observations:
-            await db.refresh(obs)
     except IntegrityError as e:
         await db.rollback()
         raise HTTPException(status_code=400, detail=f"Integrity error: {str(e)}")
@@ -120,27 +160,7 @@ async def create_observations_bulk(
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
     # Add all to Redis streams (separate from DB transaction)
-    try:
-        redis = await get_redis_client()
-        for obs in new_observations:
-            channel = f"datastream:{str(obs.datastream_id)}"
-            data = {
-                "id": str(obs.id),
-                "datastream_id": str(obs.datastream_id),
-                "result_time": obs.result_time.isoformat(),
-                "result_complex": str(obs.result_complex) if obs.result_complex is not None else "",
-                "result_numeric": str(obs.result_numeric) if obs.result_numeric is not None else "",
-                "result_text": obs.result_text or "",
-                "result_boolean": str(obs.result_boolean) if obs.result_boolean is not None else "",
-                "parameters": json.dumps(obs.parameters) if obs.parameters else "{}"
-            }
-            # Publish to per-datastream stream (consumed by WebSocket clients and Notifier)
-            await redis.xadd(channel, data, maxlen=1000, approximate=True)
-            # Set TTL to 7 days (604800 seconds)
-            await redis.expire(channel, 604800)
-    except Exception as e:
-        logger.warning(f"Warning: Failed to write observations to Redis: {str(e)}")
-        # Don't raise - observations are already created in DB
+    await publish_observations(new_observations)
 
     return new_observations
 
@@ -1,13 +1,16 @@
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from contextlib import asynccontextmanager
 from app.database import init_engine, init_db
 from app.routers import systems, deployments, procedures, features_of_interest, observed_properties, datastreams, observations, admin, forecasts
 from app.routers.auth import router as auth_router
+from app.auth.dependencies import require_scope
 from app.rate_limit import limiter
-from app.middlewares import CorrelationIdMiddleware, RequestLoggingMiddleware
+from app.middlewares import CorrelationIdMiddleware, RequestLoggingMiddleware, RequestDecompressionMiddleware
 from slowapi.errors import RateLimitExceeded
 from slowapi import _rate_limit_exceeded_handler
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from dotenv import load_dotenv
 
 # Load .env
@@ -161,6 +164,9 @@ app.add_middleware(
 )
 
 # Add middleware (order matters - add in reverse order of execution)
+# gzip responses for clients that accept it; compressed request bodies are decoded before routing
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1000")))
+app.add_middleware(RequestDecompressionMiddleware)
 app.add_middleware(RequestLoggingMiddleware)
 app.add_middleware(CorrelationIdMiddleware)
 
@@ -202,3 +208,9 @@ def health_check():
         "version": "0.1.0"
     }
 
+
+@app.get("/metrics", tags=["Health"], dependencies=[Depends(require_scope("admin:read"))])
+def metrics():
+    """Prometheus metrics (text exposition format). Requires the admin:read scope."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
@@ -0,0 +1,15 @@
+"""
+Prometheus metrics for the API, served on GET /metrics
+"""
+from prometheus_client import Counter, Histogram
+
+STREAM_ENTRIES = Counter(
+    "api_stream_entries_total",
+    "Observations written to Redis datastream streams",
+    ["outcome"],  # published / failed
+)
+STREAM_PUBLISH_SECONDS = Histogram(
+    "api_stream_publish_duration_seconds",
+    "Latency of one Redis stream pipeline (all stream writes of an observation request)",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
@@ -6,15 +6,28 @@ Provides:
 - Request/response logging
 - Performance metrics
 - Context binding for downstream operations
+- Transparent decompression of gzip/zstd request bodies
 """
 
+import os
 import uuid
 import time
+import zlib
 from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
+from starlette.types import ASGIApp, Receive, Scope, Send
 from logger.logging_config import set_correlation_id, set_request_id
 
+try:
+    import zstandard
+except ImportError:  # zstd bodies are refused with 415 without it
+    zstandard = None
+
+# Upper bound for a decompressed request body (guards against decompression bombs)
+MAX_DECOMPRESSED_BODY_BYTES = int(os.getenv("MAX_DECOMPRESSED_BODY_BYTES", str(10 * 1024 * 1024)))
+
 
 class CorrelationIdMiddleware(BaseHTTPMiddleware):
     """
@@ -108,3 +121,102 @@ class RequestLoggingMiddleware(BaseHTTPMiddleware):
         )
         
         return response
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def _gunzip(body: bytes, max_size: int) -> bytes:
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = decoder.decompress(body, max_size + 1)
+    if len(data) > max_size or decoder.unconsumed_tail:
+        raise BodyTooLarge()
+    if not decoder.eof:
+        raise ValueError("truncated gzip body")
+    return data
+
+
+def _unzstd(body: bytes, max_size: int) -> bytes:
+    # A body may hold several concatenated frames (e.g. a streaming compressor); decode them all
+    chunks, size = [], 0
+    with zstandard.ZstdDecompressor().stream_reader(body, read_across_frames=True) as reader:
+        while size <= max_size:
+            chunk = reader.read(max_size + 1 - size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+    if size > max_size:
+        raise BodyTooLarge()
+    return b"".join(chunks)
+
+
+class RequestDecompressionMiddleware:
+    """
+    ASGI middleware that decompresses request bodies sent with
+    ``Content-Encoding: gzip`` (or ``zstd`` when the zstandard package is installed).
+
+    - Routes see a plain body; Content-Encoding is dropped and Content-Length fixed
+    - Bodies larger than ``max_size`` once decompressed are refused with 413
+    - Corrupt bodies get 400, unsupported encodings 415
+    """
+
+    def __init__(self, app: ASGIApp, max_size: int = MAX_DECOMPRESSED_BODY_BYTES):
+        self.app = app
+        self.max_size = max_size
+        self.decoders = {"gzip": _gunzip}
+        if zstandard is not None:
+            self.decoders["zstd"] = _unzstd
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = Headers(scope=scope).get("content-encoding", "").strip().lower()
+        if encoding in ("", "identity"):
+            await self.app(scope, receive, send)
+            return
+        if encoding not in self.decoders:
+            response = JSONResponse({"detail": f"Unsupported Content-Encoding: {encoding}"}, status_code=415)
+            await response(scope, receive, send)
+            return
+
+        # The compressed body can't be larger than the decompressed limit either
+        chunks, received, more_body = [], 0, True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            received += len(chunk)
+            if received > self.max_size:
+                await JSONResponse({"detail": "Request body too large"}, status_code=413)(scope, receive, send)
+                return
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+
+        try:
+            body = self.decoders[encoding](b"".join(chunks), self.max_size)
+        except BodyTooLarge:
+            await JSONResponse({"detail": "Request body too large"}, status_code=413)(scope, receive, send)
+            return
+        except Exception:
+            await JSONResponse({"detail": f"Invalid {encoding} request body"}, status_code=400)(scope, receive, send)
+            return
+
+        headers = [
+            (name, value) for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length")
+        ]
+        headers.append((b"content-length", str(len(body)).encode()))
+        delivered = False
+
+        async def receive_decompressed():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(dict(scope, headers=headers), receive_decompressed, send)
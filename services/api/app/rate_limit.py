@@ -1,11 +1,16 @@
 from slowapi import Limiter
 from slowapi.util import get_remote_address
-from fastapi import Request
+from fastapi import HTTPException, Request, status
+import asyncio
+import math
+import time
 import uuid
 from jose import jwt
 import os
 
 INTERNAL_CLIENTS = {"jobs-worker", "ingestion-worker", "notifier"}
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "8"))  # Bulk inserts running at once (0 = unlimited)
+BULK_QUEUE_TIMEOUT = float(os.getenv("BULK_QUEUE_TIMEOUT", "2"))  # Seconds a bulk request may wait for a slot
 
 def get_rate_limit_key(request: Request) -> str:
     auth_header = request.headers.get("authorization", "")
@@ -21,4 +26,49 @@ def get_rate_limit_key(request: Request) -> str:
             pass
     return f"ip:{get_remote_address(request)}"
 
-limiter = Limiter(key_func=get_rate_limit_key)
\ No newline at end of file
+limiter = Limiter(key_func=get_rate_limit_key)
+
+class BulkAdmission:
+    """
+    Bounds concurrent bulk inserts so an ingestion burst cannot exhaust the database pool.
+
+    Used as a route dependency: a request waits up to ``queue_timeout`` seconds for a
+    slot, then is shed with 503 and a Retry-After estimated from how long the queue
+    ahead of it takes to drain. Internal clients are exempt from the per-client rate
+    limits, so this is their overload signal.
+    """
+
+    def __init__(self, max_concurrency: int = BULK_MAX_CONCURRENCY, queue_timeout: float = BULK_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+        self.waiting = 0
+        self.avg_duration = 0.0  # EWMA seconds per admitted bulk request
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil((self.waiting + 1) * self.avg_duration / max(self.max_concurrency, 1)))
+
+    async def __call__(self):
+        if self.semaphore is None:
+            yield
+            return
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Bulk ingestion is at capacity, retry later",
+                headers={"Retry-After": str(self.retry_after())},
+            )
+        finally:
+            self.waiting -= 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+            self.avg_duration = 0.8 * self.avg_duration + 0.2 * (time.monotonic() - started)
+
+
+bulk_admission = BulkAdmission()
\ No newline at end of file
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, Query, status, Request
+from fastapi import APIRouter, Depends, Query, status, Request, Header, Response
 from schemas.observation_schemas import ObservationRead, ObservationUpdate
 from app.database import get_db
 from app.filters import parse_time_param
@@ -6,7 +6,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import desc
 from typing import List, Optional
 from uuid import UUID
-from app.rate_limit import limiter
+from app.rate_limit import limiter, bulk_admission
 from app.models import Observation
 
 from app.crud.observation import (
@@ -83,11 +83,18 @@ async def create_a_new_observation(observation_in: ObservationRead, db: AsyncSes
     return ObservationRead(**created_observation_db.__dict__)
 
 
-@router.post("/bulk", summary="Create Observations in Bulk", status_code=status.HTTP_201_CREATED, response_model=List[ObservationRead], dependencies=[Depends(require_scope("observations:write"))])
-async def create_observations_in_bulk(observations_in: List[ObservationRead], db: AsyncSession = Depends(get_db)):
+@router.post("/bulk", summary="Create Observations in Bulk", status_code=status.HTTP_201_CREATED, response_model=List[ObservationRead], dependencies=[Depends(require_scope("observations:write")), Depends(bulk_admission)])
+async def create_observations_in_bulk(
+    observations_in: List[ObservationRead],
+    db: AsyncSession = Depends(get_db),
+    prefer: Optional[str] = Header(None, description="'return=minimal' for an empty 201 instead of the created observations"),
+):
     created_observations_db = await create_observations_bulk(db=db, observations_in=observations_in)
 
-    return [ObservationRead(**obs.__dict__) for obs in created_observations_db]
+    if prefer and "return=minimal" in prefer.lower():
+        # RFC 7240: the caller does not need the created rows echoed back
+        return Response(status_code=status.HTTP_201_CREATED, headers={"Preference-Applied": "return=minimal"})
+    return [ObservationRead.model_validate(obs, from_attributes=True) for obs in created_observations_db]
 
 
 @router.put("/{observation_id}", summary="Update Observation", status_code=status.HTTP_200_OK, response_model=ObservationRead, dependencies=[Depends(require_scope("observations:write"))])
@@ -25,6 +25,7 @@ ALL_REQUIRED_SCOPES = [
     "datastreams:write",
     "properties:read",
     "properties:write",
+    "admin:read",
 ]
 
 
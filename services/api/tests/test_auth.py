@@ -130,6 +130,11 @@ class TestAuthenticationRequired:
         response = await client_expired_token.post("/api/v1/systems/", json=payload)
         assert response.status_code == 401
 
+    async def test_metrics_without_token_returns_401(self, client_no_auth):
+        """/metrics is not public."""
+        response = await client_no_auth.get("/metrics")
+        assert response.status_code == 401
+
 
 class TestScopeValidation:
     """Test that endpoints enforce scope validation."""
@@ -155,6 +160,11 @@ class TestScopeValidation:
         response = await client_insufficient_scope.get("/api/v1/deployments/")
         assert response.status_code == 403
 
+    async def test_metrics_without_admin_scope_returns_403(self, client_insufficient_scope):
+        """/metrics requires admin:read."""
+        response = await client_insufficient_scope.get("/metrics")
+        assert response.status_code == 403
+
 
 class TestValidTokenAllowsAccess:
     """Test that valid tokens with correct scopes allow access."""
@@ -1,10 +1,16 @@
+import gzip
+import json
 import pytest
+import zstandard
 from uuid import uuid4
 from datetime import datetime, timezone, timedelta
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 import asyncio
 from urllib.parse import quote
 
+from app.middlewares import MAX_DECOMPRESSED_BODY_BYTES
+from app.rate_limit import bulk_admission
+
 pytestmark = pytest.mark.asyncio
 
 
@@ -15,6 +21,8 @@ def mock_redis():
     """Mock Redis client so tests don't require a running Redis instance."""
     mock = AsyncMock()
     mock.xadd = AsyncMock(return_value="1234567890-0")
+    # Stream writes are queued on a pipeline and sent with one execute()
+    mock.pipeline = MagicMock(return_value=MagicMock(execute=AsyncMock(return_value=[])))
     with patch("app.crud.observation.get_redis_client", return_value=mock):
         yield mock
 
@@ -217,6 +225,159 @@ async def test_create_observations_bulk_different_datastreams(client):
     assert len(response.json()) == 2
 
 
+async def test_create_observations_bulk_gzip_body(client):
+    system_id = await create_system(client)
+    ds_id = await create_datastream(client, system_id)
+
+    payload = [observation_payload(ds_id, result_numeric=i, result_time=iso_offset(i)) for i in range(3)]
+    body = gzip.compress(json.dumps(payload).encode())
+    response = await client.post(
+        "/api/v1/observations/bulk",
+        content=body,
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 201
+    assert len(response.json()) == 3
+
+
+async def test_create_observations_bulk_zstd_multiframe_body(client):
+    system_id = await create_system(client)
+    ds_id = await create_datastream(client, system_id)
+
+    payload = json.dumps([observation_payload(ds_id, result_numeric=i, result_time=iso_offset(i)) for i in range(3)]).encode()
+    compressor = zstandard.ZstdCompressor()
+    # Two concatenated frames, as a streaming compressor may send: both must be decoded
+    body = compressor.compress(payload[:20]) + compressor.compress(payload[20:])
+    response = await client.post(
+        "/api/v1/observations/bulk",
+        content=body,
+        headers={"Content-Type": "application/json", "Content-Encoding": "zstd"},
+    )
+    assert response.status_code == 201
+    assert len(response.json()) == 3
+
+
+async def test_create_observations_bulk_gzip_bomb_rejected(client):
+    body = gzip.compress(b" " * (MAX_DECOMPRESSED_BODY_BYTES + 1))
+    response = await client.post(
+        "/api/v1/observations/bulk",
+        content=body,
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 413
+
+
+async def test_create_observations_bulk_corrupt_gzip(client):
+    response = await client.post(
+        "/api/v1/observations/bulk",
+        content=b"not gzip",
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 400
+
+
+async def test_create_observations_bulk_return_minimal(client):
+    system_id = await create_system(client)
+    ds_id = await create_datastream(client, system_id)
+
+    response = await client.post(
+        "/api/v1/observations/bulk",
+        json=[observation_payload(ds_id, result_numeric=1.0)],
+        headers={"Prefer": "return=minimal"},
+    )
+    assert response.status_code == 201
+    assert response.content == b""
+    assert response.headers["Preference-Applied"] == "return=minimal"
+
+
+async def test_create_observations_bulk_shed_when_saturated(client):
+    system_id = await create_system(client)
+    ds_id = await create_datastream(client, system_id)
+
+    # Every slot taken: the request waits out the queue timeout and is shed
+    with patch.object(bulk_admission, "semaphore", asyncio.Semaphore(0)), \
+            patch.object(bulk_admission, "queue_timeout", 0.01):
+        response = await client.post("/api/v1/observations/bulk", json=[observation_payload(ds_id)])
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+async def test_create_observations_bulk_returns_inserted_rows(client):
+    system_id = await create_system(client)
+    ds_id = await create_datastream(client, system_id)
+    own_id = str(uuid4())
+
+    payload = [
+        observation_payload(ds_id, id=own_id, result_numeric=1.0),
+        observation_payload(ds_id, result_numeric=None, result_text="on", parameters=None),
+    ]
+    response = await client.post("/api/v1/observations/bulk", json=payload)
+    assert response.status_code == 201
+    first, second = response.json()
+    assert first["id"] == own_id
+    assert first["result_numeric"] == 1.0
+    assert first["parameters"] == {"quality": "good"}
+    assert second["id"] is not None
+    assert second["result_text"] == "on"
+
+    # Readable like any other observation
+    response = await client.get(f"/api/v1/observations/{second['id']}")
+    assert response.status_code == 200
+    assert response.json()["result_text"] == "on"
+
+
+async def test_create_observations_bulk_spans_statements(client):
+    system_id = await create_system(client)
+    ds_id = await create_datastream(client, system_id)
+
+    payload = [
+        observation_payload(ds_id, result_numeric=i, result_time=iso_offset(i))
+        for i in range(5)
+    ]
+    # Several multi-row INSERTs, one transaction, rows returned in request order
+    with patch("app.crud.observation.BULK_INSERT_CHUNK_SIZE", 2):
+        response = await client.post("/api/v1/observations/bulk", json=payload)
+    assert response.status_code == 201
+    assert [obs["result_numeric"] for obs in response.json()] == [0, 1, 2, 3, 4]
+
+
+async def test_create_observations_bulk_publishes_in_one_pipeline(client, mock_redis):
+    system_id = await create_system(client)
+    ds_id_1 = await create_datastream(client, system_id)
+    ds_id_2 = await create_datastream(client, system_id)
+
+    payload = [
+        observation_payload(ds_id_1, result_numeric=1.0),
+        observation_payload(ds_id_1, result_numeric=2.0),
+        observation_payload(ds_id_2, result_numeric=3.0),
+    ]
+    response = await client.post("/api/v1/observations/bulk", json=payload)
+    assert response.status_code == 201
+
+    pipe = mock_redis.pipeline.return_value
+    assert pipe.xadd.call_count == 3
+    # One EXPIRE per datastream, one round trip for the whole batch
+    assert sorted(c.args[0] for c in pipe.expire.call_args_list) == sorted([f"datastream:{ds_id_1}", f"datastream:{ds_id_2}"])
+    pipe.execute.assert_awaited_once()
+    mock_redis.xadd.assert_not_called()
+
+    response = await client.get("/metrics")  # The test token carries admin:read
+    assert response.status_code == 200
+    metrics = response.text
+    assert 'api_stream_entries_total{outcome="published"}' in metrics
+    assert "api_stream_publish_duration_seconds_count" in metrics
+
+
+async def test_create_observations_bulk_survives_redis_failure(client, mock_redis):
+    system_id = await create_system(client)
+    ds_id = await create_datastream(client, system_id)
+    mock_redis.pipeline.return_value.execute.side_effect = ConnectionError("redis down")
+
+    response = await client.post("/api/v1/observations/bulk", json=[observation_payload(ds_id)])
+    assert response.status_code == 201
+    assert len(response.json()) == 1
+
+
 # ── read ──────────────────────────────────────────────────────────────────────
 
 async def test_get_observation(client):
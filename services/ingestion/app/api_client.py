@@ -0,0 +1,200 @@
+"""
+Long-lived HTTP client for talking to the telemetry API
+
+Owns a single pooled httpx.AsyncClient for the lifetime of the worker so that
+bulk posts and token refreshes reuse keep-alive connections instead of paying
+TCP (and TLS) setup on every batch. Connection reuse is tracked through the
+httpcore trace extension and reported in the logs.
+
+JSON bodies can be sent gzip- or zstd-compressed (API_COMPRESSION); the API
+decompresses them transparently.
+"""
+import gzip
+import json
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+import httpx
+
+try:
+    import zstandard
+except ImportError:  # Only needed with API_COMPRESSION=zstd
+    zstandard = None
+from shared.logger.logging_config import setup_logging_json, setup_logging_colored
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+if LOG_FORMAT == "colored":
+    logger = setup_logging_colored("home-telemetry-ingestion-api-client")
+else:
+    logger = setup_logging_json("home-telemetry-ingestion-api-client")
+
+REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "30"))
+API_HTTP2 = os.getenv("API_HTTP2", "false").lower() == "true"
+API_MAX_CONNECTIONS = int(os.getenv("API_MAX_CONNECTIONS", "10"))
+API_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("API_MAX_KEEPALIVE_CONNECTIONS", "5"))
+API_KEEPALIVE_EXPIRY = float(os.getenv("API_KEEPALIVE_EXPIRY", "60"))
+API_STATS_LOG_INTERVAL = int(os.getenv("API_STATS_LOG_INTERVAL", "60"))  # seconds
+API_COMPRESSION = os.getenv("API_COMPRESSION", "none").lower()  # Request bodies: "none", "gzip" or "zstd"
+API_COMPRESSION_LEVEL = int(os.getenv("API_COMPRESSION_LEVEL", "0"))  # 0 = codec default (gzip 6, zstd 3)
+API_COMPRESSION_MIN_BYTES = int(os.getenv("API_COMPRESSION_MIN_BYTES", "1024"))  # Smaller bodies are sent as-is
+COMPRESSION_CODECS = ("none", "gzip", "zstd")
+
+
+def _resolve_compression(codec: str) -> str:
+    if codec not in COMPRESSION_CODECS:
+        logger.error(f"Unknown API_COMPRESSION {codec!r} - sending uncompressed bodies")
+        return "none"
+    if codec == "zstd" and zstandard is None:
+        logger.warning("API_COMPRESSION=zstd needs the zstandard package - falling back to gzip")
+        return "gzip"
+    return codec
+
+
+class ConnectionStats:
+    """Counters for requests sent and TCP connections opened by the pool"""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.connections_opened = 0
+        self.body_bytes = 0  # JSON body bytes before compression
+        self.wire_bytes = 0  # Body bytes actually sent
+
+    @property
+    def connections_reused(self) -> int:
+        return max(self.requests - self.connections_opened, 0)
+
+    @property
+    def reuse_ratio(self) -> float:
+        return self.connections_reused / self.requests if self.requests else 0.0
+
+    @property
+    def compression_ratio(self) -> float:
+        return self.body_bytes / self.wire_bytes if self.wire_bytes else 1.0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "connections_reused": self.connections_reused,
+            "reuse_ratio": round(self.reuse_ratio, 3),
+            "compression_ratio": round(self.compression_ratio, 2),
+        }
+
+
+class ApiClient:
+    """Pooled, keep-alive HTTP client shared by every API call the worker makes"""
+
+    def __init__(
+        self,
+        timeout: float = REQUEST_TIMEOUT,
+        http2: bool = API_HTTP2,
+        max_connections: int = API_MAX_CONNECTIONS,
+        max_keepalive_connections: int = API_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = API_KEEPALIVE_EXPIRY,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        compression: str = API_COMPRESSION,
+        compression_level: int = API_COMPRESSION_LEVEL,
+        compression_min_bytes: int = API_COMPRESSION_MIN_BYTES,
+    ):
+        self.timeout = timeout
+        self.http2 = http2
+        self.compression = _resolve_compression(compression)
+        self.compression_level = compression_level
+        self.compression_min_bytes = compression_min_bytes
+        self._zstd = (
+            zstandard.ZstdCompressor(level=compression_level or 3) if self.compression == "zstd" else None
+        )
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.transport = transport  # Injectable for tests and benchmarks
+        self.client: Optional[httpx.AsyncClient] = None
+        self.stats = ConnectionStats()
+        self._last_stats_log = time.monotonic()
+
+    async def start(self):
+        """Create the underlying connection pool"""
+        if self.client is not None:
+            return
+        self.client = httpx.AsyncClient(
+            timeout=self.timeout,
+            http2=self.http2,
+            limits=self.limits,
+            transport=self.transport,
+        )
+        logger.info(
+            f"API client started (http2={self.http2}, max_connections={self.limits.max_connections}, "
+            f"keepalive={self.limits.max_keepalive_connections}/{self.limits.keepalive_expiry}s, "
+            f"compression={self.compression})"
+        )
+
+    async def close(self):
+        """Close the connection pool and log final reuse counters"""
+        if self.client is None:
+            return
+        await self.client.aclose()
+        self.client = None
+        logger.info("API client closed", extra=self.stats.as_dict())
+
+    async def _trace(self, event_name: str, info: dict):
+        """httpcore trace hook - counts freshly opened TCP connections"""
+        if event_name == "connection.connect_tcp.complete":
+            self.stats.connections_opened += 1
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request over the pooled client, starting it lazily if needed"""
+        if self.client is None:
+            await self.start()
+        extensions = kwargs.pop("extensions", None) or {}
+        extensions.setdefault("trace", self._trace)
+        self.stats.requests += 1
+        response = await self.client.request(method, url, extensions=extensions, **kwargs)
+        self._maybe_log_stats()
+        return response
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def encode_json(self, payload: Any) -> Tuple[bytes, Dict[str, str]]:
+        """Serialize a JSON body and compress it if large enough; returns (body, headers)"""
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        headers = {"Content-Type": "application/json"}
+        self.stats.body_bytes += len(body)
+        if self.compression != "none" and len(body) >= self.compression_min_bytes:
+            if self._zstd is not None:
+                body = self._zstd.compress(body)
+            else:
+                body = gzip.compress(body, compresslevel=self.compression_level or 6, mtime=0)
+            headers["Content-Encoding"] = self.compression
+        self.stats.wire_bytes += len(body)
+        return body, headers
+
+    def fall_back_compression(self) -> bool:
+        """
+        Step down to a codec the API accepts after it answered 415 (zstd → gzip → none).
+
+        Returns False when bodies are already sent uncompressed.
+        """
+        if self.compression == "none":
+            return False
+        fallback = "gzip" if self.compression == "zstd" else "none"
+        logger.warning(f"API refused {self.compression} request bodies (415) - falling back to {fallback}")
+        self.compression = fallback
+        self._zstd = None
+        return True
+
+    async def post_json(self, url: str, payload: Any, headers: Optional[Dict[str, str]] = None, **kwargs) -> httpx.Response:
+        """POST a JSON body, compressed per API_COMPRESSION"""
+        body, body_headers = self.encode_json(payload)
+        return await self.post(url, content=body, headers={**body_headers, **(headers or {})}, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    def _maybe_log_stats(self):
+        now = time.monotonic()
+        if now - self._last_stats_log >= API_STATS_LOG_INTERVAL:
+            self._last_stats_log = now
+            logger.info("API connection pool stats", extra=self.stats.as_dict())
@@ -0,0 +1,94 @@
+"""
+Adaptive batch sizing for the ingestion queue
+
+Tracks the message arrival rate and the time the handler takes per batch
+(dominated by the bulk API call) as exponentially weighted moving averages.
+The target batch size is the number of messages expected to arrive while one
+batch is being submitted: under load batches grow towards BATCH_SIZE for
+throughput, and for sparse traffic they shrink towards MIN_BATCH_SIZE so a
+lone reading is flushed straight away instead of waiting out BATCH_TIMEOUT.
+"""
+import math
+import os
+import time
+from typing import Optional
+
+ADAPTIVE_BATCHING = os.getenv("ADAPTIVE_BATCHING", "false").lower() == "true"
+MIN_BATCH_SIZE = int(os.getenv("MIN_BATCH_SIZE", "1"))
+ADAPTIVE_SMOOTHING = float(os.getenv("ADAPTIVE_SMOOTHING", "0.2"))  # EWMA weight of the newest sample
+
+
+class AdaptiveBatchSizer:
+    """Picks the batch size and flush deadline from observed arrival rate and batch latency"""
+
+    def __init__(
+        self,
+        max_size: int,
+        max_wait: float,
+        min_size: int = MIN_BATCH_SIZE,
+        adaptive: bool = ADAPTIVE_BATCHING,
+        smoothing: float = ADAPTIVE_SMOOTHING,
+    ):
+        self.max_size = max(1, max_size)
+        self.min_size = max(1, min(min_size, self.max_size))
+        self.max_wait_limit = max_wait
+        self.adaptive = adaptive
+        self.smoothing = smoothing
+        self.arrival_gap: Optional[float] = None  # EWMA seconds between messages
+        self.batch_latency: Optional[float] = None  # EWMA seconds to handle one batch
+        self._last_arrival: Optional[float] = None
+
+    def _ewma(self, current: Optional[float], sample: float) -> float:
+        if current is None:
+            return sample
+        return self.smoothing * sample + (1 - self.smoothing) * current
+
+    def record_arrival(self, now: Optional[float] = None):
+        """Record one message arrival"""
+        now = time.monotonic() if now is None else now
+        if self._last_arrival is not None:
+            self.arrival_gap = self._ewma(self.arrival_gap, max(now - self._last_arrival, 0.0))
+        self._last_arrival = now
+
+    def record_batch(self, latency: float):
+        """Record how long one batch took to handle"""
+        self.batch_latency = self._ewma(self.batch_latency, max(latency, 0.0))
+
+    @property
+    def arrival_rate(self) -> float:
+        """Messages per second (0 until two messages have been seen)"""
+        if self.arrival_gap is None:
+            return 0.0
+        if self.arrival_gap == 0:
+            return math.inf
+        return 1.0 / self.arrival_gap
+
+    @property
+    def batch_size(self) -> int:
+        """Messages to collect before flushing"""
+        if not self.adaptive:
+            return self.max_size
+        if self.batch_latency is None:
+            return self.min_size
+        expected = self.arrival_rate * self.batch_latency
+        if math.isinf(expected):
+            return self.max_size
+        return max(self.min_size, min(self.max_size, math.ceil(expected)))
+
+    @property
+    def max_wait(self) -> float:
+        """Seconds the oldest message in a batch may wait before the batch is flushed"""
+        if not self.adaptive or self.arrival_gap is None or self.batch_latency is None:
+            return self.max_wait_limit
+        # Twice the expected time to fill the batch at the current rate, but never less than
+        # one submission takes (lingering that long costs no throughput)
+        return min(self.max_wait_limit, max(2 * self.batch_size * self.arrival_gap, self.batch_latency))
+
+    def as_dict(self) -> dict:
+        return {
+            "adaptive": self.adaptive,
+            "batch_size": self.batch_size,
+            "max_wait": round(self.max_wait, 3),
+            "arrival_rate": round(self.arrival_rate, 2) if not math.isinf(self.arrival_rate) else None,
+            "batch_latency": round(self.batch_latency, 3) if self.batch_latency is not None else None,
+        }
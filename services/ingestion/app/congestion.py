@@ -0,0 +1,156 @@
+"""
+AIMD congestion control for bulk API submissions
+
+The controller keeps one congestion window, measured in messages, that covers
+both pipeline knobs: the window is split into full batches (in-flight batch
+limit) and, once it is smaller than one batch, into a smaller batch size. Every
+successful request grows the window additively (about AIMD_INCREASE messages
+per round of requests); a congestion signal - a 429/503, a timeout or other
+failure, or a request slower than the latency target - halves it. Only one
+decrease is applied per round: requests that were already in flight when the
+window was cut do not cut it again.
+
+A Retry-After from the API pauses every sender until it has passed, instead of
+each batch backing off on its own.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from shared.logger.logging_config import setup_logging_json, setup_logging_colored
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+if LOG_FORMAT == "colored":
+    logger = setup_logging_colored("home-telemetry-ingestion-congestion")
+else:
+    logger = setup_logging_json("home-telemetry-ingestion-congestion")
+
+AIMD_ENABLED = os.getenv("AIMD_ENABLED", "false").lower() == "true"
+AIMD_MIN_BATCH_SIZE = int(os.getenv("AIMD_MIN_BATCH_SIZE", "10"))  # Smallest batch the window shrinks to
+AIMD_INCREASE = int(os.getenv("AIMD_INCREASE", "0"))  # Messages added per round (0 = a tenth of BATCH_SIZE)
+AIMD_DECREASE = float(os.getenv("AIMD_DECREASE", "0.5"))  # Window multiplier on congestion
+AIMD_LATENCY_TARGET = float(os.getenv("AIMD_LATENCY_TARGET", "0"))  # Seconds per request (0 = auto)
+AIMD_LATENCY_TOLERANCE = float(os.getenv("AIMD_LATENCY_TOLERANCE", "3"))  # Auto target: multiple of the baseline
+AIMD_BASELINE_SAMPLES = 100  # Auto target: baseline is the fastest of this many recent requests
+RETRY_AFTER_MAX = float(os.getenv("RETRY_AFTER_MAX", "120"))  # Longest Retry-After honored (seconds)
+
+
+def parse_retry_after(value: Optional[str], now: Optional[datetime] = None) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date), capped at RETRY_AFTER_MAX"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if at.tzinfo is None:
+            at = at.replace(tzinfo=timezone.utc)
+        seconds = (at - (now or datetime.now(timezone.utc))).total_seconds()
+    if math.isnan(seconds):
+        return None
+    return min(max(seconds, 0.0), RETRY_AFTER_MAX)
+
+
+class AimdController:
+    """Additive-increase/multiplicative-decrease window over in-flight batches and batch size"""
+
+    def __init__(
+        self,
+        max_inflight: int,
+        max_batch_size: int,
+        min_batch_size: int = AIMD_MIN_BATCH_SIZE,
+        increase: int = AIMD_INCREASE,
+        decrease: float = AIMD_DECREASE,
+        latency_target: float = AIMD_LATENCY_TARGET,
+        latency_tolerance: float = AIMD_LATENCY_TOLERANCE,
+    ):
+        self.max_batch_size = max(1, max_batch_size)
+        self.min_batch_size = max(1, min(min_batch_size, self.max_batch_size))
+        self.max_window = max(1, max_inflight) * self.max_batch_size
+        self.increase = increase if increase > 0 else max(1, self.max_batch_size // 10)
+        self.decrease = min(max(decrease, 0.1), 0.9)
+        self.latency_target = latency_target
+        self.latency_tolerance = latency_tolerance
+        self.window = float(self.max_batch_size)  # Start with one full batch in flight
+        self.resume_at = 0.0  # Monotonic time before which no request is sent (Retry-After)
+        self.latencies = deque(maxlen=AIMD_BASELINE_SAMPLES)
+        self.decreases = 0
+        self._sent = 0  # Requests started
+        self._recovery_point = 0  # Requests started before this one were in flight at the last decrease
+
+    @property
+    def inflight_limit(self) -> int:
+        """Batches that may be submitted concurrently"""
+        return max(1, int(self.window // self.max_batch_size))
+
+    @property
+    def batch_size(self) -> int:
+        """Messages per batch"""
+        return max(self.min_batch_size, min(self.max_batch_size, int(self.window)))
+
+    @property
+    def target_latency(self) -> Optional[float]:
+        """Request latency above which the API counts as congested (None until a baseline exists)"""
+        if self.latency_target > 0:
+            return self.latency_target
+        if len(self.latencies) < 10:
+            return None
+        return min(self.latencies) * self.latency_tolerance
+
+    def begin(self) -> int:
+        """Register a request about to be sent; pass the ticket to on_success/on_congestion"""
+        self._sent += 1
+        return self._sent
+
+    async def wait_ready(self):
+        """Sleep out a pause requested by the API's Retry-After"""
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def on_success(self, ticket: int, latency: float):
+        """A request was accepted after ``latency`` seconds"""
+        target = self.target_latency
+        self.latencies.append(latency)
+        if target is not None and latency > target:
+            self._decrease(ticket, f"latency {latency:.3f}s above target {target:.3f}s")
+            return
+        # Roughly ``increase`` messages per round: each request adds its share of the window
+        self.window = min(self.max_window, self.window + self.increase * self.batch_size / self.window)
+
+    def on_congestion(self, ticket: int, reason: str, retry_after: Optional[float] = None):
+        """A request failed with an overload signal (429/503, timeout, connection error)"""
+        if retry_after:
+            self.resume_at = max(self.resume_at, time.monotonic() + retry_after)
+        self._decrease(ticket, reason)
+
+    def _decrease(self, ticket: int, reason: str):
+        if ticket <= self._recovery_point:
+            return  # Sent before the last decrease - that one already accounted for this round
+        before = self.window
+        self.window = max(float(self.min_batch_size), self.window * self.decrease)
+        self._recovery_point = self._sent
+        self.decreases += 1
+        logger.warning(
+            f"API congestion ({reason}) - window {before:.0f} → {self.window:.0f} messages "
+            f"({self.inflight_limit} in flight, batch size {self.batch_size})"
+        )
+
+    def as_dict(self) -> dict:
+        target = self.target_latency
+        return {
+            "window": round(self.window, 1),
+            "inflight_limit": self.inflight_limit,
+            "batch_size": self.batch_size,
+            "target_latency": round(target, 3) if target is not None else None,
+            "decreases": self.decreases,
+            "paused_for": round(max(self.resume_at - time.monotonic(), 0.0), 3),
+        }
@@ -0,0 +1,158 @@
+"""
+Direct-to-TimescaleDB sink for trusted deployments
+
+Writes observation rows straight into the ``observations`` hypertable with one
+binary COPY per batch, skipping the HTTP hop, token validation, pydantic
+re-validation and ORM hydration of ``POST /observations/bulk``. Afterwards every
+row is published to its ``datastream:{uuid}`` Redis stream, the same way
+``create_observations_bulk`` in the API does, so WebSocket clients and the
+notifier see no difference.
+
+Rows the database refuses (bad values, unknown datastream) raise RowsRejected,
+which the worker handles like a 400/422 from the API.
+"""
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from shared.logger.logging_config import setup_logging_json, setup_logging_colored
+from shared.streams.observation_streams import STREAM_MAXLEN, STREAM_TTL, stream_entry, stream_key
+
+try:
+    import asyncpg
+except ImportError:  # Only needed with INGESTION_SINK=timescale
+    asyncpg = None
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+if LOG_FORMAT == "colored":
+    logger = setup_logging_colored("home-telemetry-ingestion-db-sink")
+else:
+    logger = setup_logging_json("home-telemetry-ingestion-db-sink")
+
+INGESTION_SINK = os.getenv("INGESTION_SINK", "api").lower()  # "api" (POST /observations/bulk) or "timescale" (COPY)
+DATABASE_HOST = os.getenv("DATABASE_HOST", "home-telemetry-timescaledb")
+DATABASE_PORT = int(os.getenv("DATABASE_PORT", "5432"))
+DATABASE_NAME = os.getenv("DATABASE_NAME", "postgres")
+DATABASE_USER = os.getenv("DATABASE_USER", "home_telemetry")
+DATABASE_PASS = os.getenv("DATABASE_PASS", "")
+DB_SINK_POOL_SIZE = int(os.getenv("DB_SINK_POOL_SIZE", "4"))
+DB_SINK_TIMEOUT = float(os.getenv("DB_SINK_TIMEOUT", "30"))  # seconds per COPY
+
+OBSERVATIONS_TABLE = "observations"
+COLUMNS = (
+    "id", "datastream_id", "result_time", "result_complex",
+    "result_numeric", "result_text", "result_boolean", "parameters",
+)
+
+
+class RowsRejected(Exception):
+    """The database refused the rows themselves (retrying the same rows cannot succeed)"""
+
+    def __init__(self, code: str, detail: str):
+        super().__init__(f"{code}: {detail}")
+        self.code = code
+        self.detail = detail
+
+
+def _json(value: Any) -> Optional[str]:
+    # asyncpg sends json columns as text
+    return json.dumps(value) if value is not None else None
+
+
+def to_record(row: Dict[str, Any]) -> Tuple:
+    """One JSON-ready observation row as a COPY record in COLUMNS order"""
+    return (
+        uuid.uuid4(),
+        uuid.UUID(row["datastream_id"]),
+        datetime.fromisoformat(row["result_time"]),
+        _json(row.get("result_complex")),
+        row.get("result_numeric"),
+        row.get("result_text"),
+        row.get("result_boolean"),
+        _json(row.get("parameters")),
+    )
+
+
+def record_stream_entry(record: Tuple) -> Dict[str, str]:
+    """Redis stream fields for one inserted COPY record (its json columns are text)"""
+    obs_id, ds_id, result_time, result_complex, result_numeric, result_text, result_boolean, parameters = record
+    return stream_entry(
+        obs_id, ds_id, result_time,
+        json.loads(result_complex) if result_complex is not None else None,
+        result_numeric, result_text, result_boolean,
+        json.loads(parameters) if parameters is not None else None,
+    )
+
+
+class TimescaleSink:
+    """Bulk-loads observation rows with binary COPY and publishes them to Redis streams"""
+
+    def __init__(self, dsn: Optional[str] = None, pool_size: int = DB_SINK_POOL_SIZE, timeout: float = DB_SINK_TIMEOUT):
+        self.dsn = dsn or (
+            f"postgresql://{DATABASE_USER}:{DATABASE_PASS}@{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}"
+        )
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.pool = None
+        self.redis = None  # Set by the worker once Redis is connected
+        self.rows_written = 0
+
+    async def start(self):
+        """Open the connection pool"""
+        if self.pool is not None:
+            return
+        if asyncpg is None:
+            raise RuntimeError("INGESTION_SINK=timescale requires the asyncpg package")
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.pool_size)
+        logger.info(f"TimescaleDB sink started ({DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}, pool={self.pool_size})")
+
+    async def close(self):
+        if self.pool is None:
+            return
+        await self.pool.close()
+        self.pool = None
+        logger.info(f"TimescaleDB sink closed ({self.rows_written} rows written)")
+
+    async def write(self, rows: List[Dict[str, Any]]):
+        """
+        COPY the rows into the hypertable, then publish them to their Redis streams.
+
+        Raises RowsRejected if the rows cannot be converted or the database refuses them;
+        any other exception is a transient failure. A failed COPY writes nothing.
+        """
+        try:
+            records = [to_record(row) for row in rows]
+        except (KeyError, TypeError, ValueError) as e:
+            raise RowsRejected("invalid-row", str(e)) from e
+
+        if self.pool is None:
+            await self.start()
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.copy_records_to_table(
+                    OBSERVATIONS_TABLE, records=records, columns=COLUMNS, timeout=self.timeout,
+                )
+        except (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError) as e:
+            raise RowsRejected(e.sqlstate, str(e)) from e
+        self.rows_written += len(records)
+
+        await self.publish(records)
+
+    async def publish(self, records: List[Tuple]):
+        """XADD every record to its datastream stream in one pipeline (rows are already stored)"""
+        if self.redis is None:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            streams = set()
+            for record in records:
+                channel = stream_key(record[1])
+                pipe.xadd(channel, record_stream_entry(record), maxlen=STREAM_MAXLEN, approximate=True)
+                streams.add(channel)
+            for channel in streams:
+                pipe.expire(channel, STREAM_TTL)
+            await pipe.execute()
+        except Exception as e:
+            # Don't raise - observations are already in the database
+            logger.warning(f"Failed to publish {len(records)} observations to Redis streams: {e}")
@@ -0,0 +1,127 @@
+"""
+Per-datastream deadband / heartbeat compression
+
+Datastreams that report the same value every few seconds only need a row when
+the value moves. A datastream configured with a ``deadband`` forwards a reading
+only if it differs from the last forwarded value by more than the deadband, or
+if ``heartbeat`` seconds have passed since the last forwarded reading (so a
+flat line still shows the sensor is alive).
+
+The last forwarded value only moves once the reading behind it was submitted
+(``commit``): a reading the API never took must not become the reference that
+later readings are suppressed against.
+
+Settings come from datastream ``properties`` and are synced by the jobs service
+into each topic config as ``{"deadband": {mqtt_key: {"deadband": 0.5, "heartbeat": 300}}}``.
+Datastreams without settings pass through untouched.
+"""
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from shared.logger.logging_config import setup_logging_json, setup_logging_colored
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+if LOG_FORMAT == "colored":
+    logger = setup_logging_colored("home-telemetry-ingestion-deadband")
+else:
+    logger = setup_logging_json("home-telemetry-ingestion-deadband")
+
+DEADBAND_DEFAULT_HEARTBEAT = float(os.getenv("DEADBAND_DEFAULT_HEARTBEAT", "300"))  # seconds
+
+
+class DeadbandFilter:
+    """Drops readings that stay within their datastream's deadband until the heartbeat expires"""
+
+    def __init__(self):
+        self.settings: Dict[str, Tuple[float, float]] = {}  # datastream_id → (deadband, heartbeat)
+        self._last: Dict[str, Tuple[datetime, float]] = {}  # datastream_id → last submitted forwarded (time, value)
+        self.forwarded = 0
+        self.suppressed = 0
+
+    def configure(self, config_map: Dict[str, dict]):
+        """Load deadband settings from topic configs (last-forwarded state is kept across reloads)"""
+        settings: Dict[str, Tuple[float, float]] = {}
+        for mqtt_topic, cfg in config_map.items():
+            datastreams = cfg.get("datastreams", {})
+            for mqtt_key, spec in (cfg.get("deadband") or {}).items():
+                ds_id = datastreams.get(mqtt_key)
+                if not ds_id:
+                    continue
+                try:
+                    band = float(spec.get("deadband", 0))
+                    heartbeat = float(spec.get("heartbeat", DEADBAND_DEFAULT_HEARTBEAT))
+                except (AttributeError, TypeError, ValueError) as e:
+                    logger.error(f"Invalid deadband config for {mqtt_topic}/{mqtt_key}: {e}")
+                    continue
+                settings[ds_id] = (band, heartbeat)
+
+        self.settings = settings
+        # Forget state of datastreams that are no longer filtered
+        for ds_id in set(self._last) - set(settings):
+            del self._last[ds_id]
+
+    def filter(
+        self, rows: List[Dict[str, Any]], pending: Optional[Dict[str, Tuple[datetime, float]]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Rows that should be forwarded (state is left alone until they are committed).
+
+        ``pending`` holds what was forwarded but not yet submitted; share one dict
+        across the calls for a batch so its readings are measured against each other.
+        """
+        if not self.settings:
+            return rows
+        pending = {} if pending is None else pending
+        kept = []
+        for row in rows:
+            if self.forward(row, pending):
+                kept.append(row)
+        return kept
+
+    def forward(self, row: Dict[str, Any], pending: Dict[str, Tuple[datetime, float]]) -> bool:
+        """Decide whether one row is forwarded, against ``pending`` and then the submitted state"""
+        ds_id = row["datastream_id"]
+        setting = self.settings.get(ds_id)
+        value = row.get("result_numeric")
+        if setting is None or value is None:
+            return True
+
+        ts = datetime.fromisoformat(row["result_time"])
+        last = pending.get(ds_id) or self._last.get(ds_id)
+        if last is not None:
+            last_ts, last_value = last
+            band, heartbeat = setting
+            # Only newer readings are dropped: a redelivered or out-of-order reading
+            # (ts <= last_ts) is always forwarded and leaves the state alone
+            if ts <= last_ts:
+                self.forwarded += 1
+                return True
+            if abs(value - last_value) <= band and (ts - last_ts).total_seconds() < heartbeat:
+                self.suppressed += 1
+                return False
+
+        pending[ds_id] = (ts, value)
+        self.forwarded += 1
+        return True
+
+    def commit(self, rows: List[Dict[str, Any]]):
+        """Record forwarded rows the API accepted (or that were spooled) as their datastreams' last forwarded value"""
+        for row in rows:
+            ds_id = row["datastream_id"]
+            value = row.get("result_numeric")
+            if ds_id not in self.settings or value is None:
+                continue
+            ts = datetime.fromisoformat(row["result_time"])
+            last = self._last.get(ds_id)
+            if last is None or ts > last[0]:
+                self._last[ds_id] = (ts, value)
+
+    def last_forwarded(self, ds_id: str) -> Optional[Tuple[datetime, float]]:
+        return self._last.get(ds_id)
+
+    def as_dict(self) -> dict:
+        return {
+            "datastreams": len(self.settings),
+            "forwarded": self.forwarded,
+            "suppressed": self.suppressed,
+        }
@@ -0,0 +1,91 @@
+"""
+Duplicate-reading suppression for the ingestion queue
+
+Tasmota devices re-send retained and duplicate telemetry after reconnects, and
+DLQ replays can reintroduce readings that were already ingested. Messages are
+keyed by (routing key, payload ``Time``, content hash); a key is remembered only
+once its message was successfully ingested, so a message that failed and comes
+back through the retry queues is never mistaken for a duplicate.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+from shared.logger.logging_config import setup_logging_json, setup_logging_colored
+from app.metrics import DEDUPE_EVICTIONS, DEDUPE_LOOKUPS
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+if LOG_FORMAT == "colored":
+    logger = setup_logging_colored("home-telemetry-ingestion-dedupe")
+else:
+    logger = setup_logging_json("home-telemetry-ingestion-dedupe")
+
+DEDUPE_ENABLED = os.getenv("DEDUPE_ENABLED", "false").lower() == "true"
+DEDUPE_CACHE_SIZE = int(os.getenv("DEDUPE_CACHE_SIZE", "50000"))
+DEDUPE_TTL = float(os.getenv("DEDUPE_TTL", "3600"))  # seconds a reading is remembered
+DEDUPE_STATS_LOG_INTERVAL = int(os.getenv("DEDUPE_STATS_LOG_INTERVAL", "60"))  # seconds
+
+DedupeKey = Tuple[str, Optional[str], bytes]
+
+
+def dedupe_key(routing_key: str, payload_time: Optional[str], body: bytes) -> DedupeKey:
+    """(routing key, payload Time, 128-bit content hash) identifying one reading"""
+    return routing_key, payload_time, hashlib.blake2b(body, digest_size=16).digest()
+
+
+class DedupeCache:
+    """Bounded LRU cache of recently ingested readings with a per-entry TTL"""
+
+    def __init__(self, max_size: int = DEDUPE_CACHE_SIZE, ttl: float = DEDUPE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, float]" = OrderedDict()  # key → expiry (monotonic)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._last_stats_log = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def seen(self, key: Hashable) -> bool:
+        """True if the reading was already ingested (counts a hit), else False (counts a miss)"""
+        expires = self._entries.get(key)
+        now = time.monotonic()
+        if expires is not None and expires > now:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            DEDUPE_LOOKUPS.labels("hit").inc()
+            self._maybe_log_stats(now)
+            return True
+        if expires is not None:
+            del self._entries[key]
+        self.misses += 1
+        DEDUPE_LOOKUPS.labels("miss").inc()
+        self._maybe_log_stats(now)
+        return False
+
+    def add(self, key: Hashable):
+        """Remember an ingested reading"""
+        self._entries[key] = time.monotonic() + self.ttl
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            DEDUPE_EVICTIONS.inc()
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def _maybe_log_stats(self, now: float):
+        if now - self._last_stats_log >= DEDUPE_STATS_LOG_INTERVAL:
+            self._last_stats_log = now
+            logger.info("Dedupe cache stats", extra=self.as_dict())
@@ -0,0 +1,208 @@
+"""
+Dead Letter Queue browsing and replay
+
+Messages are fetched with basic.get and held unacknowledged while the queue is
+scanned, so each one is seen once; afterwards everything not replayed is
+nacked back onto the queue in its original position. Browsing therefore never
+removes anything.
+
+Replay republishes matching messages through the requeue exchange - the same
+entry point delayed retries use, so sharded deployments hash them to their
+device's shard - with publisher confirms. A DLQ message is acked only after
+the broker confirmed its copy, in windows of ``window`` messages, paced to
+``rate`` messages per second.
+"""
+import asyncio
+import fnmatch
+import json
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+import aio_pika
+from app.queue import DLQ_NAME, REQUEUE_EXCHANGE
+
+REPLAY_WINDOW = 500  # Messages published before their confirms are awaited together
+
+
+def _parse_time(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+class DlqFilter:
+    """Selects DLQ messages by original routing key (glob, e.g. ``tele.A1T_*.SENSOR``) and failure time"""
+
+    def __init__(
+        self,
+        routing_key: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        reason: Optional[str] = None,
+    ):
+        self.routing_key = routing_key
+        self.since = since
+        self.until = until
+        self.reason = reason
+
+    def matches(self, message: aio_pika.IncomingMessage) -> bool:
+        headers = message.headers or {}
+        if self.routing_key is not None:
+            key = str(headers.get("x-original-routing-key") or message.routing_key or "")
+            if not fnmatch.fnmatchcase(key, self.routing_key):
+                return False
+        if self.reason is not None and headers.get("x-failure-reason") != self.reason:
+            return False
+        if self.since is not None or self.until is not None:
+            failed_at = _parse_time(headers.get("x-failed-at"))
+            if failed_at is None:
+                return False
+            if self.since is not None and failed_at < self.since:
+                return False
+            if self.until is not None and failed_at > self.until:
+                return False
+        return True
+
+
+def describe(message: aio_pika.IncomingMessage) -> Dict[str, Any]:
+    """JSON-friendly summary of one DLQ message"""
+    headers = message.headers or {}
+    try:
+        body = json.loads(message.body.decode())
+    except (UnicodeDecodeError, ValueError):
+        body = message.body.decode(errors="replace")
+    return {
+        "original_routing_key": headers.get("x-original-routing-key") or message.routing_key,
+        "failed_at": headers.get("x-failed-at"),
+        "retry_count": headers.get("x-retry-count"),
+        "reason": headers.get("x-failure-reason"),
+        "body": body,
+    }
+
+
+class DlqBrowser:
+    """Non-destructive peek, filtering and confirmed bulk replay of the DLQ"""
+
+    def __init__(self, channel: aio_pika.abc.AbstractChannel, queue_name: str = DLQ_NAME):
+        self.channel = channel  # Must be opened with publisher confirms for replay (aio_pika default)
+        self.queue_name = queue_name
+        self.queue: Optional[aio_pika.abc.AbstractQueue] = None
+
+    async def open(self) -> int:
+        """Declare the DLQ and return its message count"""
+        self.queue = await self.channel.declare_queue(self.queue_name, durable=True, passive=True)
+        return self.queue.declaration_result.message_count
+
+    async def _scan(self):
+        """Yield every message currently in the queue, holding each unacked"""
+        for _ in range(self.queue.declaration_result.message_count):
+            message = await self.queue.get(no_ack=False, fail=False)
+            if message is None:
+                return
+            yield message
+
+    @staticmethod
+    async def _release(messages: List[aio_pika.IncomingMessage]):
+        """Put held messages back onto the queue"""
+        for message in messages:
+            await message.nack(requeue=True)
+
+    async def peek(self, count: int = 10, selector: Optional[DlqFilter] = None) -> List[Dict[str, Any]]:
+        """Up to ``count`` matching messages, leaving the queue unchanged"""
+        selector = selector or DlqFilter()
+        held, found = [], []
+        try:
+            async for message in self._scan():
+                held.append(message)
+                if selector.matches(message):
+                    found.append(describe(message))
+                    if len(found) >= count:
+                        break
+        finally:
+            await self._release(held)
+        return found
+
+    async def replay(
+        self,
+        selector: Optional[DlqFilter] = None,
+        rate: float = 0,
+        limit: Optional[int] = None,
+        window: int = REPLAY_WINDOW,
+    ) -> Dict[str, int]:
+        """
+        Republish matching messages for ingestion and remove them from the DLQ.
+
+        Each window is published concurrently and its confirms awaited together; only
+        confirmed messages are acked, the rest go back to the DLQ. ``rate`` caps
+        messages per second (0 = unlimited), ``limit`` caps messages replayed.
+        """
+        selector = selector or DlqFilter()
+        exchange = await self.channel.get_exchange(REQUEUE_EXCHANGE)
+        held: List[aio_pika.IncomingMessage] = []  # Skipped or failed - released when the scan is done
+        pending: List[aio_pika.IncomingMessage] = []
+        stats = {"replayed": 0, "failed": 0, "skipped": 0}
+        started = time.monotonic()
+        if rate > 0:
+            window = max(1, min(window, int(rate)))  # At most about one second of messages per window
+
+        async def flush():
+            window_messages = pending[:]
+            pending.clear()
+            results = await asyncio.gather(
+                *(exchange.publish(self._replay_message(m), routing_key=self._routing_key(m)) for m in window_messages),
+                return_exceptions=True,
+            )
+            for message, result in zip(window_messages, results):
+                if isinstance(result, BaseException):
+                    held.append(message)  # Not nacked yet, or the scan would fetch it again
+                    stats["failed"] += 1
+                else:
+                    await message.ack()
+                    stats["replayed"] += 1
+            if rate > 0:
+                # Pace to the rate: sleep until the replayed total is due
+                due = started + (stats["replayed"] + stats["failed"]) / rate
+                await asyncio.sleep(max(due - time.monotonic(), 0))
+
+        try:
+            async for message in self._scan():
+                if not selector.matches(message):
+                    held.append(message)
+                    stats["skipped"] += 1
+                    continue
+                pending.append(message)
+                if len(pending) >= window:
+                    await flush()
+                if limit is not None and stats["replayed"] + stats["failed"] + len(pending) >= limit:
+                    break
+            if pending:
+                await flush()
+        finally:
+            await self._release(pending + held)
+        return stats
+
+    @staticmethod
+    def _routing_key(message: aio_pika.IncomingMessage) -> str:
+        headers = message.headers or {}
+        return str(headers.get("x-original-routing-key") or message.routing_key)
+
+    def _replay_message(self, message: aio_pika.IncomingMessage) -> aio_pika.Message:
+        headers = message.headers or {}
+        return aio_pika.Message(
+            body=message.body,
+            headers={
+                "x-retry-count": 0,  # A fresh set of retries
+                "x-original-routing-key": self._routing_key(message),
+                "x-replayed-at": datetime.now(timezone.utc).isoformat(),
+                "x-previous-failure": str(headers.get("x-failure-reason") or headers.get("x-failed-at") or ""),
+            },
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+        )
+
+    async def purge(self) -> int:
+        result = await self.queue.purge()
+        return result.message_count
@@ -0,0 +1,201 @@
+"""
+Windowed downsampling for high-frequency datastreams
+
+A datastream configured with a ``window`` (seconds) no longer produces one row
+per raw sample. Its readings are folded into a fixed, clock-aligned window
+(min/max/mean/last/count) and one row per window is emitted, with the chosen
+aggregate as ``result_numeric`` and all aggregates under
+``parameters["aggregation"]``.
+
+State is one open window per datastream, so memory stays O(active datastreams).
+A window closes when a reading for a later window arrives, or when its flush
+deadline (``window`` seconds after it opened, plus a grace period) passes.
+Closed windows wait in an outbox until they have been submitted. A sample that
+arrives for a window already closed is dropped as late, so a window is never
+emitted twice.
+
+Delivery is at-most-once for absorbed samples: the messages they came from are
+acknowledged once folded in, so the open windows (at most one per datastream)
+are lost if the worker crashes before they close. A clean shutdown flushes them.
+
+Settings come from datastream ``properties`` and are synced by the jobs service
+into each topic config as ``{"downsample": {mqtt_key: {"window": 60, "value": "mean"}}}``.
+"""
+import asyncio
+import heapq
+import math
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from shared.logger.logging_config import setup_logging_json, setup_logging_colored
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+if LOG_FORMAT == "colored":
+    logger = setup_logging_colored("home-telemetry-ingestion-downsample")
+else:
+    logger = setup_logging_json("home-telemetry-ingestion-downsample")
+
+DOWNSAMPLE_GRACE = float(os.getenv("DOWNSAMPLE_GRACE", "5"))  # seconds past a window's span before it is force-flushed
+AGGREGATES = ("mean", "min", "max", "last", "count")
+
+
+class _Window:
+    __slots__ = ("start", "deadline", "count", "total", "min", "max", "last")
+
+    def __init__(self, start: float, deadline: float):
+        self.start = start  # Window start, epoch seconds (aligned to the window length)
+        self.deadline = deadline  # Monotonic flush deadline
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.last = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.last = value
+
+
+class Downsampler:
+    """Folds readings of configured datastreams into fixed windows, one row per window"""
+
+    def __init__(self, grace: float = DOWNSAMPLE_GRACE):
+        self.grace = grace
+        self.settings: Dict[str, Tuple[float, str]] = {}  # datastream_id → (window seconds, value aggregate)
+        self._windows: Dict[str, _Window] = {}
+        self._last_seen: Dict[str, float] = {}  # datastream_id → newest absorbed sample time (epoch)
+        self._closed_until: Dict[str, float] = {}  # datastream_id → end of its last closed window (epoch)
+        self._deadlines: List[Tuple[float, str, float]] = []  # heap of (deadline, datastream_id, window start)
+        self.outbox: List[Dict[str, Any]] = []  # Closed-window rows waiting to be submitted
+        self.deadline_changed = asyncio.Event()
+        self.absorbed = 0
+        self.late = 0
+
+    def configure(self, config_map: Dict[str, dict]):
+        """Load window settings from topic configs; windows of datastreams no longer downsampled are closed"""
+        settings: Dict[str, Tuple[float, str]] = {}
+        for mqtt_topic, cfg in config_map.items():
+            datastreams = cfg.get("datastreams", {})
+            for mqtt_key, spec in (cfg.get("downsample") or {}).items():
+                ds_id = datastreams.get(mqtt_key)
+                if not ds_id:
+                    continue
+                try:
+                    window = float(spec["window"])
+                    value = spec.get("value", "mean")
+                    if window <= 0 or value not in AGGREGATES:
+                        raise ValueError(f"window={window}, value={value}")
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.error(f"Invalid downsample config for {mqtt_topic}/{mqtt_key}: {e}")
+                    continue
+                settings[ds_id] = (window, value)
+
+        for ds_id in [d for d in self._windows if self.settings.get(d) != settings.get(d)]:
+            self._close(ds_id)
+        for ds_id in set(self._last_seen) - set(settings):
+            del self._last_seen[ds_id]
+        for ds_id in set(self._closed_until) - set(settings):
+            del self._closed_until[ds_id]
+        self.settings = settings
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+    def filter(self, rows: List[Dict[str, Any]], now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Absorb rows of downsampled datastreams; return the rows that pass through unchanged"""
+        if not self.settings:
+            return rows
+        now = time.monotonic() if now is None else now
+        passed = []
+        for row in rows:
+            if row["datastream_id"] in self.settings and row.get("result_numeric") is not None:
+                self.add(row, now)
+            else:
+                passed.append(row)
+        return passed
+
+    def add(self, row: Dict[str, Any], now: float):
+        ds_id = row["datastream_id"]
+        window_len, _ = self.settings[ds_id]
+        ts = datetime.fromisoformat(row["result_time"]).timestamp()
+        start = math.floor(ts / window_len) * window_len
+
+        if ts <= self._last_seen.get(ds_id, -math.inf) or ts < self._closed_until.get(ds_id, -math.inf):
+            # Redelivered or out-of-order sample (already counted), or its window was closed on its deadline
+            self.late += 1
+            return
+        self._last_seen[ds_id] = ts
+
+        window = self._windows.get(ds_id)
+        if window is not None and start > window.start:
+            self._close(ds_id)
+            window = None
+        if window is None:
+            window = _Window(start, now + window_len + self.grace)
+            self._windows[ds_id] = window
+            heapq.heappush(self._deadlines, (window.deadline, ds_id, start))
+            self.deadline_changed.set()
+
+        window.add(float(row["result_numeric"]))
+        self.absorbed += 1
+
+    def _close(self, ds_id: str):
+        window = self._windows.pop(ds_id)
+        window_len, value = self.settings[ds_id]
+        self._closed_until[ds_id] = window.start + window_len
+        aggregates = {
+            "mean": window.total / window.count,
+            "min": window.min,
+            "max": window.max,
+            "last": window.last,
+            "count": window.count,
+        }
+        self.outbox.append({
+            "datastream_id": ds_id,
+            "result_time": datetime.fromtimestamp(window.start, tz=timezone.utc).isoformat(),
+            "result_numeric": float(aggregates[value]),
+            "parameters": {"aggregation": {"window": window_len, **aggregates}},
+        })
+
+    @property
+    def next_deadline(self) -> Optional[float]:
+        return self._deadlines[0][0] if self._deadlines else None
+
+    def close_due(self, now: Optional[float] = None) -> int:
+        """Close every window whose flush deadline has passed; returns how many were closed"""
+        now = time.monotonic() if now is None else now
+        closed = 0
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, ds_id, start = heapq.heappop(self._deadlines)
+            window = self._windows.get(ds_id)
+            if window is not None and window.start == start:  # Skip entries of windows already closed
+                self._close(ds_id)
+                closed += 1
+        return closed
+
+    def close_all(self):
+        """Close every open window (shutdown)"""
+        for ds_id in list(self._windows):
+            self._close(ds_id)
+        self._deadlines.clear()
+
+    def take_outbox(self) -> List[Dict[str, Any]]:
+        rows, self.outbox = self.outbox, []
+        return rows
+
+    def requeue(self, rows: List[Dict[str, Any]]):
+        """Put rows whose submission failed back into the outbox"""
+        self.outbox[:0] = rows
+
+    def as_dict(self) -> dict:
+        return {
+            "datastreams": len(self.settings),
+            "open_windows": len(self._windows),
+            "outbox": len(self.outbox),
+            "absorbed": self.absorbed,
+            "late": self.late,
+        }
@@ -1,28 +1,41 @@
 """
-Message handlers for different sensor types.
+Payload extractors for different sensor types.
 
-Each handler transforms raw message data from RabbitMQ into observation objects.
-Handlers are registered by model type in MODEL_HANDLERS.
+Each sensor model is described by a declarative extractor spec mapping a payload
+field path to the ``mqtt_key`` of the datastream it feeds. Specs are compiled once
+per topic into an extractor that turns a raw payload into plain, JSON-ready
+observation rows - no per-reading pydantic construction or re-serialization.
 
 Message flow:
 1. RabbitMQ receives message with routing key: "tele.NOUS_A1T_4E4984.SENSOR"
-2. Worker converts routing key (dots→slashes): "tele/NOUS_A1T_4E4984/SENSOR"
-3. Worker looks up topic config in Redis hash "mqtt:topic_config" (written by jobs sync)
-4. Config contains: {"model": "A1T", "datastreams": {"Power": "uuid", ...}}
-5. Worker gets handler from MODEL_HANDLERS: handle_sensor_A1T()
-6. Handler receives the datastreams dict and maps payload fields → datastream IDs
+2. On every config load, the worker reads the topic configs from the Redis hash
+   "mqtt:topic_config" (written by jobs sync), e.g.
+   {"model": "A1T", "datastreams": {"Power": "uuid", ...}}
+3. It compiles the spec of each topic (config "extractor", else MODEL_EXTRACTORS[model])
+   against its datastreams and indexes it by routing key (app.routing.TopicIndex)
+4. Each message's routing key is resolved through that index: one dict lookup for
+   exact topics, the wildcard trie for "+"/"#" patterns
+5. The compiled extractor appends one row per configured reading to the batch
 
 Redis setup (via jobs sync job):
     HSET mqtt:topic_config "tele/NOUS_A1T_4E4984/SENSOR"
          '{"model": "A1T", "datastreams": {"Power": "uuid", "Voltage": "uuid", "Total": "uuid"}}'
+
+A device model without a built-in spec can carry its own in the topic config
+(taken from the system's ``properties.extractor``):
+    '{"model": "BME280", "extractor": {"BME280.Pressure": "Pressure"}, "datastreams": {...}}'
 """
-from typing import List, Dict
+from typing import List, Dict, Any, Callable, Optional
+from uuid import UUID
 from datetime import datetime, timezone, timedelta
 from schemas.observation_schemas import ObservationWrite
 
 # Fixed UTC+1 offset for incoming sensor data (no DST)
 UTC_PLUS_1 = timezone(timedelta(hours=1))
 
+# Compiled extractor: appends JSON-ready rows for one payload, returns how many were added
+Extractor = Callable[[dict, List[Dict[str, Any]]], int]
+
 
 def _parse_time(data: dict) -> datetime:
     """Parse 'Time' field from sensor payload and convert UTC+1 → UTC."""
@@ -36,74 +49,110 @@ def _parse_time(data: dict) -> datetime:
     return datetime.now(timezone.utc)
 
 
+def _to_number(value: Any) -> float:
+    """Coerce a reading to float the way ObservationWrite.result_numeric would."""
+    if isinstance(value, bool):
+        raise ValueError(f"Boolean is not a numeric reading: {value!r}")
+    return float(value)
+
+
 # ==========================
-# TOPIC HANDLERS
+# EXTRACTOR SPECS
 # ==========================
-async def handle_sensor_SHT40(data: dict, datastreams: Dict[str, str]) -> List[ObservationWrite]:
-    """
-    Handle SHT4X temperature/humidity sensor messages.
-
-    datastreams keys (set via properties.mqtt_key on each datastream):
-        "Temperature", "Humidity", "DewPoint"
-    """
-    result_time = _parse_time(data)
-    sht = data.get("SHT4X", {})
+# payload field path ("Section.Field") → datastream mqtt_key
+MODEL_EXTRACTORS: Dict[str, Dict[str, str]] = {
+    "SHT40": {
+        "SHT4X.Temperature": "Temperature",
+        "SHT4X.Humidity":    "Humidity",
+        "SHT4X.DewPoint":    "DewPoint",
+    },
+    "A1T": {
+        "ENERGY.Power":   "Power",
+        "ENERGY.Voltage": "Voltage",
+        "ENERGY.Total":   "Total",
+    },
+}
 
-    readings = {
-        "Temperature": sht.get("Temperature"),
-        "Humidity":    sht.get("Humidity"),
-        "DewPoint":    sht.get("DewPoint"),
-    }
 
-    observations = []
-    for mqtt_key, value in readings.items():
-        ds_id = datastreams.get(mqtt_key)
-        if value is not None and ds_id:
-            observations.append(ObservationWrite(
-                datastream_id=ds_id,
-                result_time=result_time,
-                result_numeric=value,
-            ))
+def get_extractor_spec(config: dict) -> Optional[Dict[str, str]]:
+    """Spec for a topic config: its own "extractor" entry, else the built-in one for its model."""
+    return config.get("extractor") or MODEL_EXTRACTORS.get(config.get("model"))
 
-    return observations
 
+def compile_extractor(spec: Dict[str, str], datastreams: Dict[str, str]) -> Extractor:
+    """
+    Compile an extractor spec against a topic's datastreams.
 
-async def handle_sensor_A1T(data: dict, datastreams: Dict[str, str]) -> List[ObservationWrite]:
+    Paths are split and datastream IDs validated once here, so extracting a
+    payload is just dictionary walks. Readings whose mqtt_key has no datastream
+    are dropped at compile time; missing or None values are skipped per payload.
     """
-    Handle NOUS A1T consumption messages.
+    fields = []
+    for path, mqtt_key in spec.items():
+        ds_id = datastreams.get(mqtt_key)
+        if not ds_id:
+            continue
+        fields.append((tuple(path.split(".")), str(UUID(str(ds_id)))))
+
+    def extract(data: dict, rows: List[Dict[str, Any]]) -> int:
+        result_time = _parse_time(data).isoformat()
+        added = 0
+        for keys, ds_id in fields:
+            value = data
+            for key in keys:
+                value = value.get(key) if isinstance(value, dict) else None
+                if value is None:
+                    break
+            if value is None:
+                continue
+            rows.append({
+                "datastream_id": ds_id,
+                "result_time": result_time,
+                "result_numeric": _to_number(value),
+            })
+            added += 1
+        return added
+
+    return extract
+
+
+def compile_topic_config(config: dict) -> Optional[Extractor]:
+    """Compile the extractor for a topic config, or None if its model has no spec."""
+    spec = get_extractor_spec(config)
+    if not spec:
+        return None
+    return compile_extractor(spec, config.get("datastreams", {}))
+
 
-    datastreams keys (set via properties.mqtt_key on each datastream):
-        "Power", "Voltage", "Total"
+# ==========================
+# TOPIC HANDLERS
+# ==========================
+def _make_model_handler(model: str):
     """
-    result_time = _parse_time(data)
-    energy = data.get("ENERGY", {})
+    Build an ObservationWrite-returning handler from a model's extractor spec.
 
-    readings = {
-        "Power":   energy.get("Power"),
-        "Voltage": energy.get("Voltage"),
-        "Total":   energy.get("Total"),
-    }
+    Kept for callers that want validated pydantic objects; the worker itself
+    uses compiled extractors and sends the plain rows.
+    """
+    spec = MODEL_EXTRACTORS[model]
 
-    observations = []
-    for mqtt_key, value in readings.items():
-        ds_id = datastreams.get(mqtt_key)
-        if value is not None and ds_id:
-            observations.append(ObservationWrite(
-                datastream_id=ds_id,
-                result_time=result_time,
-                result_numeric=value,
-            ))
+    async def handler(data: dict, datastreams: Dict[str, str]) -> List[ObservationWrite]:
+        rows: List[Dict[str, Any]] = []
+        compile_extractor(spec, datastreams)(data, rows)
+        return [ObservationWrite(**row) for row in rows]
 
-    return observations
+    handler.__name__ = f"handle_sensor_{model}"
+    handler.__doc__ = f"Handle {model} messages (datastream keys: {', '.join(spec.values())})."
+    return handler
 
 
 # ==========================
 # MODEL → HANDLER REGISTRY
 # ==========================
-MODEL_HANDLERS = {
-    "SHT40": handle_sensor_SHT40,
-    "A1T":   handle_sensor_A1T,
-}
+MODEL_HANDLERS = {model: _make_model_handler(model) for model in MODEL_EXTRACTORS}
+
+handle_sensor_SHT40 = MODEL_HANDLERS["SHT40"]
+handle_sensor_A1T = MODEL_HANDLERS["A1T"]
 
 
 def get_handler(model: str):
@@ -0,0 +1,86 @@
+"""
+Prometheus metrics for the ingestion worker
+
+Metrics live in the ``prometheus_client`` default registry and are served on
+``GET /metrics`` by ``start_http_server`` on METRICS_PORT.
+
+Label sets per metric are capped at METRICS_MAX_SERIES; later ones are folded
+into ``other`` so a misbehaving publisher cannot grow the registry unbounded.
+"""
+import math
+import os
+from typing import Set, Tuple
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.metrics import MetricWrapperBase
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))  # 0 = no /metrics endpoint
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # 0.0.0.0 to be scraped from other hosts or containers
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "1000"))  # Label sets per metric
+METRICS_QUEUE_POLL_INTERVAL = int(os.getenv("METRICS_QUEUE_POLL_INTERVAL", "15"))  # seconds between queue depth polls
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class CappedLabels:
+    """A labelled metric whose ``labels()`` folds label sets beyond ``max_series`` into ``other``"""
+
+    def __init__(self, metric: MetricWrapperBase, max_series: int = METRICS_MAX_SERIES):
+        self.metric = metric
+        self.max_series = max_series
+        self._series: Set[Tuple[str, ...]] = set()
+
+    def labels(self, *values: str):
+        key = tuple(str(v) for v in values)
+        if key not in self._series:
+            if len(self._series) >= self.max_series:
+                key = ("other",) * len(key)
+            else:
+                self._series.add(key)
+        return self.metric.labels(*key)
+
+    def clear(self):
+        """Drop every series (tests)"""
+        self._series.clear()
+        self.metric.clear()
+
+
+MESSAGES_CONSUMED = CappedLabels(Counter(
+    "ingestion_messages_consumed_total", "Messages received from RabbitMQ", ["topic"]))
+MESSAGES_ACKED = CappedLabels(Counter(
+    "ingestion_messages_acked_total", "Messages ingested and acknowledged", ["topic"]))
+MESSAGES_REQUEUED = CappedLabels(Counter(
+    "ingestion_messages_requeued_total", "Messages scheduled for a delayed retry", ["topic"]))
+MESSAGES_DEAD_LETTERED = CappedLabels(Counter(
+    "ingestion_messages_dead_lettered_total", "Messages moved to the DLQ", ["topic", "reason"]))
+BATCH_SIZES = Histogram(
+    "ingestion_batch_size", "Messages per flushed batch", buckets=BATCH_SIZE_BUCKETS)
+HANDLER_CPU_SECONDS = CappedLabels(Counter(
+    "ingestion_handler_cpu_seconds_total", "CPU time spent extracting and filtering messages", ["model"]))
+API_REQUEST_SECONDS = Histogram(
+    "ingestion_api_request_duration_seconds", "Bulk observation request latency", ["status"], buckets=LATENCY_BUCKETS)
+TOKEN_REFRESHES = Counter(
+    "ingestion_token_refreshes_total", "API token fetches", ["outcome"])
+DEDUPE_LOOKUPS = Counter(
+    "ingestion_dedupe_lookups_total", "Duplicate-suppression cache lookups", ["result"])
+DEDUPE_EVICTIONS = Counter(
+    "ingestion_dedupe_evictions_total", "Readings evicted from the duplicate-suppression cache before their TTL")
+QUEUE_DEPTH = Gauge(
+    "ingestion_queue_depth", "Messages ready in the consumed queue(s) at the last poll")
+QUEUE_LAG_SECONDS = Gauge(
+    "ingestion_queue_lag_seconds", "Estimated seconds to drain the queue at the recent consumption rate")
+PENDING_ACK = Gauge(
+    "ingestion_pending_ack", "Messages flushed to the handler and not yet settled")
+UNACKED_DELIVERIES = Gauge(
+    "ingestion_unacked_deliveries", "Deliveries received and not yet acknowledged to RabbitMQ")
+INFLIGHT_BATCHES = Gauge(
+    "ingestion_inflight_batches", "Batches being handled concurrently")
+
+
+def queue_lag(depth: int, consumed: float, interval: float) -> float:
+    """Seconds to drain ``depth`` messages at the rate ``consumed`` messages took ``interval`` seconds"""
+    if depth <= 0:
+        return 0.0
+    rate = consumed / interval if interval > 0 else 0.0
+    return depth / rate if rate > 0 else math.inf
@@ -0,0 +1,443 @@
+"""
+Native MQTT ingestion source
+
+With INGESTION_SOURCE=mqtt the worker subscribes to the MQTT broker itself
+instead of consuming the RabbitMQ queue that the broker's MQTT plugin feeds,
+which removes a broker hop along with its latency and queue memory. Only the
+way messages arrive and are settled changes: batching, fair scheduling,
+duplicate suppression, routing and the batch handler are those of
+ObservationQueue.
+
+- Subscriptions are shared (``$share/MQTT_SHARED_GROUP/<topic>``), so the
+  workers of one group split the stream between them
+- A QoS 1 message is acknowledged (PUBACK) only once it is settled: after the
+  API accepted it, or after it was dead-lettered. Until then the broker keeps
+  it in the worker's persistent session and redelivers it after a reconnect
+- PUBACKs follow the order messages were received in (MQTT 5 section 4.6): a
+  settled message waits until every earlier one is settled too
+- The MQTT 5 Receive Maximum is set to PREFETCH_COUNT, so the broker stops
+  sending once that many messages are unacknowledged, like a RabbitMQ prefetch
+- Failed messages are appended to the retry spool of their attempt (one disk
+  spool per attempt under MQTT_RETRY_DIR) and acknowledged, so they do not hold
+  back later PUBACKs while they wait. A background task per spool feeds them
+  back into the batch after ``retry_delay(attempt)``; each spool's cursor only
+  moves past a retry once it is settled again. Without a retry spool (or with
+  it full) a failed message waits in-process, unacknowledged
+- Once out of retries (or straight away for poison messages) messages are
+  published to ``MQTT_DLQ_TOPIC/<topic>`` with the failure details as MQTT 5
+  user properties, then acknowledged
+
+paho-mqtt runs its network loop in a background thread; received messages are
+handed to the event loop through an asyncio queue and handled one at a time,
+so their order into the batch is kept.
+"""
+import asyncio
+import base64
+import json
+import os
+import socket
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+try:
+    import paho.mqtt.client as mqtt
+    from paho.mqtt.packettypes import PacketTypes
+    from paho.mqtt.properties import Properties
+except ImportError:  # Only needed with INGESTION_SOURCE=mqtt
+    mqtt = None
+from shared.logger.logging_config import setup_logging_json, setup_logging_colored
+from app.metrics import MESSAGES_CONSUMED, MESSAGES_DEAD_LETTERED, MESSAGES_REQUEUED
+from app.queue import ObservationQueue, PendingBatch, MAX_INFLIGHT_BATCHES, MAX_MESSAGE_RETRIES, PREFETCH_COUNT, retry_delay
+from app.routing import mqtt_topic_to_routing_key
+from app.spool import ObservationSpool, Position
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+if LOG_FORMAT == "colored":
+    logger = setup_logging_colored("home-telemetry-ingestion-mqtt")
+else:
+    logger = setup_logging_json("home-telemetry-ingestion-mqtt")
+
+MQTT_HOST = os.getenv("MQTT_HOST", "localhost")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+MQTT_USERNAME = os.getenv("MQTT_USERNAME", "")
+MQTT_PASSWORD = os.getenv("MQTT_PASSWORD", "")
+# Stable per worker: the broker keeps unacknowledged messages in this client's session across restarts
+MQTT_CLIENT_ID = os.getenv("MQTT_CLIENT_ID", f"home-telemetry-ingestion-{socket.gethostname()}")
+MQTT_TOPICS = os.getenv("MQTT_TOPICS", "tele/+/SENSOR")  # Comma-separated topic filters
+MQTT_SHARED_GROUP = os.getenv("MQTT_SHARED_GROUP", "ingestion")  # Shared subscription group ("" = plain subscriptions)
+MQTT_QOS = int(os.getenv("MQTT_QOS", "1"))
+MQTT_KEEPALIVE = int(os.getenv("MQTT_KEEPALIVE", "60"))  # seconds
+MQTT_SESSION_EXPIRY = int(os.getenv("MQTT_SESSION_EXPIRY", "3600"))  # Seconds the broker keeps the session after a disconnect
+MQTT_DLQ_TOPIC = os.getenv("MQTT_DLQ_TOPIC", "ingestion/dlq")  # Dead letters go to <MQTT_DLQ_TOPIC>/<original topic>
+MQTT_CONNECT_TIMEOUT = int(os.getenv("MQTT_CONNECT_TIMEOUT", "30"))  # seconds
+MQTT_PUBLISH_TIMEOUT = int(os.getenv("MQTT_PUBLISH_TIMEOUT", "10"))  # Seconds to wait for a dead letter's PUBACK
+# One retry spool per attempt under this directory, should be a persistent volume ("" = retries wait in-process, unacknowledged)
+MQTT_RETRY_DIR = os.getenv("MQTT_RETRY_DIR", "/var/lib/ingestion/mqtt-retry")
+RECEIVE_MAXIMUM_LIMIT = 65535  # Largest Receive Maximum MQTT 5 allows
+
+
+def shared_subscription(topic: str, group: str) -> str:
+    """"tele/+/SENSOR" in group "ingestion" → "$share/ingestion/tele/+/SENSOR" (unchanged without a group)"""
+    return f"$share/{group}/{topic}" if group else topic
+
+
+class MqttDelivery:
+    """A received MQTT message, shaped like the aio_pika message ObservationQueue settles"""
+
+    def __init__(self, client: Any, delivery_tag: int, topic: str, body: bytes, mid: int, qos: int):
+        self.client = client
+        self.delivery_tag = delivery_tag  # Local sequence number (MQTT packet ids are reused)
+        self.topic = topic
+        self.routing_key = mqtt_topic_to_routing_key(topic)
+        self.body = body
+        self.mid = mid
+        self.qos = qos
+        self.headers = {}  # x-retry-count, as on a retried RabbitMQ message
+
+    async def ack(self, multiple: bool = False):
+        """PUBACK this message (QoS 0 messages need none)"""
+        if self.qos > 0:
+            self.client.ack(self.mid, self.qos)
+
+
+class SpooledRetry(MqttDelivery):
+    """
+    A failed message fed back from a retry spool.
+
+    It was PUBACKed when it was spooled, so settling it moves the spool's cursor
+    past it instead. Every record of a spooled line shares the line's position;
+    only the last one carries it, and acks run in receive order, so the cursor
+    never passes a record that is not settled yet.
+    """
+
+    def __init__(self, delivery_tag: int, record: dict, spool: ObservationSpool, position: Optional[Position]):
+        super().__init__(None, delivery_tag, record["topic"], base64.b64decode(record["body"]), mid=0, qos=0)
+        self.headers["x-retry-count"] = record["retry_count"]
+        self.spool = spool
+        self.position = position
+
+    async def ack(self, multiple: bool = False):
+        """Commit the retry spool up to this record"""
+        if self.position is not None and self.position > self.spool.cursor:
+            await self.spool.commit(self.position)
+
+
+class MqttObservationQueue(ObservationQueue):
+    """ObservationQueue fed by a shared MQTT subscription instead of a RabbitMQ queue"""
+
+    def __init__(
+        self,
+        host: str = MQTT_HOST,
+        port: int = MQTT_PORT,
+        topics: Optional[Iterable[str]] = None,
+        shared_group: str = MQTT_SHARED_GROUP,
+        qos: int = MQTT_QOS,
+        client_id: str = MQTT_CLIENT_ID,
+        auto_ack: bool = True,
+        max_inflight: int = MAX_INFLIGHT_BATCHES,
+        prefetch_count: int = PREFETCH_COUNT,
+        retry_dir: str = MQTT_RETRY_DIR,
+    ):
+        super().__init__(auto_ack=auto_ack, max_inflight=max_inflight, prefetch_count=prefetch_count, shard_count=0)
+        self.host = host
+        self.port = port
+        self.topics = list(topics) if topics is not None else [t.strip() for t in MQTT_TOPICS.split(",") if t.strip()]
+        self.shared_group = shared_group
+        self.qos = qos
+        self.client_id = client_id
+        self.client: Optional[Any] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._inbox: asyncio.Queue = asyncio.Queue()  # (topic, payload, mid, qos) from the network thread
+        self._subscribed = asyncio.Event()
+        self._delivery_tag = 0
+        self._retry_tasks: Set[asyncio.Task] = set()  # In-process retries (no retry spool)
+        self.retry_dir = retry_dir
+        self.retry_spools: Dict[int, ObservationSpool] = {}  # attempt -> spool
+        self._retry_appended: Dict[int, asyncio.Event] = {}
+        self._retry_feeders: List[asyncio.Task] = []
+
+    @property
+    def subscriptions(self) -> List[str]:
+        return [shared_subscription(topic, self.shared_group) for topic in self.topics]
+
+    async def connect(self):
+        """Connect with a persistent MQTT 5 session and subscribe"""
+        if mqtt is None:
+            raise RuntimeError("INGESTION_SOURCE=mqtt needs the paho-mqtt package")
+        self._loop = asyncio.get_running_loop()
+        if not self.auto_ack and self.retry_dir and not self.retry_spools:
+            await self.open_retry_spools()
+        self._subscribed.clear()
+        self.deliveries.clear()  # A new client: the session redelivers whatever the old one left unacknowledged
+        client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=self.client_id,
+            protocol=mqtt.MQTTv5,
+            manual_ack=not self.auto_ack,  # PUBACK only once the message is settled
+        )
+        if MQTT_USERNAME:
+            client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_message = self._on_message
+        properties = Properties(PacketTypes.CONNECT)
+        properties.SessionExpiryInterval = MQTT_SESSION_EXPIRY
+        properties.ReceiveMaximum = min(max(self.prefetch_count, 1), RECEIVE_MAXIMUM_LIMIT)
+        self.client = client
+        try:
+            await self._loop.run_in_executor(None, lambda: client.connect(
+                self.host, self.port, MQTT_KEEPALIVE, clean_start=False, properties=properties
+            ))
+            client.loop_start()
+            await asyncio.wait_for(self._subscribed.wait(), timeout=MQTT_CONNECT_TIMEOUT)
+            logger.info(
+                f"[INGESTION] Connected to MQTT broker {self.host}:{self.port} as {self.client_id}, "
+                f"subscribed to {self.subscriptions} (QoS {self.qos}, receive maximum {properties.ReceiveMaximum})"
+            )
+        except Exception as e:
+            logger.error(f"[INGESTION] Failed to connect to MQTT broker: {e}")
+            raise
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        # Network thread: (re)subscribe on every connect, the session may have expired meanwhile
+        if reason_code.is_failure:
+            logger.error(f"[INGESTION] MQTT connection refused: {reason_code}")
+            return
+        logger.info(f"[INGESTION] MQTT connected (session present: {flags.session_present})")
+        client.subscribe([(topic, self.qos) for topic in self.subscriptions])
+        self._loop.call_soon_threadsafe(self._subscribed.set)
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logger.warning(f"[INGESTION] MQTT connection lost ({reason_code}) - reconnecting")
+
+    def _on_message(self, client, userdata, message):
+        # Network thread: hand the message to the event loop
+        self._loop.call_soon_threadsafe(
+            self._inbox.put_nowait, (message.topic, message.payload, message.mid, message.qos)
+        )
+
+    async def disconnect(self):
+        """Disconnect, leaving unacknowledged messages in the session for redelivery, and close the retry spools"""
+        try:
+            await self._disconnect_client()
+        finally:
+            await self.close_retry_spools()
+
+    async def _disconnect_client(self):
+        for task in list(self._retry_tasks):
+            task.cancel()
+        if self.client is not None:
+            self.client.disconnect()
+            await asyncio.get_running_loop().run_in_executor(None, self.client.loop_stop)
+            logger.info("[INGESTION] Disconnected from MQTT broker")
+
+    async def reconnect(self):
+        """Reconnect to the MQTT broker (the retry spools and their feeders carry on)"""
+        try:
+            await self._disconnect_client()
+        except Exception:
+            pass
+        await self.connect()
+
+    async def open_retry_spools(self):
+        """Open one retry spool per attempt and start feeding due retries back into the batch"""
+        for attempt in range(1, MAX_MESSAGE_RETRIES + 1):
+            spool = ObservationSpool(os.path.join(self.retry_dir, f"attempt-{attempt}"))
+            await spool.open()
+            self.retry_spools[attempt] = spool
+            self._retry_appended[attempt] = asyncio.Event()
+            self._retry_feeders.append(asyncio.create_task(self._feed_retries(attempt)))
+
+    async def close_retry_spools(self):
+        """Stop the feeders and close the retry spools; unsettled retries are fed again on the next start"""
+        for task in self._retry_feeders:
+            task.cancel()
+        await asyncio.gather(*self._retry_feeders, return_exceptions=True)
+        for spool in self.retry_spools.values():
+            await spool.close()
+        self._retry_feeders.clear()
+        self._retry_appended.clear()
+        self.retry_spools.clear()
+
+    async def _feed_retries(self, attempt: int):
+        """Feed an attempt's spooled retries back into the batch once due, in the order they were spooled"""
+        spool = self.retry_spools[attempt]
+        appended = self._retry_appended[attempt]
+        position = spool.cursor
+        while True:
+            appended.clear()
+            records, after = await spool.read(1, start=position)
+            if after == position:
+                await appended.wait()
+                continue
+            if records:
+                # Every record of an attempt waits the same delay, so spool order is due order
+                delay = records[0]["due"] - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                for i, record in enumerate(records):
+                    self._delivery_tag += 1
+                    delivery = SpooledRetry(self._delivery_tag, record, spool, after if i == len(records) - 1 else None)
+                    self.deliveries.track(delivery)
+                    await self._receive(delivery)
+            position = after
+
+    async def consume_messages(self):
+        """Feed received messages into the batch, in arrival order"""
+        if self.client is None:
+            raise RuntimeError("MQTT client not connected. Call connect() first.")
+
+        logger.info("[INGESTION] Starting message consumption...")
+        while True:
+            topic, body, mid, qos = await self._inbox.get()
+            self._delivery_tag += 1
+            delivery = MqttDelivery(self.client, self._delivery_tag, topic, body, mid, qos)
+            MESSAGES_CONSUMED.labels(delivery.routing_key).inc()  # First receipt only, not retries
+            if not self.auto_ack:
+                self.deliveries.track(delivery)  # In receive order, which PUBACKs must follow
+            await self._receive(delivery)
+
+    async def _receive(self, delivery: MqttDelivery):
+        """Decode a delivery (new or due for a retry) and add it to the batch"""
+        try:
+            body = json.loads(delivery.body.decode())
+            body["topic"] = delivery.routing_key
+            logger.debug(f"[INGESTION] Received message: {body}")
+            key = self._dedupe_key(delivery, delivery.routing_key, body)
+            if await self._drop_if_duplicate(delivery, key):
+                return
+            # Track the delivery for its PUBACK unless paho already acknowledged it
+            await self.add_to_batch(body, rabbitmq_message=None if self.auto_ack else delivery, key=key)
+        except json.JSONDecodeError as e:
+            logger.error(f"[INGESTION] Failed to decode message: {e}")
+            if not self.auto_ack:
+                await self.dead_letter([delivery], reason="undecodable")
+        except Exception as e:
+            logger.error(f"[INGESTION] Error processing message: {e}")
+            if not self.auto_ack:
+                await self.dead_letter([delivery], reason="consume-error")
+
+    async def _settle(self, messages: List[MqttDelivery]):
+        """
+        PUBACK the settled prefix, one message at a time in receive order.
+
+        MQTT has no multiple ack, and PUBACKs must go out in the order the
+        PUBLISH packets arrived, so a settled message is held back until every
+        earlier one is settled. Retries are spooled and settled right away; only
+        one waiting in-process (no retry spool) holds back everything after it.
+        """
+        if not messages:
+            return
+        prefix = self.deliveries.settle_prefix(messages)
+        if not prefix:
+            logger.debug("[INGESTION] PUBACK deferred until earlier messages settle")
+        for msg in prefix:
+            try:
+                await msg.ack()
+            except Exception as e:
+                logger.error(f"[INGESTION] Failed to acknowledge message: {e}")
+
+    async def move_batch_to_dlq(self, batch: Optional[PendingBatch] = None, indices: Optional[Iterable[int]] = None):
+        """Retry a batch's messages (or those behind ``indices``) after their retry delay, or dead-letter them once out of retries"""
+        messages = await self._take_pending(batch, indices)
+        exhausted = []
+        retrying: Dict[int, List[MqttDelivery]] = {}
+        for msg in messages:
+            retry_count = msg.headers.get("x-retry-count", 0)
+            if retry_count >= MAX_MESSAGE_RETRIES:
+                exhausted.append(msg)
+                continue
+            msg.headers["x-retry-count"] = retry_count + 1
+            retrying.setdefault(retry_count + 1, []).append(msg)
+            MESSAGES_REQUEUED.labels(msg.routing_key).inc()
+        for attempt, retries in retrying.items():
+            await self._retry(retries, attempt)
+        if exhausted:
+            logger.warning(f"[INGESTION] {len(exhausted)} messages out of retries after {MAX_MESSAGE_RETRIES} attempts")
+            await self.dead_letter(exhausted, reason="retries-exhausted")
+        logger.info(f"[INGESTION] Processed {len(messages)} failed messages (retry or DLQ)")
+
+    async def _retry(self, messages: List[MqttDelivery], attempt: int):
+        """Hand messages to the attempt's retry spool and settle them, or keep them unacknowledged for an in-process retry"""
+        if await self._spool_retries(messages, attempt):
+            await self._settle(messages)
+            return
+        # Stays unacknowledged while it waits: a restart in the meantime gets it redelivered
+        for msg in messages:
+            self._schedule_retry(msg, retry_delay(attempt))
+
+    async def _spool_retries(self, messages: List[MqttDelivery], attempt: int) -> bool:
+        """Durably append messages to the attempt's retry spool; False if there is none or it is full"""
+        spool = self.retry_spools.get(attempt)
+        if spool is None:
+            return False
+        due = time.time() + retry_delay(attempt)
+        records = [
+            {
+                "topic": msg.topic,
+                "body": base64.b64encode(msg.body).decode(),
+                "retry_count": msg.headers.get("x-retry-count", 0),
+                "due": due,
+            }
+            for msg in messages
+        ]
+        try:
+            spooled = await spool.append(records)
+        except OSError as e:
+            logger.error(f"[INGESTION] Failed to spool {len(records)} retries: {e}")
+            return False
+        if spooled:
+            self._retry_appended[attempt].set()
+        return spooled
+
+    def _schedule_retry(self, delivery: MqttDelivery, delay: float):
+        task = asyncio.create_task(self._retry_later(delivery, delay))
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    async def _retry_later(self, delivery: MqttDelivery, delay: float):
+        await asyncio.sleep(delay)
+        await self._receive(delivery)
+
+    async def dead_letter(self, messages: List[MqttDelivery], reason: str = ""):
+        """Publish messages to the DLQ topic (no retries) and acknowledge the ones the broker accepted"""
+        failed_at = datetime.now(timezone.utc).isoformat()
+        results = await asyncio.gather(
+            *(self._publish_dead_letter(msg, reason, failed_at) for msg in messages),
+            return_exceptions=True,
+        )
+        settled, failed = [], []
+        for msg, result in zip(messages, results):
+            if isinstance(result, BaseException):
+                logger.error(f"[INGESTION] Failed to dead-letter message from {msg.topic}: {result}")
+                failed.append(msg)
+            else:
+                settled.append(msg)
+        if failed:
+            # Comes back through the last attempt's spool (retry count unchanged) and is dead-lettered again
+            await self._retry(failed, MAX_MESSAGE_RETRIES)
+        if settled:
+            logger.warning(f"[INGESTION] {len(settled)} messages moved to DLQ ({reason})")
+        await self._settle(settled)
+        for msg in settled:
+            MESSAGES_DEAD_LETTERED.labels(msg.routing_key, reason or "unknown").inc()
+
+    async def _publish_dead_letter(self, delivery: MqttDelivery, reason: str, failed_at: str):
+        """Publish the original payload at QoS 1 and wait for the broker's PUBACK"""
+        properties = Properties(PacketTypes.PUBLISH)
+        properties.UserProperty = [
+            ("x-retry-count", str(delivery.headers.get("x-retry-count", 0))),
+            ("x-failed-at", failed_at),
+            ("x-original-routing-key", delivery.routing_key),
+            ("x-failure-reason", reason),
+        ]
+        info = self.client.publish(f"{MQTT_DLQ_TOPIC}/{delivery.topic}", delivery.body, qos=1, properties=properties)
+        await asyncio.get_running_loop().run_in_executor(None, info.wait_for_publish, MQTT_PUBLISH_TIMEOUT)
+        if not info.is_published():
+            raise TimeoutError(f"no PUBACK within {MQTT_PUBLISH_TIMEOUT}s")
+
+    async def queue_depth(self) -> Optional[int]:
+        """None: MQTT has no way to query a subscription's backlog"""
+        return None
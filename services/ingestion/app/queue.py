@@ -4,11 +4,19 @@ Collects messages from queue and batches them for bulk API submission
 """
 import json
 import asyncio
-from typing import List, Callable, Optional, Any
+import contextvars
+import time
+from collections import OrderedDict
+from typing import List, Callable, Optional, Any, Set, Iterable, Dict
 from datetime import datetime, timedelta, timezone
 import aio_pika
 import os
 from shared.logger.logging_config import setup_logging_json, setup_logging_colored
+from app.batching import AdaptiveBatchSizer
+from app.congestion import AimdController, AIMD_ENABLED
+from app.scheduling import FairScheduler, FAIR_SCHEDULING
+from app.metrics import BATCH_SIZES, MESSAGES_ACKED, MESSAGES_CONSUMED, MESSAGES_DEAD_LETTERED, MESSAGES_REQUEUED
+from app.dedupe import DedupeCache, DEDUPE_ENABLED, dedupe_key
 
 LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
 if LOG_FORMAT == "colored":
@@ -17,47 +25,311 @@ else:
     logger = setup_logging_json("home-telemetry-ingestion-queue")
 
 RABBITMQ_URL = os.getenv("RABBITMQ_URL")
+INGESTION_SOURCE = os.getenv("INGESTION_SOURCE", "rabbitmq").lower()  # "rabbitmq" or "mqtt" (app/mqtt_source.py)
 
-if not RABBITMQ_URL:
+if not RABBITMQ_URL and INGESTION_SOURCE != "mqtt":
     raise ValueError("RABBITMQ_URL environment variable is not set")
 
 QUEUE_NAME = os.getenv("QUEUE_NAME", "observations")
 DLQ_NAME = f"{QUEUE_NAME}.dlq"  # Dead Letter Queue
-BATCH_SIZE = int(os.getenv("BATCH_SIZE", "100"))
+RETRY_EXCHANGE = f"{QUEUE_NAME}.retry"  # Headers exchange routing failed messages to their delay queue
+REQUEUE_EXCHANGE = f"{QUEUE_NAME}.requeue"  # Fanout exchange expired retries are dead-lettered into
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "100"))  # Upper bound when ADAPTIVE_BATCHING is on
 BATCH_TIMEOUT = int(os.getenv("BATCH_TIMEOUT", "5"))  # seconds
 MAX_MESSAGE_RETRIES = int(os.getenv("MAX_MESSAGE_RETRIES", "3"))  # Max retries per message
+RETRY_DELAY = int(os.getenv("RETRY_DELAY", "10"))  # Delay in seconds before the first retry
+RETRY_BACKOFF = float(os.getenv("RETRY_BACKOFF", "2"))  # Delay multiplier per further attempt
+RETRY_MAX_DELAY = int(os.getenv("RETRY_MAX_DELAY", "600"))  # Upper bound for a single retry delay
+MAX_INFLIGHT_BATCHES = int(os.getenv("MAX_INFLIGHT_BATCHES", "1"))  # Batches handled concurrently (1 = inline)
+# Unacked deliveries the broker may push to this consumer: one batch being filled plus every in-flight batch
+PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", str(BATCH_SIZE * (MAX_INFLIGHT_BATCHES + 1))))
+# Sharded mode: SHARD_COUNT virtual shard queues fed by a consistent-hash exchange (0 = single queue).
+# SHARD_COUNT is fixed for a deployment (changing it re-maps devices); workers can come and go.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "1"))  # Workers sharing the shards
+SHARD_WORKER_INDEX = int(os.getenv("SHARD_WORKER_INDEX", "0"))  # This worker's index, 0..SHARD_WORKERS-1
+SHARD_EXCHANGE = f"{QUEUE_NAME}.shards"  # x-consistent-hash exchange hashing on the routing key
+SHARD_SOURCE_EXCHANGE = "amq.topic"  # Where the MQTT plugin publishes sensor telemetry
+SHARD_BINDING_KEY = "#.SENSOR"
+SHARD_OWNER_PRIORITY = 10  # Consumer priority on owned shards; other shards get a standby consumer at 0
+QUEUE_ARGUMENTS = {"x-max-length": 50000, "x-overflow": "reject-publish"}
+
+
+
+def shard_queue_name(shard: int) -> str:
+    """Virtual shard queue fed by the consistent-hash exchange"""
+    return f"{QUEUE_NAME}.shard.{shard}"
+
+
+def owned_shards(shard_count: int, workers: int, index: int) -> List[int]:
+    """Shards a worker is the preferred consumer of (round-robin over worker indices)"""
+    return [shard for shard in range(shard_count) if shard % max(workers, 1) == index]
+
+
+def retry_queue_name(attempt: int) -> str:
+    """Delay queue holding messages waiting for their Nth retry"""
+    return f"{QUEUE_NAME}.retry.{attempt}"
+
+
+def retry_delay(attempt: int) -> int:
+    """Seconds a message waits before its Nth retry (exponential, capped)"""
+    return int(min(RETRY_DELAY * RETRY_BACKOFF ** (attempt - 1), RETRY_MAX_DELAY))
+
+
+# Batch whose handler is currently running in this task; lets ack_batch()/move_batch_to_dlq()
+# settle exactly that batch when several batches are in flight
+_current_batch: contextvars.ContextVar[Optional["PendingBatch"]] = contextvars.ContextVar(
+    "current_batch", default=None
+)
+
+
+class PendingBatch:
+    """A flushed batch and the RabbitMQ messages that must be settled once it is processed"""
+
+    def __init__(
+        self,
+        payloads: List[dict],
+        messages: List[aio_pika.IncomingMessage],
+        keys: Optional[List[Any]] = None,
+    ):
+        self.payloads = payloads
+        self.messages = messages  # messages[i] carried payloads[i] (empty in auto-ack mode)
+        self.keys = keys or []  # Dedupe key per payload, remembered once the payload is acked
+        self.unsettled: Set[int] = set(range(len(messages)))
+
+    @property
+    def settled(self) -> bool:
+        return not self.unsettled
+
+    def take(self, indices: Optional[Iterable[int]] = None) -> List[aio_pika.IncomingMessage]:
+        """Detach the still-unsettled messages at the given payload indices (default: all)"""
+        wanted = self.unsettled if indices is None else self.unsettled.intersection(indices)
+        taken = sorted(wanted)
+        self.unsettled.difference_update(taken)
+        return [self.messages[i] for i in taken]
+
+
+class DeliveryTracker:
+    """
+    Tracks unacknowledged deliveries in delivery-tag order.
+
+    Settled messages are acknowledged with a single ``ack(multiple=True)`` on the
+    highest tag of the settled prefix. A batch that completes while an older one
+    is still in flight is held back until the older batch settles, so a multiple
+    ack never covers a message that is still being processed.
+    """
+
+    def __init__(self):
+        self._deliveries: "OrderedDict[Any, list]" = OrderedDict()  # delivery_tag -> [message, settled]
+
+    def __len__(self) -> int:
+        return len(self._deliveries)
+
+    def track(self, message: aio_pika.IncomingMessage):
+        self._deliveries.setdefault(message.delivery_tag, [message, False])
+
+    def forget(self, message: aio_pika.IncomingMessage):
+        """Stop tracking a message that was settled individually (e.g. nacked)"""
+        self._deliveries.pop(message.delivery_tag, None)
+
+    def settle(self, messages: Iterable[aio_pika.IncomingMessage]) -> Optional[aio_pika.IncomingMessage]:
+        """Mark messages settled; return the message to multi-ack for the settled prefix, if any"""
+        prefix = self.settle_prefix(messages)
+        return prefix[-1] if prefix else None
+
+    def settle_prefix(self, messages: Iterable[aio_pika.IncomingMessage]) -> List[aio_pika.IncomingMessage]:
+        """Mark messages settled; remove and return every message of the settled prefix, in delivery order"""
+        for msg in messages:
+            self._deliveries.setdefault(msg.delivery_tag, [msg, False])[1] = True
+
+        prefix = []
+        while self._deliveries:
+            tag, (msg, settled) = next(iter(self._deliveries.items()))
+            if not settled:
+                break
+            del self._deliveries[tag]
+            prefix.append(msg)
+        return prefix
+
+    def take_settled(self) -> List[aio_pika.IncomingMessage]:
+        """Remove and return settled deliveries still held behind an unsettled older one"""
+        settled = [tag for tag, (_, done) in self._deliveries.items() if done]
+        return [self._deliveries.pop(tag)[0] for tag in settled]
+
+    def clear(self):
+        self._deliveries.clear()
 
 
 class ObservationQueue:
-    def __init__(self, rabbitmq_url: str = RABBITMQ_URL, queue_name: str = QUEUE_NAME, auto_ack: bool = True):
+    def __init__(
+        self,
+        rabbitmq_url: str = RABBITMQ_URL,
+        queue_name: str = QUEUE_NAME,
+        auto_ack: bool = True,
+        max_inflight: int = MAX_INFLIGHT_BATCHES,
+        prefetch_count: int = PREFETCH_COUNT,
+        shard_count: int = SHARD_COUNT,
+        shard_workers: int = SHARD_WORKERS,
+        shard_index: int = SHARD_WORKER_INDEX,
+    ):
         self.rabbitmq_url = rabbitmq_url
         self.queue_name = queue_name
         self.auto_ack = auto_ack  # If False, messages won't be acknowledged
         self.connection: Optional[aio_pika.Connection] = None
         self.channel: Optional[aio_pika.Channel] = None
         self.queue: Optional[aio_pika.Queue] = None
+        self.shard_count = shard_count
+        self.owned_shards = set(owned_shards(shard_count, shard_workers, shard_index))
+        self.shard_queues: Dict[int, aio_pika.Queue] = {}
+        self.retry_exchange: Optional[aio_pika.Exchange] = None
         self.message_handler: Optional[Callable] = None
         self.batch: List[dict] = []
         self.batch_messages: List[aio_pika.IncomingMessage] = []  # Track original message objects
         self.pending_ack_messages: List[aio_pika.IncomingMessage] = []  # Messages waiting to be acknowledged
         self.batch_lock = asyncio.Lock()
         self.last_flush = datetime.now(timezone.utc)
+        self.max_inflight = max(1, max_inflight)  # Bounded pipeline depth
+        self.inflight_tasks: Set[asyncio.Task] = set()
+        self._inflight_slots = 0
+        self._inflight_cond = asyncio.Condition()
+        self.prefetch_count = prefetch_count
+        self.deliveries = DeliveryTracker()
+        self.sizer = AdaptiveBatchSizer(BATCH_SIZE, BATCH_TIMEOUT)
+        # Shrinks in-flight batches and batch size while the API signals overload
+        self.congestion: Optional[AimdController] = AimdController(self.max_inflight, BATCH_SIZE) if AIMD_ENABLED else None
+        self.dedupe: Optional[DedupeCache] = DedupeCache() if DEDUPE_ENABLED else None
+        self.batch_keys: List[Any] = []  # Dedupe keys parallel to self.batch
+        self.batch_deadline: Optional[float] = None  # Loop time by which the current batch must flush
+        self._batch_started = asyncio.Event()  # Set while the batch holds messages
+        # Fair mode: messages wait in per-topic queues and each batch is drawn from them by DRR
+        self.scheduler: Optional[FairScheduler] = FairScheduler() if FAIR_SCHEDULING else None
+        self._batch_full = asyncio.Event()  # Fair mode: a full batch is waiting
+
+    @property
+    def current_batch(self) -> Optional[PendingBatch]:
+        """Batch being handled by the calling task, if any"""
+        return _current_batch.get()
+
+    async def _take_pending(
+        self, batch: Optional[PendingBatch], indices: Optional[Iterable[int]] = None
+    ) -> List[aio_pika.IncomingMessage]:
+        """Detach the messages to settle: the given/current batch (optionally only the
+        messages behind the given payload indices), or everything pending"""
+        batch = batch or _current_batch.get()
+        async with self.batch_lock:
+            if batch is None:
+                messages = list(self.pending_ack_messages)
+                self.pending_ack_messages.clear()
+                return messages
+            messages = batch.take(indices)
+            taken = {id(msg) for msg in messages}
+            self.pending_ack_messages[:] = [m for m in self.pending_ack_messages if id(m) not in taken]
+            return messages
 
     async def connect(self):
         """Initialize RabbitMQ connection"""
         try:
             self.connection = await aio_pika.connect(self.rabbitmq_url)
             self.channel = await self.connection.channel()
-            self.queue = await self.channel.declare_queue(
-                self.queue_name,
-                durable=True,
-                arguments={"x-max-length": 50000, "x-overflow": "reject-publish"}
-            )
-            logger.info(f"[INGESTION] Connected to RabbitMQ queue: {self.queue_name}")
+            self.deliveries.clear()  # Delivery tags are per channel
+            if self.sharded:
+                # Quorum queues only take per-consumer limits: split the prefetch over the owned shards
+                await self.channel.set_qos(prefetch_count=self.shard_prefetch_count)
+                await self._declare_shard_topology()
+            else:
+                # Bound unacked deliveries so the worker never hoards the whole queue in memory
+                await self.channel.set_qos(prefetch_count=self.prefetch_count)
+                self.queue = await self.channel.declare_queue(
+                    self.queue_name,
+                    durable=True,
+                    arguments=QUEUE_ARGUMENTS,
+                )
+            await self._declare_retry_topology()
+            logger.info(f"[INGESTION] Connected to RabbitMQ queue: {self.queue_name} (prefetch={self.prefetch_count})")
         except Exception as e:
             logger.error(f"[INGESTION] Failed to connect to RabbitMQ: {e}")
             raise
 
+    @property
+    def sharded(self) -> bool:
+        return self.shard_count > 0
+
+    @property
+    def shard_prefetch_count(self) -> int:
+        """Per-consumer prefetch, so the owned shards together stay within prefetch_count"""
+        return max(1, self.prefetch_count // max(len(self.owned_shards), 1))
+
+    async def _declare_shard_topology(self):
+        """
+        Declare the sharded topology.
+
+        Sensor telemetry is routed from amq.topic into a consistent-hash exchange
+        that hashes the routing key (one MQTT topic = one device) onto
+        SHARD_COUNT shard queues, so every reading of a device lands in the same
+        shard, in order. Shard queues are single-active-consumer quorum queues:
+        every worker subscribes to every shard, with a high priority on the
+        shards it owns and as a standby on the rest. Only one consumer per shard
+        receives messages at a time, so per-device ordering holds while the
+        shards spread over workers, and a standby takes over if the owner goes
+        away. Single active consumer only honours consumer priorities on quorum
+        queues from RabbitMQ 4.0 (classic queues activate the first consumer
+        registered), so sharding requires RabbitMQ 4.0 or later.
+        """
+        shard_exchange = await self.channel.declare_exchange(
+            SHARD_EXCHANGE, "x-consistent-hash", durable=True
+        )
+        await shard_exchange.bind(SHARD_SOURCE_EXCHANGE, routing_key=SHARD_BINDING_KEY)
+        for shard in range(self.shard_count):
+            queue = await self.channel.declare_queue(
+                shard_queue_name(shard),
+                durable=True,
+                arguments={**QUEUE_ARGUMENTS, "x-queue-type": "quorum", "x-single-active-consumer": True},
+            )
+            await queue.bind(shard_exchange, routing_key="1")  # Equal weight on the hash ring
+            self.shard_queues[shard] = queue
+        self.shard_exchange = shard_exchange
+        logger.info(
+            f"[INGESTION] Shard topology ready: {self.shard_count} shards, owning {sorted(self.owned_shards)}"
+        )
+
+    async def _declare_retry_topology(self):
+        """
+        Declare the delayed-retry topology.
+
+        Failed messages are published to RETRY_EXCHANGE with a ``retry-attempt``
+        header, which routes them to the delay queue for that attempt. Each
+        message carries a per-message TTL (growing with the attempt). When it
+        expires, the broker dead-letters it into REQUEUE_EXCHANGE, which feeds
+        the main queue, with the original routing key preserved. The worker
+        never sleeps on a retry.
+        """
+        requeue_exchange = await self.channel.declare_exchange(
+            REQUEUE_EXCHANGE, aio_pika.ExchangeType.FANOUT, durable=True
+        )
+        if self.sharded:
+            # Expired retries are re-hashed on their original routing key, back to their device's shard
+            await self.shard_exchange.bind(requeue_exchange)
+        else:
+            await self.queue.bind(requeue_exchange)
+        self.retry_exchange = await self.channel.declare_exchange(
+            RETRY_EXCHANGE, aio_pika.ExchangeType.HEADERS, durable=True
+        )
+        for attempt in range(1, MAX_MESSAGE_RETRIES + 1):
+            delay_queue = await self.channel.declare_queue(
+                retry_queue_name(attempt),
+                durable=True,
+                arguments={"x-dead-letter-exchange": REQUEUE_EXCHANGE},
+            )
+            # Headers starting with "x-" are ignored for matching, hence the plain header name
+            await delay_queue.bind(
+                self.retry_exchange,
+                arguments={"x-match": "all", "retry-attempt": str(attempt)},
+            )
+        logger.info(
+            f"[INGESTION] Retry topology ready: delays "
+            f"{[retry_delay(a) for a in range(1, MAX_MESSAGE_RETRIES + 1)]}s"
+        )
+
     async def disconnect(self):
         """Close RabbitMQ connection"""
         if self.connection:
@@ -78,142 +350,396 @@ class ObservationQueue:
         self.message_handler = handler
         logger.info("[INGESTION] Registered batch handler")
 
-    async def add_to_batch(self, message: dict, rabbitmq_message: aio_pika.IncomingMessage = None):
-        """Add message to batch, optionally tracking the original RabbitMQ message"""
+    async def add_to_batch(
+        self, message: dict, rabbitmq_message: aio_pika.IncomingMessage = None, key: Any = None
+    ):
+        """Add message to batch, optionally tracking the original RabbitMQ message and its dedupe key"""
+        if self.scheduler is not None:
+            await self._add_to_topic_queue(message, rabbitmq_message, key)
+            return
+
         should_flush = False
         async with self.batch_lock:
+            self.sizer.record_arrival()
+            if not self.batch:
+                # First message of a batch starts its flush deadline
+                self.batch_deadline = asyncio.get_running_loop().time() + self.sizer.max_wait
+                self._batch_started.set()
             self.batch.append(message)
+            self.batch_keys.append(key)
             if rabbitmq_message:
                 self.batch_messages.append(rabbitmq_message)
+                self.deliveries.track(rabbitmq_message)
             logger.debug(f"[INGESTION] Added message to batch. Batch size: {len(self.batch)}")
             
             # Check if we should flush, but don't hold lock during flush
-            if len(self.batch) >= BATCH_SIZE:
+            if len(self.batch) >= self.batch_size:
                 should_flush = True
 
         # Call flush outside the lock to prevent deadlock
         if should_flush:
             await self._flush_batch()
 
-    async def ack_batch(self):
-        """Acknowledge all pending messages after successful API submission"""
+    async def _add_to_topic_queue(self, message: dict, rabbitmq_message: Optional[aio_pika.IncomingMessage], key: Any):
+        """Fair mode: queue the message under its topic; drain_fair() forms the batches"""
         async with self.batch_lock:
-            for msg in self.pending_ack_messages:
-                try:
-                    await msg.ack()
-                    logger.debug(f"[INGESTION] Acknowledged message")
-                except Exception as e:
-                    logger.error(f"[INGESTION] Failed to acknowledge message: {e}")
-            count = len(self.pending_ack_messages)
-            self.pending_ack_messages.clear()
-            logger.info(f"[INGESTION] Acknowledged {count} messages")
+            self.sizer.record_arrival()
+            if rabbitmq_message:
+                self.deliveries.track(rabbitmq_message)
+            now = asyncio.get_running_loop().time()
+            self.scheduler.push(message.get("topic", ""), message, rabbitmq_message, key, now)
+            self._batch_started.set()
+            if len(self.scheduler) >= self.batch_size:
+                self._batch_full.set()
 
-    async def move_batch_to_dlq(self):
-        """Move all pending messages to DLQ or requeue with incremented retry count"""
-        async with self.batch_lock:
-            for msg in self.pending_ack_messages:
+    async def ack_batch(self, batch: Optional[PendingBatch] = None, indices: Optional[Iterable[int]] = None):
+        """Acknowledge a batch's messages after successful API submission.
+
+        Defaults to the batch being handled by the calling task, or to every
+        pending message when called outside a batch handler. ``indices`` limits
+        the ack to the messages behind those payloads.
+        """
+        self._remember_ingested(batch or _current_batch.get(), indices)
+        messages = await self._take_pending(batch, indices)
+        await self._settle(messages)
+        for msg in messages:
+            MESSAGES_ACKED.labels(self.original_routing_key(msg)).inc()
+        logger.info(f"[INGESTION] Acknowledged {len(messages)} messages")
+
+    def _remember_ingested(self, batch: Optional[PendingBatch], indices: Optional[Iterable[int]]):
+        """Record the dedupe keys of successfully ingested payloads"""
+        if self.dedupe is None or batch is None:
+            return
+        for i in range(len(batch.keys)) if indices is None else indices:
+            if i < len(batch.keys) and batch.keys[i] is not None:
+                self.dedupe.add(batch.keys[i])
+
+    def _dedupe_key(self, message: aio_pika.IncomingMessage, routing_key: str, body: dict) -> Any:
+        if self.dedupe is None:
+            return None
+        return dedupe_key(routing_key, body.get("Time"), message.body)
+
+    async def _drop_if_duplicate(self, message: aio_pika.IncomingMessage, key: Any) -> bool:
+        """True if the message repeats an already ingested reading (settled here, before any handler work)"""
+        if key is None or not self.dedupe.seen(key):
+            return False
+        logger.debug(f"[INGESTION] Dropping duplicate reading from {key[0]} at {key[1]}")
+        if not self.auto_ack:
+            self.deliveries.track(message)
+            await self._settle([message])
+        return True
+
+    async def _settle(self, messages: List[aio_pika.IncomingMessage]):
+        """Mark messages as done and multi-ack the contiguous settled prefix"""
+        if not messages:
+            return
+        if self.sharded:
+            await self._ack_each(messages)
+            return
+        last = self.deliveries.settle(messages)
+        # Fair mode batches out of delivery order, so a message can wait in its topic queue
+        # while later deliveries settle: ack those one by one rather than let them hold prefetch
+        stragglers = self.deliveries.take_settled() if self.scheduler is not None else []
+        if last is None and not stragglers:
+            logger.debug("[INGESTION] Ack deferred until older in-flight batches settle")
+            return
+        try:
+            if last is not None:
+                await last.ack(multiple=True)
+                logger.debug(f"[INGESTION] Acknowledged deliveries up to tag {last.delivery_tag}")
+            for message in stragglers:
+                await message.ack()
+        except Exception as e:
+            logger.error(f"[INGESTION] Failed to acknowledge messages: {e}")
+
+    async def _ack_each(self, messages: List[aio_pika.IncomingMessage]):
+        """
+        Acknowledge messages one by one.
+
+        Shard queues share the channel, and each shard's iterator buffers its own
+        deliveries: a message with a lower tag can still wait in another shard's
+        iterator, untracked, so a multiple ack could settle it unprocessed.
+        """
+        for message in messages:
+            self.deliveries.forget(message)
+            try:
+                await message.ack()
+            except Exception as e:
+                logger.error(f"[INGESTION] Failed to acknowledge message {message.delivery_tag}: {e}")
+
+    @staticmethod
+    def original_routing_key(message: aio_pika.IncomingMessage) -> str:
+        """Routing key the message was first published with (survives retries and DLQ replays)"""
+        if message.headers and message.headers.get("x-original-routing-key"):
+            return str(message.headers["x-original-routing-key"])
+        return message.routing_key
+
+    async def _republish(self, publishes: List[tuple]) -> List[aio_pika.IncomingMessage]:
+        """
+        Publish (original, exchange, message, routing key) copies concurrently and await
+        their publisher confirms together. Returns the originals whose copy was confirmed;
+        the others are nacked back onto the queue.
+        """
+        results = await asyncio.gather(
+            *(exchange.publish(message, routing_key=routing_key) for _, exchange, message, routing_key in publishes),
+            return_exceptions=True,
+        )
+        confirmed = []
+        for (original, _, _, _), result in zip(publishes, results):
+            if not isinstance(result, BaseException):
+                confirmed.append(original)
+                continue
+            logger.error(f"[INGESTION] Failed to republish failed message: {result}")
+            # As fallback, NACK to requeue
+            self.deliveries.forget(original)
+            try:
+                await original.nack(requeue=True)
+            except Exception:
+                pass
+        return confirmed
+
+    async def move_batch_to_dlq(self, batch: Optional[PendingBatch] = None, indices: Optional[Iterable[int]] = None):
+        """Move a batch's messages (or those behind ``indices``) to DLQ or requeue with incremented retry count"""
+        messages = await self._take_pending(batch, indices)
+        publishes = []
+        to_dlq = set()  # ids of the messages going to the DLQ rather than a delay queue
+        failed_at = datetime.now(timezone.utc).isoformat()
+        for msg in messages:
+            # Get current retry count from message headers
+            retry_count = 0
+            if msg.headers and "x-retry-count" in msg.headers:
                 try:
-                    # Get current retry count from message headers
-                    retry_count = 0
-                    if msg.headers and "x-retry-count" in msg.headers:
-                        retry_count = int(msg.headers["x-retry-count"])
-                    
-                    if retry_count >= MAX_MESSAGE_RETRIES:
-                        # Max retries exceeded - move to DLQ
-                        await self.channel.default_exchange.publish(
-                            aio_pika.Message(
-                                body=msg.body,
-                                headers={
-                                    "x-retry-count": retry_count,
-                                    "x-failed-at": datetime.now(timezone.utc).isoformat(),
-                                    "x-original-routing-key": msg.routing_key,
-                                },
-                                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-                            ),
-                            routing_key=DLQ_NAME,
-                        )
-                        # ACK the original message (it's been moved to DLQ)
-                        await msg.ack()
-                        logger.warning(f"[INGESTION] Message moved to DLQ after {retry_count} retries")
-                    else:
-                        # Republish with incremented retry count
-                        await self.channel.default_exchange.publish(
-                            aio_pika.Message(
-                                body=msg.body,
-                                headers={"x-retry-count": retry_count + 1},
-                                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-                            ),
-                            routing_key=QUEUE_NAME,
-                        )
-                        # ACK the original message (it's been requeued with new retry count)
-                        await msg.ack()
-                        logger.debug(f"[INGESTION] Message requeued with retry count {retry_count + 1}")
-                        
-                except Exception as e:
-                    logger.error(f"[INGESTION] Failed to handle failed message: {e}")
-                    # As fallback, NACK to requeue
-                    try:
-                        await msg.nack(requeue=True)
-                    except:
-                        pass
-            
-            count = len(self.pending_ack_messages)
-            self.pending_ack_messages.clear()
-            logger.info(f"[INGESTION] Processed {count} failed messages (retry or DLQ)")
+                    retry_count = int(msg.headers["x-retry-count"])
+                except (TypeError, ValueError):
+                    pass
+
+            if retry_count >= MAX_MESSAGE_RETRIES:
+                # Max retries exceeded - move to DLQ
+                publishes.append((msg, self.channel.default_exchange, aio_pika.Message(
+                    body=msg.body,
+                    headers={
+                        "x-retry-count": retry_count,
+                        "x-failed-at": failed_at,
+                        "x-original-routing-key": self.original_routing_key(msg),
+                    },
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                ), DLQ_NAME))
+                to_dlq.add(id(msg))
+            else:
+                # Park in the delay queue for this attempt; the broker requeues it when the TTL expires
+                attempt = retry_count + 1
+                publishes.append((msg, self.retry_exchange, aio_pika.Message(
+                    body=msg.body,
+                    headers={
+                        "x-retry-count": attempt,
+                        "retry-attempt": str(attempt),
+                        "x-original-routing-key": self.original_routing_key(msg),
+                    },
+                    expiration=retry_delay(attempt),
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                ), self.original_routing_key(msg)))
+
+        # Originals are settled (multi-acked) only once their copies are confirmed
+        settled = await self._republish(publishes)
+        await self._settle(settled)
+        dead_lettered = 0
+        for msg in settled:
+            if id(msg) in to_dlq:
+                dead_lettered += 1
+                MESSAGES_DEAD_LETTERED.labels(self.original_routing_key(msg), "retries-exhausted").inc()
+            else:
+                MESSAGES_REQUEUED.labels(self.original_routing_key(msg)).inc()
+        if dead_lettered:
+            logger.warning(f"[INGESTION] {dead_lettered} messages moved to DLQ after {MAX_MESSAGE_RETRIES} retries")
+        logger.info(f"[INGESTION] Processed {len(messages)} failed messages (retry or DLQ)")
+
+    async def dead_letter_batch(
+        self, indices: Iterable[int], reason: str = "", batch: Optional[PendingBatch] = None
+    ):
+        """Send the messages behind the given payload indices straight to the DLQ (poison messages)"""
+        batch = batch or _current_batch.get()
+        if batch is None:
+            raise RuntimeError("dead_letter_batch() needs a batch (call it from the batch handler)")
+        messages = await self._take_pending(batch, indices)
+        await self.dead_letter(messages, reason)
+
+    async def dead_letter(self, messages: List[aio_pika.IncomingMessage], reason: str = ""):
+        """Publish messages straight to the DLQ (no retries) and settle them"""
+        failed_at = datetime.now(timezone.utc).isoformat()
+        publishes = []
+        for msg in messages:
+            try:
+                retry_count = int(msg.headers.get("x-retry-count", 0)) if msg.headers else 0
+            except (TypeError, ValueError):
+                retry_count = 0
+            publishes.append((msg, self.channel.default_exchange, aio_pika.Message(
+                body=msg.body,
+                headers={
+                    "x-retry-count": retry_count,
+                    "x-failed-at": failed_at,
+                    "x-original-routing-key": self.original_routing_key(msg),
+                    "x-failure-reason": reason,
+                },
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ), DLQ_NAME))
+        settled = await self._republish(publishes)
+        if settled:
+            logger.warning(f"[INGESTION] {len(settled)} messages moved to DLQ ({reason})")
+        await self._settle(settled)
+        for msg in settled:
+            MESSAGES_DEAD_LETTERED.labels(self.original_routing_key(msg), reason or "unknown").inc()
 
     async def _should_flush(self) -> bool:
-        """Check if batch should be flushed based on time or size"""
+        """Check if batch should be flushed based on its deadline or size"""
         if not self.batch:
             return False
-        
-        time_since_last_flush = (datetime.now(timezone.utc) - self.last_flush).total_seconds()
-        return time_since_last_flush >= BATCH_TIMEOUT or len(self.batch) >= BATCH_SIZE
+
+        deadline_passed = self.batch_deadline is not None and asyncio.get_running_loop().time() >= self.batch_deadline
+        return deadline_passed or len(self.batch) >= self.batch_size
+
+    @property
+    def batch_size(self) -> int:
+        """Messages to collect before flushing: the sizer's target, capped by the congestion window"""
+        size = self.sizer.batch_size
+        if self.congestion is not None:
+            size = min(size, self.congestion.batch_size)
+        return size
+
+    @property
+    def inflight_limit(self) -> int:
+        """Batches that may be handled concurrently right now"""
+        if self.congestion is None:
+            return self.max_inflight
+        return min(self.max_inflight, self.congestion.inflight_limit)
 
     async def _flush_batch(self):
-        """Flush current batch to handler"""
-        batch_to_send = None
-        messages_to_ack = None
+        """Flush current batch to handler.
+
+        With max_inflight == 1 the handler runs inline, so consumption waits for
+        the batch to be submitted. With a deeper pipeline the handler runs as a
+        background task and consumption only blocks once max_inflight batches
+        are outstanding.
+        """
+        if self.max_inflight > 1:
+            await self._acquire_inflight_slot()
 
         # Prepare batch while holding lock
         async with self.batch_lock:
-            if not self.batch or not self.message_handler:
-                return
-
-            batch_to_send = self.batch.copy()
-            messages_to_ack = self.batch_messages.copy()
-            self.batch.clear()
-            self.batch_messages.clear()
-            self.last_flush = datetime.now(timezone.utc)
-            
-            # Move messages to pending BEFORE calling handler (so ack_batch() has them available)
-            self.pending_ack_messages.extend(messages_to_ack)
+            if self.scheduler is not None:
+                pending = self._take_fair_batch()
+            elif not self.batch or not self.message_handler:
+                pending = None
+            else:
+                pending = PendingBatch(self.batch.copy(), self.batch_messages.copy(), self.batch_keys.copy())
+                self.batch.clear()
+                self.batch_messages.clear()
+                self.batch_keys.clear()
+                self.last_flush = datetime.now(timezone.utc)
+                self.batch_deadline = None
+                self._batch_started.clear()
+
+                # Move messages to pending BEFORE calling handler (so ack_batch() has them available)
+                self.pending_ack_messages.extend(pending.messages)
+
+        if self.max_inflight <= 1:
+            if pending:
+                await self._run_batch(pending)
+            return
+
+        if not pending:
+            await self._release_inflight_slot()
+            return
+
+        task = asyncio.create_task(self._run_batch(pending))
+        self.inflight_tasks.add(task)
+        task.add_done_callback(self._on_batch_done)
 
+    def _take_fair_batch(self) -> Optional[PendingBatch]:
+        """Fair mode: draw the next batch from the topic queues (caller holds batch_lock)"""
+        entries = self.scheduler.take(self.batch_size, asyncio.get_running_loop().time()) if self.message_handler else []
+        if not len(self.scheduler):
+            self._batch_started.clear()
+        if len(self.scheduler) < self.batch_size:
+            self._batch_full.clear()
+        if not entries:
+            return None
+        pending = PendingBatch(
+            [payload for payload, _, _, _ in entries],
+            [message for _, message, _, _ in entries if message is not None],
+            [key for _, _, key, _ in entries],
+        )
+        self.last_flush = datetime.now(timezone.utc)
+        self.pending_ack_messages.extend(pending.messages)
+        return pending
+
+    async def _run_batch(self, pending: PendingBatch):
+        """Run the handler for one batch, settling its messages if the handler did not"""
+        token = _current_batch.set(pending)
+        started = time.monotonic()
         # Call handler OUTSIDE the lock to prevent deadlock when handler calls ack_batch()
         try:
-            logger.info(f"[INGESTION] Flushing batch with {len(batch_to_send)} messages")
-            await self.message_handler(batch_to_send)
+            logger.info(f"[INGESTION] Flushing batch with {len(pending.payloads)} messages")
+            BATCH_SIZES.observe(len(pending.payloads))
+            await self.message_handler(pending.payloads)
+            self.sizer.record_batch(time.monotonic() - started)
         except Exception as e:
             logger.error(f"[INGESTION] Error processing batch: {e}")
             logger.warning("[INGESTION] Messages in failed batch will be NACKed and retried")
+        finally:
+            if not pending.settled:
+                try:
+                    await self.move_batch_to_dlq(pending)
+                except Exception as e:
+                    logger.error(f"[INGESTION] Failed to requeue unsettled batch: {e}")
+            _current_batch.reset(token)
+
+    @property
+    def inflight_count(self) -> int:
+        return self._inflight_slots
+
+    async def _acquire_inflight_slot(self):
+        async with self._inflight_cond:
+            # The limit is re-read on every release, so a shrinking congestion window drains the pipeline
+            await self._inflight_cond.wait_for(lambda: self._inflight_slots < self.inflight_limit)
+            self._inflight_slots += 1
+
+    async def _release_inflight_slot(self):
+        async with self._inflight_cond:
+            self._inflight_slots -= 1
+            self._inflight_cond.notify_all()
+
+    def _on_batch_done(self, task: asyncio.Task):
+        self.inflight_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"[INGESTION] Batch task failed: {task.exception()}")
+        asyncio.ensure_future(self._release_inflight_slot())
+
+    async def wait_inflight(self):
+        """Wait until every in-flight batch has been handled"""
+        if self.inflight_tasks:
+            await asyncio.gather(*self.inflight_tasks, return_exceptions=True)
 
     async def consume_messages(self):
         """Consume messages from queue and add to batch"""
-        if not self.queue:
+        if not self.queue and not self.shard_queues:
             raise RuntimeError("Queue not initialized. Call connect() first.")
 
         logger.info("[INGESTION] Starting message consumption...")
         
         async def message_callback(message: aio_pika.IncomingMessage):
+            MESSAGES_CONSUMED.labels(self.original_routing_key(message)).inc()
             # If auto_ack is False, don't acknowledge the message
             if self.auto_ack:
                 async with message.process():
                     try:
                         body = json.loads(message.body.decode())
                         # Extract routing key from RabbitMQ message metadata
-                        routing_key = message.routing_key
+                        routing_key = self.original_routing_key(message)
                         body["topic"] = routing_key
                         logger.debug(f"[INGESTION] Received message: {body}")
-                        await self.add_to_batch(body)
+                        key = self._dedupe_key(message, routing_key, body)
+                        if not await self._drop_if_duplicate(message, key):
+                            await self.add_to_batch(body, key=key)
                     except json.JSONDecodeError as e:
                         logger.error(f"[INGESTION] Failed to decode message: {e}")
                     except Exception as e:
@@ -223,55 +749,134 @@ class ObservationQueue:
                 try:
                     body = json.loads(message.body.decode())
                     # Extract routing key from RabbitMQ message metadata
-                    routing_key = message.routing_key
+                    routing_key = self.original_routing_key(message)
                     body["topic"] = routing_key
                     logger.debug(f"[INGESTION] Received message (NO-ACK): {body}")
+                    key = self._dedupe_key(message, routing_key, body)
+                    if await self._drop_if_duplicate(message, key):
+                        return
                     # Track original message for later acknowledgment
-                    await self.add_to_batch(body, rabbitmq_message=message)
+                    await self.add_to_batch(body, rabbitmq_message=message, key=key)
                 except json.JSONDecodeError as e:
                     logger.error(f"[INGESTION] Failed to decode message: {e}")
+                    # Settle it now - an unsettled delivery would hold back every later multi-ack
+                    await self.dead_letter([message], reason="undecodable")
                 except Exception as e:
                     logger.error(f"[INGESTION] Error processing message: {e}")
+                    await self.dead_letter([message], reason="consume-error")
+
+        async def consume(queue: aio_pika.Queue, **kwargs):
+            # One iterator per queue, handled sequentially, keeps each queue's order into the batch
+            async with queue.iterator(**kwargs) as queue_iter:
+                async for message in queue_iter:
+                    await message_callback(message)
 
         # Consume messages
-        async with self.queue.iterator() as queue_iter:
-            async for message in queue_iter:
-                await message_callback(message)
+        if not self.sharded:
+            await consume(self.queue)
+            return
+        await asyncio.gather(*(
+            consume(queue, arguments={"x-priority": SHARD_OWNER_PRIORITY if shard in self.owned_shards else 0})
+            for shard, queue in self.shard_queues.items()
+        ))
+
+    async def queue_depth(self) -> Optional[int]:
+        """
+        Messages ready in the queue(s) this worker consumes (its owned shards when sharded), None if unknown.
+
+        Polled on a short-lived channel of its own: a passive declare of a missing
+        queue fails with 404, which closes the channel it ran on, and that must
+        not be the channel the consumers are on.
+        """
+        names = [shard_queue_name(shard) for shard in sorted(self.owned_shards)] if self.sharded else [self.queue_name]
+        channel = await self.connection.channel()
+        try:
+            depth = 0
+            for name in names:
+                queue = await channel.declare_queue(name, passive=True)
+                depth += queue.declaration_result.message_count
+            return depth
+        finally:
+            if not channel.is_closed:
+                await channel.close()
+
+    async def flush_on_deadline(self):
+        """Flush a partial batch exactly when its oldest message reaches the flush deadline"""
+        logger.info("[INGESTION] Starting batch deadline timer")
+        loop = asyncio.get_running_loop()
 
-    async def flush_periodically(self):
-        """Periodically flush batch if threshold time is reached"""
-        logger.info("[INGESTION] Starting periodic batch flush timer")
-        
         while True:
             try:
-                await asyncio.sleep(1)  # Check every second
+                # Sleep until a batch exists, then until its deadline (re-checked: a size
+                # flush may have started a newer batch with a later deadline meanwhile)
+                await self._batch_started.wait()
+                deadline = self.batch_deadline
+                if deadline is not None and deadline > loop.time():
+                    await asyncio.sleep(deadline - loop.time())
+                    continue
+
                 should_flush = False
-                
                 async with self.batch_lock:
                     if await self._should_flush():
                         should_flush = True
+                    elif not self.batch:
+                        self._batch_started.clear()
 
                 # Call flush outside the lock to prevent deadlock
                 if should_flush:
                     await self._flush_batch()
                     
             except asyncio.CancelledError:
-                logger.info("[INGESTION] Periodic flush task cancelled")
-                # Final flush before exit
-                async with self.batch_lock:
-                    if self.batch:
-                        await self._flush_batch()
+                logger.info("[INGESTION] Batch deadline timer cancelled")
+                # Final flush before exit (_flush_batch takes the lock itself)
+                if self.batch:
+                    await self._flush_batch()
+                break
+            except Exception as e:
+                logger.error(f"[INGESTION] Error in batch deadline timer: {e}")
+                await asyncio.sleep(1)
+
+    async def drain_fair(self):
+        """
+        Fair mode: flush a batch whenever a full one is waiting or the oldest queued
+        message reaches its deadline.
+
+        Consumption does not wait for the flush, so while every pipeline slot is busy
+        messages keep arriving into the topic queues (up to the prefetch window) and
+        the batch is drawn from all of them once a slot frees up.
+        """
+        logger.info("[INGESTION] Starting fair batch scheduler")
+        loop = asyncio.get_running_loop()
+
+        while True:
+            try:
+                await self._batch_started.wait()
+                oldest = self.scheduler.oldest
+                if len(self.scheduler) < self.batch_size and oldest is not None:
+                    delay = oldest + self.sizer.max_wait - loop.time()
+                    if delay > 0:
+                        try:
+                            await asyncio.wait_for(self._batch_full.wait(), timeout=delay)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                await self._flush_batch()
+            except asyncio.CancelledError:
+                logger.info("[INGESTION] Fair batch scheduler cancelled")
+                while len(self.scheduler) and self.message_handler:
+                    await self._flush_batch()
                 break
             except Exception as e:
-                logger.error(f"[INGESTION] Error in periodic flush: {e}")
+                logger.error(f"[INGESTION] Error in fair batch scheduler: {e}")
+                await asyncio.sleep(1)
 
     async def start_consuming(self):
-        """Start consuming messages with periodic flush"""
+        """Start consuming messages with deadline-driven flushing"""
         if not self.message_handler:
             raise RuntimeError("No message handler registered. Call register_handler() first.")
 
-        # Start periodic flush task
-        flush_task = asyncio.create_task(self.flush_periodically())
+        # Start the batch deadline timer (or, in fair mode, the scheduler that forms every batch)
+        flush_task = asyncio.create_task(self.drain_fair() if self.scheduler is not None else self.flush_on_deadline())
         
         try:
             # Start consuming (blocks indefinitely)
@@ -284,3 +889,4 @@ class ObservationQueue:
                 await flush_task
             except asyncio.CancelledError:
                 pass
+            await self.wait_inflight()
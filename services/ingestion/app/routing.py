@@ -0,0 +1,177 @@
+"""
+Routing-key index for the ingestion worker
+
+Resolves an AMQP routing key straight to its compiled extractor and datastream
+map. Exact topics live in a dict keyed by the routing key itself (no per-message
+string conversion); MQTT-style wildcard topics (``+`` = one level, ``#`` = the
+rest) live in a trie so one config entry can cover a family of devices.
+Unknown routing keys are remembered in a bounded negative cache and reported
+through rate-limited logging instead of one warning per message.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from shared.logger.logging_config import setup_logging_json, setup_logging_colored
+from app.handlers import Extractor, compile_topic_config
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+if LOG_FORMAT == "colored":
+    logger = setup_logging_colored("home-telemetry-ingestion-routing")
+else:
+    logger = setup_logging_json("home-telemetry-ingestion-routing")
+
+UNKNOWN_TOPIC_CACHE_SIZE = int(os.getenv("UNKNOWN_TOPIC_CACHE_SIZE", "1024"))
+UNKNOWN_TOPIC_LOG_INTERVAL = int(os.getenv("UNKNOWN_TOPIC_LOG_INTERVAL", "60"))  # seconds
+WILDCARD_CACHE_SIZE = int(os.getenv("WILDCARD_CACHE_SIZE", "4096"))
+
+
+def mqtt_topic_to_routing_key(mqtt_topic: str) -> str:
+    """"tele/NOUS_A1T_4E4984/SENSOR" → "tele.NOUS_A1T_4E4984.SENSOR" (as bridged by RabbitMQ MQTT)"""
+    return mqtt_topic.replace("/", ".")
+
+
+class TopicRoute:
+    """A resolved topic: its config model, datastream map and compiled extractor"""
+
+    __slots__ = ("topic", "model", "datastreams", "extractor")
+
+    def __init__(self, topic: str, model: Optional[str], datastreams: Dict[str, str], extractor: Extractor):
+        self.topic = topic
+        self.model = model
+        self.datastreams = datastreams
+        self.extractor = extractor
+
+
+class _TrieNode:
+    __slots__ = ("children", "route", "multi_route")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.route: Optional[TopicRoute] = None  # Route ending exactly at this level
+        self.multi_route: Optional[TopicRoute] = None  # Route for "#" at this level
+
+
+class TopicIndex:
+    """Prebuilt routing-key → TopicRoute index with wildcard trie and negative cache"""
+
+    def __init__(
+        self,
+        negative_cache_size: int = UNKNOWN_TOPIC_CACHE_SIZE,
+        log_interval: int = UNKNOWN_TOPIC_LOG_INTERVAL,
+        wildcard_cache_size: int = WILDCARD_CACHE_SIZE,
+    ):
+        self.exact: Dict[str, TopicRoute] = {}
+        self.trie = _TrieNode()
+        self.wildcard_count = 0
+        self.negative_cache_size = negative_cache_size
+        self.log_interval = log_interval
+        self.wildcard_cache_size = wildcard_cache_size
+        self._wildcard_hits: "OrderedDict[str, TopicRoute]" = OrderedDict()
+        self._unknown: "OrderedDict[str, int]" = OrderedDict()  # routing key → suppressed count
+        self._suppressed = 0
+        self._last_summary = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.exact) + self.wildcard_count
+
+    @classmethod
+    def build(cls, config_map: Dict[str, dict], **kwargs) -> "TopicIndex":
+        """Compile every topic config and index it by routing key"""
+        index = cls(**kwargs)
+        for mqtt_topic, cfg in config_map.items():
+            try:
+                extractor = compile_topic_config(cfg)
+            except Exception as e:
+                logger.error(f"Invalid extractor config for {mqtt_topic}: {e}")
+                continue
+            if extractor is None:
+                logger.warning(f"No extractor spec for model '{cfg.get('model')}' (topic {mqtt_topic})")
+                continue
+            index.add(TopicRoute(mqtt_topic, cfg.get("model"), cfg.get("datastreams", {}), extractor))
+        return index
+
+    def add(self, route: TopicRoute):
+        """Index a route under its topic, in the trie if the topic has wildcards"""
+        levels = route.topic.split("/")
+        if "+" not in levels and "#" not in levels:
+            self.exact[mqtt_topic_to_routing_key(route.topic)] = route
+            return
+
+        node = self.trie
+        for i, level in enumerate(levels):
+            if level == "#":
+                if i != len(levels) - 1:
+                    logger.error(f"Invalid topic pattern (# must be last): {route.topic}")
+                    return
+                node.multi_route = route
+                break
+            node = node.children.setdefault(level, _TrieNode())
+        else:
+            node.route = route
+        self.wildcard_count += 1
+
+    def resolve(self, routing_key: str) -> Optional[TopicRoute]:
+        """Route for a routing key, or None (recorded in the negative cache) if unconfigured"""
+        route = self.exact.get(routing_key)
+        if route is not None:
+            return route
+
+        if routing_key in self._unknown:
+            self._unknown.move_to_end(routing_key)
+            self._unknown[routing_key] += 1
+            self._suppressed += 1
+            self._maybe_log_summary()
+            return None
+
+        if self.wildcard_count:
+            route = self._wildcard_hits.get(routing_key)
+            if route is not None:
+                self._wildcard_hits.move_to_end(routing_key)
+                return route
+            route = self._match(self.trie, routing_key.split("."), 0)
+            if route is not None:
+                self._wildcard_hits[routing_key] = route
+                if len(self._wildcard_hits) > self.wildcard_cache_size:
+                    self._wildcard_hits.popitem(last=False)
+                return route
+
+        self._remember_unknown(routing_key)
+        return None
+
+    def _match(self, node: _TrieNode, levels: list, i: int) -> Optional[TopicRoute]:
+        """Most specific match: literal level, then "+", then "#"."""
+        if i == len(levels):
+            return node.route or node.multi_route
+        for key in (levels[i], "+"):
+            child = node.children.get(key)
+            if child is not None:
+                route = self._match(child, levels, i + 1)
+                if route is not None:
+                    return route
+        return node.multi_route
+
+    def _remember_unknown(self, routing_key: str):
+        self._unknown[routing_key] = 0
+        if len(self._unknown) > self.negative_cache_size:
+            self._unknown.popitem(last=False)
+        logger.warning(f"No topic config found for: {routing_key} (further messages are counted, not logged)")
+
+    def _maybe_log_summary(self):
+        now = time.monotonic()
+        if now - self._last_summary < self.log_interval:
+            return
+        self._last_summary = now
+        if self._suppressed:
+            noisiest = sorted(self._unknown.items(), key=lambda kv: kv[1], reverse=True)[:5]
+            logger.warning(
+                f"{self._suppressed} messages for {len(self._unknown)} unknown topics in the last "
+                f"{self.log_interval}s - scheduled for delayed retry, then dead-lettered",
+                extra={"top_unknown_topics": dict(noisiest)},
+            )
+            self._suppressed = 0
+
+    @property
+    def unknown_topics(self) -> Dict[str, int]:
+        """Unknown routing keys currently in the negative cache and their suppressed message counts"""
+        return dict(self._unknown)
@@ -0,0 +1,165 @@
+"""
+Fair per-topic scheduling for the ingestion batcher
+
+With a single FIFO batch, a chatty device (a power meter reporting every
+second) fills batch after batch while a temperature sensor's reading waits
+behind its backlog. With FAIR_SCHEDULING on, received messages are queued per
+topic and each batch is drawn from those queues by deficit round robin: every
+round, each waiting topic may add up to FAIR_QUANTUM messages, so a quiet
+topic's reading makes the next batch however much a chatty one has queued.
+Order within a topic is kept.
+
+Per-topic rate caps (token buckets, FAIR_TOPIC_RATE / FAIR_TOPIC_RATES) are
+work-conserving: a topic over its cap is batched only once no topic within its
+cap has messages waiting, so spare capacity is never left idle.
+"""
+import fnmatch
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from shared.logger.logging_config import setup_logging_json, setup_logging_colored
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+if LOG_FORMAT == "colored":
+    logger = setup_logging_colored("home-telemetry-ingestion-scheduling")
+else:
+    logger = setup_logging_json("home-telemetry-ingestion-scheduling")
+
+FAIR_SCHEDULING = os.getenv("FAIR_SCHEDULING", "false").lower() == "true"
+FAIR_QUANTUM = int(os.getenv("FAIR_QUANTUM", "10"))  # Messages a topic may add to a batch per round
+FAIR_TOPIC_RATE = float(os.getenv("FAIR_TOPIC_RATE", "0"))  # Default per-topic cap in messages/s (0 = none)
+FAIR_TOPIC_RATES = os.getenv("FAIR_TOPIC_RATES", "")  # Per-topic caps, e.g. "tele.A1T_*.SENSOR=1,tele.X.SENSOR=0.2"
+FAIR_RATE_BURST = float(os.getenv("FAIR_RATE_BURST", "5"))  # Seconds of its rate a topic may send at once
+
+Entry = Tuple[dict, Any, Any, float]  # payload, RabbitMQ message, dedupe key, arrival time
+
+
+def parse_topic_rates(spec: str) -> List[Tuple[str, float]]:
+    """(routing-key glob, messages/s) pairs from a FAIR_TOPIC_RATES value; the first matching glob wins"""
+    rates = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        pattern, _, value = item.strip().rpartition("=")
+        try:
+            if not pattern:
+                raise ValueError("expected glob=rate")
+            rates.append((pattern.strip(), float(value)))
+        except ValueError as e:
+            logger.error(f"Invalid FAIR_TOPIC_RATES entry {item.strip()!r}: {e}")
+    return rates
+
+
+class TopicQueue:
+    """One topic's waiting messages, DRR deficit and rate-cap token bucket"""
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.entries: Deque[Entry] = deque()
+        self.deficit = 0
+        self.rate = rate
+        self.capacity = max(rate * burst, 1.0) if rate > 0 else 0.0
+        self.tokens = self.capacity
+        self.refilled = now
+
+    def refill(self, now: float):
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    @property
+    def within_cap(self) -> bool:
+        return self.rate <= 0 or self.tokens >= 1
+
+    def pop(self) -> Entry:
+        self.deficit -= 1
+        if self.rate > 0:
+            # Service beyond the cap is owed back (bounded, so an idle spell clears it)
+            self.tokens = max(self.tokens - 1, -self.capacity)
+        return self.entries.popleft()
+
+
+class FairScheduler:
+    """Per-topic queues drained into batches by deficit round robin, with work-conserving rate caps"""
+
+    def __init__(
+        self,
+        quantum: int = FAIR_QUANTUM,
+        default_rate: float = FAIR_TOPIC_RATE,
+        rates: Optional[List[Tuple[str, float]]] = None,
+        burst: float = FAIR_RATE_BURST,
+    ):
+        self.quantum = max(1, quantum)
+        self.default_rate = default_rate
+        self.rates = parse_topic_rates(FAIR_TOPIC_RATES) if rates is None else rates
+        self.burst = burst
+        self.topics: Dict[str, TopicQueue] = {}
+        self.active: Deque[str] = deque()  # Topics with waiting messages, in round-robin order
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def rate_for(self, topic: str) -> float:
+        for pattern, rate in self.rates:
+            if fnmatch.fnmatchcase(topic, pattern):
+                return rate
+        return self.default_rate
+
+    def push(self, topic: str, payload: dict, message: Any = None, key: Any = None, now: Optional[float] = None):
+        """Queue one received message behind the earlier ones from its topic"""
+        now = time.monotonic() if now is None else now
+        queue = self.topics.get(topic)
+        if queue is None:
+            queue = self.topics[topic] = TopicQueue(self.rate_for(topic), self.burst, now)
+        if not queue.entries:
+            self.active.append(topic)
+        queue.entries.append((payload, message, key, now))
+        self.size += 1
+
+    @property
+    def oldest(self) -> Optional[float]:
+        """Arrival time of the longest-waiting message"""
+        return min((self.topics[topic].entries[0][3] for topic in self.active), default=None)
+
+    def take(self, count: int, now: Optional[float] = None) -> List[Entry]:
+        """Up to ``count`` messages: topics within their rate cap first, then (if room is left) the rest"""
+        now = time.monotonic() if now is None else now
+        for topic in self.active:
+            self.topics[topic].refill(now)
+        batch: List[Entry] = []
+        self._round_robin(batch, count, capped=True)
+        if len(batch) < count:
+            self._round_robin(batch, count, capped=False)
+        return batch
+
+    def _round_robin(self, batch: List[Entry], count: int, capped: bool):
+        skipped = 0  # Topics passed over in a row because they are over their cap
+        while len(batch) < count and self.active and skipped < len(self.active):
+            topic = self.active[0]
+            queue = self.topics[topic]
+            if capped and not queue.within_cap:
+                self.active.rotate(-1)
+                skipped += 1
+                continue
+            skipped = 0
+            if queue.deficit < 1:
+                queue.deficit += self.quantum
+            before = len(batch)
+            while queue.entries and queue.deficit >= 1 and len(batch) < count and (queue.within_cap or not capped):
+                batch.append(queue.pop())
+            self.size -= len(batch) - before
+
+            if not queue.entries:
+                queue.deficit = 0
+                self.active.popleft()
+            elif queue.deficit < 1 or (capped and not queue.within_cap):
+                self.active.rotate(-1)
+            # Otherwise the batch is full: the topic keeps its turn and deficit for the next one
+
+    def as_dict(self) -> dict:
+        return {
+            "waiting": self.size,
+            "topics_waiting": len(self.active),
+            "over_cap": sum(1 for topic in self.active if not self.topics[topic].within_cap),
+        }
@@ -0,0 +1,223 @@
+"""
+On-disk spool for observations that could not be sent during an API outage
+
+An append-only log of JSON-ready observation rows split into numbered segment
+files. Each append is one line (one batch of rows) followed by a single fsync,
+so the worker can acknowledge the RabbitMQ messages behind it as soon as
+append() returns. A cursor file records how far replay has got; segments behind
+the cursor are deleted. A torn last line (crash mid-write) is skipped on read.
+
+All file I/O runs in a worker thread so the event loop keeps consuming.
+"""
+import asyncio
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+from shared.logger.logging_config import setup_logging_json, setup_logging_colored
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+if LOG_FORMAT == "colored":
+    logger = setup_logging_colored("home-telemetry-ingestion-spool")
+else:
+    logger = setup_logging_json("home-telemetry-ingestion-spool")
+
+SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "false").lower() == "true"
+SPOOL_DIR = os.getenv("SPOOL_DIR", "/var/lib/ingestion/spool")
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", str(1024 * 1024 * 1024)))
+SPOOL_REPLAY_BATCH = int(os.getenv("SPOOL_REPLAY_BATCH", "500"))  # rows per replayed bulk request
+SPOOL_REPLAY_RATE = float(os.getenv("SPOOL_REPLAY_RATE", "2000"))  # rows per second while replaying
+SPOOL_PROBE_INTERVAL = float(os.getenv("SPOOL_PROBE_INTERVAL", "5"))  # seconds between replay attempts in an outage
+
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+REJECTED_FILE = "rejected.jsonl"  # Spooled rows the API refused on replay, kept for inspection
+
+# (segment number, byte offset) of the next unread line
+Position = Tuple[int, int]
+
+
+def _segment_name(number: int) -> str:
+    return f"{number:012d}{SEGMENT_SUFFIX}"
+
+
+class ObservationSpool:
+    """Append-only, segment-based disk spool of observation rows"""
+
+    def __init__(
+        self,
+        directory: str = SPOOL_DIR,
+        segment_bytes: int = SPOOL_SEGMENT_BYTES,
+        max_bytes: int = SPOOL_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.segments: List[int] = []
+        self.cursor: Position = (0, 0)
+        self.size_bytes = 0  # Bytes on disk across all segments (including already replayed parts)
+        self._writer = None
+        self._lock = asyncio.Lock()
+        self.data_available = asyncio.Event()  # Set while there is unreplayed data
+
+    # ---- lifecycle ----
+
+    async def open(self):
+        """Create the spool directory and recover segments and cursor from a previous run"""
+        await asyncio.to_thread(self._open)
+        if not self.is_empty():
+            self.data_available.set()
+        logger.info(
+            f"Spool opened at {self.directory}: {len(self.segments)} segments, {self.size_bytes} bytes",
+            extra={"cursor": list(self.cursor)},
+        )
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.segments = sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+        self.size_bytes = sum(os.path.getsize(self._path(n)) for n in self.segments)
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                segment, offset = json.load(f)
+            self.cursor = (int(segment), int(offset))
+        except (FileNotFoundError, ValueError):
+            self.cursor = (self.segments[0], 0) if self.segments else (0, 0)
+
+    async def close(self):
+        async with self._lock:
+            if self._writer is not None:
+                await asyncio.to_thread(self._writer.close)
+                self._writer = None
+
+    def _path(self, number: int) -> str:
+        return os.path.join(self.directory, _segment_name(number))
+
+    def is_empty(self) -> bool:
+        if not self.segments:
+            return True
+        last = self.segments[-1]
+        return self.cursor >= (last, os.path.getsize(self._path(last)))
+
+    # ---- writing ----
+
+    async def append(self, rows: List[Dict[str, Any]]) -> bool:
+        """Durably append one batch of rows; False if the spool is full (rows not written)"""
+        if not rows:
+            return True
+        line = (json.dumps(rows, separators=(",", ":")) + "\n").encode()
+        async with self._lock:
+            if self.size_bytes + len(line) > self.max_bytes:
+                logger.error(f"Spool full ({self.size_bytes} bytes) - not spooling {len(rows)} rows")
+                return False
+            await asyncio.to_thread(self._append, line)
+        self.data_available.set()
+        return True
+
+    def _append(self, line: bytes):
+        if self._writer is None or self._writer.tell() >= self.segment_bytes:
+            self._roll()
+        self._writer.write(line)
+        self._writer.flush()
+        os.fsync(self._writer.fileno())  # One fsync per batch, not per row
+        self.size_bytes += len(line)
+
+    def _roll(self):
+        if self._writer is not None:
+            self._writer.close()
+        number = self.segments[-1] + 1 if self.segments else 1
+        self._writer = open(self._path(number), "ab")
+        self.segments.append(number)
+        if self.cursor < (self.segments[0], 0):
+            self.cursor = (number, 0)
+        # Make the new segment's directory entry durable too
+        dir_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    # ---- replay ----
+
+    async def read(
+        self, max_rows: int = SPOOL_REPLAY_BATCH, start: Optional[Position] = None
+    ) -> Tuple[List[Dict[str, Any]], Position]:
+        """Rows from the cursor (or ``start``) onwards (at least one spooled batch, up to about max_rows) and the position after them"""
+        async with self._lock:
+            return await asyncio.to_thread(self._read, max_rows, start or self.cursor)
+
+    def _read(self, max_rows: int, start: Position) -> Tuple[List[Dict[str, Any]], Position]:
+        rows: List[Dict[str, Any]] = []
+        segment, offset = start
+        for number in self.segments:
+            if number < segment:
+                continue
+            if number > segment:
+                segment, offset = number, 0
+            with open(self._path(number), "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Torn write at the tail - wait for the rest or drop on next roll
+                    try:
+                        batch = json.loads(line)
+                    except ValueError:
+                        logger.error(f"Skipping corrupt spool record in segment {number} at {offset}")
+                        batch = []
+                    offset += len(line)
+                    rows.extend(batch)
+                    if len(rows) >= max_rows:
+                        return rows, (segment, offset)
+            if number == self.segments[-1]:
+                break
+        return rows, (segment, offset)
+
+    async def commit(self, position: Position):
+        """Advance the cursor past replayed rows and delete fully replayed segments"""
+        async with self._lock:
+            await asyncio.to_thread(self._commit, position)
+            if self.is_empty():
+                self.data_available.clear()
+
+    def _commit(self, position: Position):
+        self.cursor = position
+        tmp = os.path.join(self.directory, CURSOR_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(list(position), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.directory, CURSOR_FILE))
+
+        # Segments before the cursor's segment are fully replayed; the active one is
+        # truncated away only once it is both replayed and closed for writing
+        active = self.segments[-1] if self.segments else None
+        for number in list(self.segments):
+            done = number < position[0] or (
+                number == position[0] and number != active
+                and position[1] >= os.path.getsize(self._path(number))
+            )
+            if not done:
+                continue
+            self.size_bytes -= os.path.getsize(self._path(number))
+            os.remove(self._path(number))
+            self.segments.remove(number)
+
+    async def reject(self, rows: List[Dict[str, Any]], reason: str):
+        """Keep rows the API refused on replay (they are no longer in RabbitMQ) for inspection"""
+        record = json.dumps({"reason": reason, "rows": rows}, separators=(",", ":")) + "\n"
+
+        def _write():
+            with open(os.path.join(self.directory, REJECTED_FILE), "a") as f:
+                f.write(record)
+
+        await asyncio.to_thread(_write)
+
+    def as_dict(self) -> dict:
+        return {
+            "segments": len(self.segments),
+            "size_bytes": self.size_bytes,
+            "cursor": list(self.cursor),
+        }
@@ -1,8 +1,9 @@
 """
 Standalone observations ingestion worker
 
-Consumes MQTT messages from RabbitMQ queue, processes them through handlers,
-and sends observations in bulk to the API.
+Consumes MQTT messages from RabbitMQ queue (or, with INGESTION_SOURCE=mqtt,
+straight from the MQTT broker), processes them through handlers, and sends
+observations in bulk to the API.
 
 Usage:
     python -m app.worker
@@ -11,14 +12,27 @@ import asyncio
 import sys
 import os
 import json
+import time
 import httpx
 import redis.asyncio as aioredis
-from typing import List, Dict, Any
+from prometheus_client import start_http_server
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 from shared.logger.logging_config import setup_logging_json, setup_logging_colored
-from schemas.observation_schemas import ObservationWrite
-from app.queue import ObservationQueue
-from app.handlers import get_handler, MODEL_HANDLERS
+from app.queue import ObservationQueue, INGESTION_SOURCE, MAX_MESSAGE_RETRIES, retry_delay
+from app.mqtt_source import MqttObservationQueue
+from app.routing import TopicIndex
+from app.deadband import DeadbandFilter
+from app.downsample import Downsampler
+from app.api_client import ApiClient
+from app.congestion import parse_retry_after
+from app.metrics import (
+    API_REQUEST_SECONDS, HANDLER_CPU_SECONDS, INFLIGHT_BATCHES, MESSAGES_CONSUMED, METRICS_HOST, METRICS_PORT,
+    METRICS_QUEUE_POLL_INTERVAL, PENDING_ACK, QUEUE_DEPTH, QUEUE_LAG_SECONDS, TOKEN_REFRESHES,
+    UNACKED_DELIVERIES, queue_lag,
+)
+from app.db_sink import TimescaleSink, RowsRejected, INGESTION_SINK
+from app.spool import ObservationSpool, SPOOL_ENABLED, SPOOL_REPLAY_BATCH, SPOOL_REPLAY_RATE, SPOOL_PROBE_INTERVAL
 
 # Configuration
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -28,11 +42,16 @@ OBSERVATIONS_BULK_ENDPOINT = f"{API_BASE_URL}/observations/bulk"
 REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "30"))
 REDIS_URL = os.getenv("REDIS_URL")
 REDIS_TOPIC_CONFIG_KEY = "mqtt:topic_config"
+REDIS_TOPIC_CONFIG_VERSION_KEY = "mqtt:topic_config:version"  # Bumped by the jobs sync on every change
+REDIS_TOPIC_CONFIG_CHANNEL = "mqtt:topic_config:changes"  # Change notifications from the jobs sync
+TOPIC_CONFIG_REFRESH_INTERVAL = int(os.getenv("TOPIC_CONFIG_REFRESH_INTERVAL", "300"))  # Safety-net poll (seconds)
 AUTO_ACK = os.getenv("AUTO_ACK", "false").lower() == "true"
+SOURCE_NAME = "MQTT broker" if INGESTION_SOURCE == "mqtt" else "RabbitMQ"  # For log lines
 MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "5"))  # API request retries (per batch)
-MAX_MESSAGE_RETRIES = int(os.getenv("MAX_MESSAGE_RETRIES", "10"))  # Message-level retries before DLQ
 BASE_DELAY = int(os.getenv("BASE_DELAY", "5"))
-RETRY_DELAY = int(os.getenv("RETRY_DELAY", "10"))  # Delay in seconds before retrying failed messages
+REJECTED_STATUS_CODES = {400, 413, 415, 422}  # API refused the payload itself - bisect instead of retrying
+UNSUPPORTED_MEDIA_TYPE = 415  # Content-Encoding the API cannot decode - resend with a simpler codec first
+OVERLOAD_STATUS_CODES = {429, 503}  # API shedding load - wait out its Retry-After instead of the fixed backoff
 API_CLIENT_ID = os.getenv("API_CLIENT_ID", "ingestion-worker")
 API_CLIENT_SECRET = os.getenv("API_CLIENT_SECRET", "")
 # Derive base host URL: strip /api/v1 suffix so token URL points to the right place
@@ -69,242 +88,609 @@ class TokenManager:
         if not API_CLIENT_SECRET:
             raise RuntimeError("API_CLIENT_SECRET is not set — cannot authenticate with the API")
         logger.info(f"Fetching auth token for client '{API_CLIENT_ID}'")
-        async with httpx.AsyncClient(timeout=10) as client:
-            resp = await client.post(
+        try:
+            resp = await api_client.post(
                 API_TOKEN_URL,
                 data={
                     "grant_type": "client_credentials",
                     "client_id": API_CLIENT_ID,
                     "client_secret": API_CLIENT_SECRET,
                 },
+                timeout=10,
             )
             resp.raise_for_status()
             body = resp.json()
-            self._token = body["access_token"]
-            expires_in = int(body.get("expires_in", 900))
-            self._expires_at = time.time() + expires_in
-            logger.info(f"Auth token acquired (expires in {expires_in}s)")
+        except Exception:
+            TOKEN_REFRESHES.labels("failure").inc()
+            raise
+        TOKEN_REFRESHES.labels("success").inc()
+        self._token = body["access_token"]
+        expires_in = int(body.get("expires_in", 900))
+        self._expires_at = time.time() + expires_in
+        logger.info(f"Auth token acquired (expires in {expires_in}s)")
 
 
 # Global instances
-observation_queue = ObservationQueue(auto_ack=AUTO_ACK)
+observation_queue = MqttObservationQueue(auto_ack=AUTO_ACK) if INGESTION_SOURCE == "mqtt" else ObservationQueue(auto_ack=AUTO_ACK)
+api_client = ApiClient(timeout=REQUEST_TIMEOUT)  # Pooled keep-alive client, shared by all API calls
+db_sink: Optional[TimescaleSink] = TimescaleSink() if INGESTION_SINK == "timescale" else None
 redis_client: aioredis.Redis = None
 topic_config_map: dict = {}  # Cache of topic → {"model": ..., "datastreams": {...}} from Redis
+topic_config_version: Optional[int] = None  # Version of the loaded config (None = unversioned)
+topic_index = TopicIndex()  # routing key → compiled route (rebuilt on every config load)
+deadband = DeadbandFilter()  # Per-datastream deadband/heartbeat compression (settings from topic configs)
+downsampler = Downsampler()  # Per-datastream windowed aggregation (settings from topic configs)
 token_manager = TokenManager()
+spool: Optional[ObservationSpool] = ObservationSpool() if SPOOL_ENABLED else None
+api_outage = False  # Set while the API is failing; batches then go straight to the spool
 
 
-def _get_topic_config(routing_key: str):
-    """
-    Convert RabbitMQ routing key (dots) to MQTT topic (slashes),
-    then return (model, datastreams) from the Redis config cache.
+def _set_topic_configs(new_config_map: dict):
+    """Install a topic config map and rebuild the routing-key index from it."""
+    global topic_config_map, topic_index
+    topic_index = TopicIndex.build(new_config_map)
+    deadband.configure(new_config_map)
+    downsampler.configure(new_config_map)
+    topic_config_map = new_config_map
 
-    Example: "tele.NOUS_A1T_4E4984.SENSOR" → "tele/NOUS_A1T_4E4984/SENSOR"
-             → ("A1T", {"Power": "uuid", "Voltage": "uuid", "Total": "uuid"})
-    """
-    mqtt_topic = routing_key.replace(".", "/")
-    config = topic_config_map.get(mqtt_topic)
-    if config:
-        model = config.get("model")
-        datastreams = config.get("datastreams", {})
-        logger.debug(f"Matched '{routing_key}' → model='{model}', datastreams={list(datastreams.keys())}")
-        return model, datastreams
-    logger.warning(f"No topic config found for: {mqtt_topic}")
-    return None, {}
+
+class BatchRejected(Exception):
+    """The API refused the submitted rows themselves (400/413/415/422) - retrying them unchanged cannot succeed"""
+
+    def __init__(self, status_code: int, detail: str = ""):
+        super().__init__(f"API rejected batch with {status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
 
 
 async def process_messages(messages: List[Dict[str, Any]]):
     """
-    Process raw messages from queue through handler and send observations to API.
+    Process raw messages from queue through extractors and send observations to API.
     
     For each message:
     1. Get the routing key (topic)
-    2. Convert dots to slashes and look up model in Redis cache
-    3. Get the appropriate handler from MODEL_HANDLERS
-    4. Call handler to generate observations
+    2. Resolve it through the prebuilt routing-key index (exact or wildcard)
+    3. Collect the message's readings as JSON-ready rows, minus those folded into a
+       downsampling window and then those inside their deadband
+
+    Messages are settled individually, so one bad message cannot fail the batch:
+    - payloads that cannot be extracted go straight to the DLQ
+    - messages for unknown topics are scheduled for delayed retry (the topic may be provisioned meanwhile)
+    - rows the API rejects are isolated by bisection; only the offending messages go to the DLQ
+    - everything else is acknowledged once accepted, or retried if the API is unavailable
     """
-    observations = []
-    processing_errors = False
+    extracted: List[Tuple[int, List[Dict[str, Any]]]] = []  # (message index, its rows)
+    poison: Dict[str, List[int]] = {}  # DLQ reason → message indices
+    unroutable: List[int] = []
+    cpu_by_model: Dict[str, float] = {}
+    forwarded: Dict[str, Any] = {}  # Deadband state of this batch's readings, committed once submitted
 
-    for message in messages:
+    for index, message in enumerate(messages):
         try:
-            # DEBUG: Print raw message from queue
-            logger.debug(f"\n{'='*60}")
-            logger.debug(f"RAW MESSAGE FROM QUEUE:")
-            logger.debug(f"{'='*60}")
-            logger.debug(f"Full message: {json.dumps(message, indent=2, default=str)}")
-            
             routing_key = message.get("topic")
-            data_payload = message
-            # Remove topic from data since it's metadata, not sensor data
-            if "topic" in data_payload:
-                data_payload = {k: v for k, v in data_payload.items() if k != "topic"}
-            
-            logger.debug(f"Routing Key: {routing_key}")
-            logger.debug(f"Data: {json.dumps(data_payload, indent=2, default=str)}")
 
-            if not data_payload:
+            if not any(key != "topic" for key in message):
                 logger.warning(f"Message has no data: {message}")
-                logger.info(f"{'='*60}\n")
-                processing_errors = True
-                continue
-
-            # Determine model + datastreams from routing key
-            model, datastreams = _get_topic_config(routing_key)
-            if not model:
-                logger.warning(f"No topic config for: {routing_key} - marking as processing error")
-                logger.info(f"{'='*60}\n")
-                processing_errors = True
+                poison.setdefault("no-data", []).append(index)
                 continue
 
-            # Get handler for this model
-            handler = MODEL_HANDLERS.get(model)
-            if not handler:
-                logger.error(f"Handler not found for model: {model}")
-                logger.info(f"{'='*60}\n")
-                processing_errors = True
+            # Resolve routing key → compiled extractor (unknown topics are logged by the index, rate-limited)
+            route = topic_index.resolve(routing_key)
+            if route is None:
+                unroutable.append(index)
                 continue
 
-            logger.debug(f"Model: {model}")
-            logger.debug(f"Handler: {handler.__name__}")
-            logger.debug(f"{'='*60}\n")
-
-            logger.debug(f"Processing message from {routing_key} with {model} handler")
-
-            # Call handler to get observations
-            obs = await handler(data_payload, datastreams)
-            logger.debug(f"Observations: {obs}")
-            observations.extend(obs)
-            logger.debug(f"Handler {model} generated {len(obs)} observations")
+            rows: List[Dict[str, Any]] = []
+            cpu_started = time.process_time()
+            added = route.extractor(message, rows)
+            # Samples absorbed into an open window are acked with their message: at-most-once until it closes
+            rows = deadband.filter(downsampler.filter(rows), forwarded)
+            cpu_by_model[route.model] = cpu_by_model.get(route.model, 0.0) + time.process_time() - cpu_started
+            extracted.append((index, rows))
+            logger.debug(f"Extractor {route.model} generated {added} observations from {routing_key} ({len(rows)} forwarded)")
 
         except Exception as e:
             logger.error(f"Error processing message: {e}", extra={"message": message})
-            logger.info(f"{'='*60}\n")
-            processing_errors = True
+            poison.setdefault("extract-error", []).append(index)
             continue
 
-    # Send all observations in bulk (if any were generated)
-    if observations:
-        success = await send_observations_to_api(observations)
+    for model, cpu in cpu_by_model.items():
+        HANDLER_CPU_SECONDS.labels(model).inc(cpu)
+
+    if spool is not None and api_outage:
+        # API known to be down - drain the queue into the spool at disk speed
+        accepted, rejected, failed = [], [], [index for index, _ in extracted]
     else:
-        # No observations generated
-        if processing_errors:
-            # Errors occurred during processing - don't ack
-            logger.warning("Errors occurred during processing - messages will not be acknowledged")
-            success = False
-        else:
-            # No errors but also no messages to process
-            success = True
-            logger.info("No observations generated from batch")
-
-    # Only acknowledge if all messages were successfully processed
-    if success:
-        await observation_queue.ack_batch()
-        logger.info("Batch processed successfully - messages acknowledged and removed from queue")
+        accepted, rejected, failed = await submit_isolating_rejects(extracted)
+    if failed and spool is not None and await spool_failed_rows(extracted, failed):
+        accepted, failed = accepted + failed, []  # Durably on disk - safe to ack
+    if rejected:
+        poison.setdefault("api-rejected", []).extend(rejected)
+
+    if accepted:
+        accepted_set = set(accepted)
+        deadband.commit([row for index, rows in extracted if index in accepted_set for row in rows])
+        await observation_queue.ack_batch(indices=accepted)
+        logger.info(f"{len(accepted)}/{len(messages)} messages processed - acknowledged and removed from queue")
+    for reason, indices in poison.items():
+        logger.warning(f"Isolated {len(indices)} poison messages ({reason}) - moving them to DLQ")
+        await observation_queue.dead_letter_batch(indices, reason=reason)
+    retry = unroutable + failed
+    if retry:
+        # Park failed messages in the delay queues (or DLQ) - the broker redelivers them later,
+        # so the worker keeps consuming healthy traffic meanwhile
+        await observation_queue.move_batch_to_dlq(indices=retry)
+        logger.warning(f"{len(retry)} messages failed - scheduled for delayed retry or moved to DLQ")
+
+    # Windows closed by this batch's readings
+    if downsampler.outbox:
+        await submit_downsampled()
+
+
+async def spool_failed_rows(extracted: List[Tuple[int, List[Dict[str, Any]]]], failed: List[int]) -> bool:
+    """
+    Write the rows of messages the API could not take to the disk spool.
+
+    Returns True once they are durably spooled; False if the spool is full or
+    unwritable, leaving the messages to the retry path.
+    """
+    global api_outage
+
+    failed_set = set(failed)
+    rows = [row for index, message_rows in extracted if index in failed_set for row in message_rows]
+    try:
+        if not await spool.append(rows):
+            return False
+    except Exception as e:
+        logger.error(f"Failed to spool observations: {e}")
+        return False
+    # Only with data on disk: replay_spool is what probes the API and clears the outage
+    if not api_outage:
+        logger.warning("API unavailable - spooling observations to disk until it recovers")
+    api_outage = True
+    logger.info(f"Spooled {len(rows)} observations from {len(failed)} messages")
+    return True
+
+
+async def submit_downsampled():
+    """
+    Submit the rows of closed downsampling windows.
+
+    They no longer belong to any RabbitMQ message, so rows that cannot be sent
+    are spooled if possible, or kept in the outbox for the next attempt.
+    """
+    # Window rows go through the deadband like any other reading; requeued ones are filtered again
+    rows = deadband.filter(downsampler.take_outbox())
+    if not rows:
+        return
+    groups = [(i, [row]) for i, row in enumerate(rows)]
+
+    if spool is not None and api_outage:
+        accepted, failed = [], [i for i, _ in groups]
     else:
-        # Move failed messages to DLQ or retry with incremented count
-        logger.warning(f"Processing failed - waiting {RETRY_DELAY}s before retry")
-        await asyncio.sleep(RETRY_DELAY)
-        await observation_queue.move_batch_to_dlq()
-        logger.warning("Messages requeued or moved to DLQ")
+        accepted, rejected, failed = await submit_isolating_rejects(groups)
+        if rejected:
+            logger.error(f"API rejected {len(rejected)} downsampled observations - dropped",
+                         extra={"rows": [rows[i] for i in rejected]})
+
+    if failed and spool is not None and await spool_failed_rows(groups, failed):
+        accepted, failed = accepted + failed, []
+    deadband.commit([rows[i] for i in accepted])
+    if failed:
+        downsampler.requeue([rows[i] for i in failed])
+        logger.warning(f"{len(failed)} downsampled observations kept for the next attempt")
+
+
+async def flush_downsample_windows():
+    """Close downsampling windows at their flush deadline, so a quiet datastream's last window is not held back"""
+    while True:
+        try:
+            downsampler.deadline_changed.clear()
+            deadline = downsampler.next_deadline
+            if deadline is None:
+                await downsampler.deadline_changed.wait()
+                continue
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(downsampler.deadline_changed.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if downsampler.close_due() or downsampler.outbox:
+                await submit_downsampled()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error flushing downsample windows: {e}")
+            await asyncio.sleep(1)
+
+
+async def replay_spool():
+    """
+    Replay spooled observations once the API accepts them again.
+
+    While the spool holds data, chunks of SPOOL_REPLAY_BATCH rows are sent at no
+    more than SPOOL_REPLAY_RATE rows/s so the recovering API is not flooded. A
+    failed chunk marks the API as down (new batches are spooled directly) and is
+    retried every SPOOL_PROBE_INTERVAL seconds; the first accepted chunk ends the
+    outage. A chunk is committed only once fully sent, so a crash mid-replay can
+    resend it (at-least-once, like a RabbitMQ redelivery).
+    """
+    global api_outage
+
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await spool.data_available.wait()
+            started = loop.time()
+            rows, position = await spool.read(SPOOL_REPLAY_BATCH)
+            if not rows:
+                spool.data_available.clear()  # Only a partial record left; the next append wakes us
+                continue
+
+            # One group per row, so a rejected chunk is bisected down to the offending rows
+            accepted, rejected, failed = await submit_isolating_rejects(
+                [(i, [row]) for i, row in enumerate(rows)], max_retries=1
+            )
+
+            if failed:
+                api_outage = True
+                await asyncio.sleep(SPOOL_PROBE_INTERVAL)
+                continue
+
+            if rejected:
+                logger.error(f"API rejected {len(rejected)} spooled observations - kept in the spool's rejected file")
+                await spool.reject([rows[i] for i in rejected], reason="api-rejected")
+            if api_outage:
+                logger.info("API accepting observations again - resuming live submission")
+                api_outage = False
+            await spool.commit(position)
+            logger.debug(f"Replayed {len(rows)} spooled observations", extra=spool.as_dict())
+
+            # Rate control: no more than SPOOL_REPLAY_RATE rows per second
+            pause = len(rows) / SPOOL_REPLAY_RATE - (loop.time() - started)
+            if pause > 0:
+                await asyncio.sleep(pause)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error replaying spool: {e}")
+            await asyncio.sleep(SPOOL_PROBE_INTERVAL)
+
+
+async def submit_isolating_rejects(
+    extracted: List[Tuple[int, List[Dict[str, Any]]]],
+    max_retries: int = MAX_RETRIES,
+) -> Tuple[List[int], List[int], List[int]]:
+    """
+    Submit the rows of a group of messages, bisecting the group whenever the API rejects it.
+
+    A rejection (400/422) only means some row in the group is bad (a 413 that the group is
+    too large), so the group is split in half and each half resubmitted until the offending
+    messages are isolated. Transient failures are not bisected - the whole group is retried later.
+
+    Returns (accepted, rejected, failed) message indices.
+    """
+    indices = [index for index, _ in extracted]
+    rows = [row for _, message_rows in extracted for row in message_rows]
+    if not rows:
+        return indices, [], []  # Nothing to send (e.g. readings without configured datastreams)
+
+    try:
+        if await send_observations(rows, max_retries=max_retries):
+            return indices, [], []
+        return [], [], indices
+    except BatchRejected as e:
+        if len(extracted) == 1:
+            logger.warning(f"API rejected message {indices[0]}: {e.detail}")
+            return [], indices, []
+        logger.info(f"API rejected {len(extracted)} messages ({e.status_code}) - bisecting to isolate offenders")
+
+    middle = len(extracted) // 2
+    accepted, rejected, failed = await submit_isolating_rejects(extracted[:middle], max_retries)
+    accepted2, rejected2, failed2 = await submit_isolating_rejects(extracted[middle:], max_retries)
+    return accepted + accepted2, rejected + rejected2, failed + failed2
+
+
+async def send_observations(observations: List[Dict[str, Any]], max_retries: int = MAX_RETRIES):
+    """Send rows to the configured sink (INGESTION_SINK); same return and BatchRejected contract for both"""
+    if db_sink is not None:
+        return await send_observations_to_db(observations, max_retries=max_retries)
+    return await send_observations_to_api(observations, max_retries=max_retries)
+
+
+async def send_observations_to_db(observations: List[Dict[str, Any]], max_retries: int = MAX_RETRIES):
+    """
+    Write JSON-ready observation rows straight into TimescaleDB with exponential backoff retry.
+
+    Returns True once the rows are stored, False after max_retries failed attempts.
+    Raises BatchRejected when the database refuses the rows themselves; that is not retried.
+    """
+    if not observations:
+        return True
+
+    for attempt in range(max_retries):
+        try:
+            await db_sink.write(observations)
+            logger.info(f" Successfully wrote {len(observations)} observations to TimescaleDB")
+            return True
+        except RowsRejected as e:
+            raise BatchRejected(e.code, e.detail) from e
+        except Exception as e:
+            if attempt < max_retries - 1:
+                delay = BASE_DELAY * (2 ** attempt)
+                logger.warning(f"✗ Failed to write observations - retrying in {delay}s (attempt {attempt + 1}/{max_retries}): {e}")
+                await asyncio.sleep(delay)
+            else:
+                logger.error(f"✗ Failed to write observations after {max_retries} attempts: {e}")
+                return False
+
+    return False
 
 
-async def send_observations_to_api(observations: List[ObservationWrite]):
+async def send_observations_to_api(observations: List[Dict[str, Any]], max_retries: int = MAX_RETRIES):
     """
-    Send observations in bulk to the API with exponential backoff retry.
+    Send JSON-ready observation rows in bulk to the API with exponential backoff retry.
     
-    Returns True if successful (201), False otherwise.
+    Returns True if successful (201), False otherwise (after max_retries attempts).
+    Raises BatchRejected when the API refuses the rows themselves (400/422) or
+    their size (413); that is not retried. A 415 (compressed body the API cannot
+    decode) is resent at once with the next simpler codec. A 429/503 with Retry-After is retried after the delay the API
+    asked for. With AIMD_ENABLED, latencies and failures also drive the queue's
+    congestion window.
     """
     if not observations:
         return True  # No observations to send is considered success
     
-    for attempt in range(MAX_RETRIES):
+    congestion = observation_queue.congestion
+    for attempt in range(max_retries):
+        if congestion is not None:
+            await congestion.wait_ready()
+            ticket = congestion.begin()
         try:
-            logger.info(f"Sending batch of {len(observations)} observations to API (attempt {attempt + 1}/{MAX_RETRIES})")
-
-            # Convert to dicts for JSON serialization (mode='json' ensures UUIDs are converted to strings)
-            obs_dicts = [obs.model_dump(mode='json') for obs in observations]
+            logger.info(f"Sending batch of {len(observations)} observations to API (attempt {attempt + 1}/{max_retries})")
 
             token = await token_manager.get_token()
-            async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT) as client:
-                logger.debug(f"POST {OBSERVATIONS_BULK_ENDPOINT}")
-                response = await client.post(
+            logger.debug(f"POST {OBSERVATIONS_BULK_ENDPOINT}")
+            started = time.monotonic()
+            try:
+                response = await api_client.post_json(
                     OBSERVATIONS_BULK_ENDPOINT,
-                    json=obs_dicts,
-                    headers={"Authorization": f"Bearer {token}"},
+                    observations,
+                    # The created rows are not used - skip serializing them back
+                    headers={"Authorization": f"Bearer {token}", "Prefer": "return=minimal"},
                 )
-                response.raise_for_status()
-
-                # Check for 201 Created response
-                if response.status_code == 201:
-                    logger.info(f" Successfully ingested {len(observations)} observations")
-                    return True
-                else:
-                    logger.warning(f"✗ API returned {response.status_code} instead of 201")
-                    return False
+            except httpx.TimeoutException:
+                API_REQUEST_SECONDS.labels("timeout").observe(time.monotonic() - started)
+                raise
+            except Exception:
+                API_REQUEST_SECONDS.labels("error").observe(time.monotonic() - started)
+                raise
+            API_REQUEST_SECONDS.labels(str(response.status_code)).observe(time.monotonic() - started)
+            response.raise_for_status()
+
+            # Check for 201 Created response
+            if response.status_code == 201:
+                if congestion is not None:
+                    congestion.on_success(ticket, time.monotonic() - started)
+                logger.info(f" Successfully ingested {len(observations)} observations")
+                return True
+            else:
+                logger.warning(f"✗ API returned {response.status_code} instead of 201")
+                return False
 
         except httpx.TimeoutException as e:
-            if attempt < MAX_RETRIES - 1:
+            if congestion is not None:
+                congestion.on_congestion(ticket, "request timeout")
+            if attempt < max_retries - 1:
                 delay = BASE_DELAY * (2 ** attempt)
-                logger.warning(f"✗ Request timeout - retrying in {delay}s (attempt {attempt + 1}/{MAX_RETRIES})")
+                logger.warning(f"✗ Request timeout - retrying in {delay}s (attempt {attempt + 1}/{max_retries})")
                 await asyncio.sleep(delay)
             else:
-                logger.error(f"✗ Request timeout after {MAX_RETRIES} attempts")
+                logger.error(f"✗ Request timeout after {max_retries} attempts")
                 return False
         except httpx.HTTPStatusError as e:
-            if attempt < MAX_RETRIES - 1:
-                delay = BASE_DELAY * (2 ** attempt)
-                logger.warning(f"✗ API returned error {e.response.status_code} - retrying in {delay}s (attempt {attempt + 1}/{MAX_RETRIES})")
+            status_code = e.response.status_code
+            if status_code == UNSUPPORTED_MEDIA_TYPE and api_client.fall_back_compression():
+                continue
+            if status_code in REJECTED_STATUS_CODES:
+                raise BatchRejected(status_code, e.response.text) from e
+            retry_after = parse_retry_after(e.response.headers.get("Retry-After")) if status_code in OVERLOAD_STATUS_CODES else None
+            if congestion is not None:
+                congestion.on_congestion(ticket, f"API returned {status_code}", retry_after)
+            if attempt < max_retries - 1:
+                delay = retry_after if retry_after is not None else BASE_DELAY * (2 ** attempt)
+                logger.warning(f"✗ API returned error {status_code} - retrying in {delay:g}s (attempt {attempt + 1}/{max_retries})")
                 await asyncio.sleep(delay)
             else:
-                logger.error(f"✗ API returned error {e.response.status_code}: {e.response.text}")
+                logger.error(f"✗ API returned error {status_code}: {e.response.text}")
                 return False
         except Exception as e:
-            if attempt < MAX_RETRIES - 1:
+            if congestion is not None:
+                congestion.on_congestion(ticket, type(e).__name__)
+            if attempt < max_retries - 1:
                 delay = BASE_DELAY * (2 ** attempt)
-                logger.warning(f"✗ Failed to send observations - retrying in {delay}s (attempt {attempt + 1}/{MAX_RETRIES}): {e}")
+                logger.warning(f"✗ Failed to send observations - retrying in {delay}s (attempt {attempt + 1}/{max_retries}): {e}")
                 await asyncio.sleep(delay)
             else:
-                logger.error(f"✗ Failed to send observations after {MAX_RETRIES} attempts: {e}")
+                logger.error(f"✗ Failed to send observations after {max_retries} attempts: {e}")
                 return False
     
     return False
 
 
+def _log_topic_changes(old_config_map: dict, new_config_map: dict):
+    old_topics = set(old_config_map.keys())
+    new_topics = set(new_config_map.keys())
+    added = new_topics - old_topics
+    removed = old_topics - new_topics
+    updated = {t for t in old_topics & new_topics if old_config_map[t] != new_config_map[t]}
+
+    if added:
+        logger.info(f"Added topics: {added}")
+    if removed:
+        logger.info(f"Removed topics: {removed}")
+    if updated:
+        logger.info(f"Updated topics: {updated}")
+
+
+async def load_topic_config():
+    """Load the whole topic config hash and its version in one transaction."""
+    global topic_config_version
+
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.get(REDIS_TOPIC_CONFIG_VERSION_KEY)
+        pipe.hgetall(REDIS_TOPIC_CONFIG_KEY)
+        version, raw_configs = await pipe.execute()
+
+    new_config_map = {topic: json.loads(cfg) for topic, cfg in raw_configs.items()}
+    if new_config_map != topic_config_map:
+        _log_topic_changes(topic_config_map, new_config_map)
+        _set_topic_configs(new_config_map)
+    topic_config_version = int(version) if version is not None else None
+
+
+async def apply_topic_config_changes(changed: List[str], removed: List[str]):
+    """Re-fetch only the changed topic fields (HMGET) and drop removed ones."""
+    new_config_map = dict(topic_config_map)
+    for topic in removed:
+        new_config_map.pop(topic, None)
+
+    if changed:
+        raw_configs = await redis_client.hmget(REDIS_TOPIC_CONFIG_KEY, changed)
+        for topic, cfg in zip(changed, raw_configs):
+            if cfg is None:  # Removed again since the notification was sent
+                new_config_map.pop(topic, None)
+            else:
+                new_config_map[topic] = json.loads(cfg)
+
+    if new_config_map != topic_config_map:
+        _log_topic_changes(topic_config_map, new_config_map)
+        _set_topic_configs(new_config_map)
+
+
+async def handle_topic_config_notification(data: str):
+    """
+    Apply one change notification from the jobs sync.
+
+    Notifications carry the new config version. The next consecutive version is
+    applied incrementally; a gap (a missed notification) triggers a full reload,
+    and a version already seen is ignored.
+    """
+    global topic_config_version
+
+    event = json.loads(data)
+    version = event.get("version")
+
+    if version is not None and topic_config_version is not None:
+        if version <= topic_config_version:
+            logger.debug(f"Ignoring stale topic config notification (v{version} <= v{topic_config_version})")
+            return
+        if version > topic_config_version + 1:
+            logger.info(f"Topic config v{topic_config_version} → v{version} skipped versions, reloading all topics")
+            await load_topic_config()
+            return
+
+    await apply_topic_config_changes(event.get("changed", []), event.get("removed", []))
+    if version is not None:
+        topic_config_version = version
+    logger.info(f"Topic config updated to v{version}: now have {len(topic_config_map)} topics")
+
+
+async def watch_topic_config_changes():
+    """
+    Subscribe to topic config change notifications.
+
+    New or edited sensors are picked up as soon as the jobs sync publishes them.
+    After (re)subscribing the whole config is reloaded once, since notifications
+    sent while unsubscribed are lost.
+    """
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(REDIS_TOPIC_CONFIG_CHANNEL)
+            await load_topic_config()
+            logger.info(f"Subscribed to topic config changes ({REDIS_TOPIC_CONFIG_CHANNEL})")
+
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                try:
+                    await handle_topic_config_notification(message["data"])
+                except Exception as e:
+                    logger.error(f"Error applying topic config notification: {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Topic config subscription lost: {e}; resubscribing in 5s")
+            await asyncio.sleep(5)
+        finally:
+            try:
+                await pubsub.close()
+            except Exception:
+                pass
+
+
+def register_metric_gauges():
+    """Read the queue's live counters at scrape time (looked up through the global, which tests swap)"""
+    PENDING_ACK.set_function(lambda: len(observation_queue.pending_ack_messages))
+    UNACKED_DELIVERIES.set_function(lambda: len(observation_queue.deliveries))
+    INFLIGHT_BATCHES.set_function(lambda: observation_queue.inflight_count)
+
+
+def messages_consumed() -> float:
+    """Messages consumed so far, over every topic"""
+    return sum(
+        sample.value
+        for family in MESSAGES_CONSUMED.metric.collect()
+        for sample in family.samples
+        if sample.name.endswith("_total")
+    )
+
+
+async def poll_queue_lag():
+    """Poll the queue depth and estimate how long draining it takes at the recent consumption rate"""
+    consumed_before = messages_consumed()
+    polled_at = time.monotonic()
+    while True:
+        try:
+            await asyncio.sleep(METRICS_QUEUE_POLL_INTERVAL)
+            depth = await observation_queue.queue_depth()
+            if depth is None:  # Source cannot report a backlog (MQTT)
+                continue
+            consumed, now = messages_consumed(), time.monotonic()
+            QUEUE_DEPTH.set(depth)
+            QUEUE_LAG_SECONDS.set(queue_lag(depth, consumed - consumed_before, now - polled_at))
+            consumed_before, polled_at = consumed, now
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error polling queue depth: {e}")
+
+
 async def refresh_topic_config():
     """
-    Periodically refresh topic config from Redis.
-    This allows the worker to pick up new sensors or removed sensors
-    without requiring a restart.
+    Safety-net poll for topic config changes.
+
+    Changes normally arrive through watch_topic_config_changes(); this only
+    compares the config version counter and reloads when it has moved (or when
+    the config is unversioned), in case a notification was missed.
     """
-    global redis_client, topic_config_map
-    
-    refresh_interval = int(os.getenv("TOPIC_CONFIG_REFRESH_INTERVAL", "300"))  # Default 300 seconds
-    
     while True:
         try:
-            await asyncio.sleep(refresh_interval)
+            await asyncio.sleep(TOPIC_CONFIG_REFRESH_INTERVAL)
             
             if not redis_client:
                 logger.warning("Redis client not available for config refresh")
                 continue
             
-            raw_configs = await redis_client.hgetall(REDIS_TOPIC_CONFIG_KEY)
-            new_config_map = {topic: json.loads(cfg) for topic, cfg in raw_configs.items()}
-            
-            # Only log if config changed
-            if new_config_map != topic_config_map:
-                old_topics = set(topic_config_map.keys())
-                new_topics = set(new_config_map.keys())
-                added = new_topics - old_topics
-                removed = old_topics - new_topics
-                
-                if added:
-                    logger.info(f"Added topics: {added}")
-                if removed:
-                    logger.info(f"Removed topics: {removed}")
-                
-                topic_config_map = new_config_map
-                logger.info(f"Topic config refreshed: now have {len(topic_config_map)} topics")
+            version = await redis_client.get(REDIS_TOPIC_CONFIG_VERSION_KEY)
+            if version is not None and topic_config_version is not None and int(version) == topic_config_version:
+                continue
+
+            await load_topic_config()
+            logger.info(f"Topic config refreshed (v{topic_config_version}): now have {len(topic_config_map)} topics")
             
         except Exception as e:
             logger.error(f"Error refreshing topic config: {e}")
@@ -317,40 +703,83 @@ async def main():
     logger.info("=" * 60)
     logger.info("Starting Observations Ingestion Worker")
     logger.info("=" * 60)
-    logger.info(f"API URL: {API_BASE_URL}")
-    logger.info(f"Observations Endpoint: {OBSERVATIONS_BULK_ENDPOINT}")
+    if db_sink is not None:
+        logger.info(f"Sink: TimescaleDB COPY ({db_sink.pool_size} connections)")
+    else:
+        logger.info(f"API URL: {API_BASE_URL}")
+        logger.info(f"Observations Endpoint: {OBSERVATIONS_BULK_ENDPOINT}")
     logger.info(f"Redis URL: {REDIS_URL}")
+    if INGESTION_SOURCE == "mqtt":
+        logger.info(f"Source: MQTT {observation_queue.host}:{observation_queue.port} {observation_queue.subscriptions} (QoS {observation_queue.qos})")
+    else:
+        logger.info(f"Source: RabbitMQ queue {observation_queue.queue_name}")
     logger.info(f"Auto-Ack: {AUTO_ACK} (if False, messages stay in queue)")
-    logger.info(f"Batch Size: {int(os.getenv('BATCH_SIZE', '100'))}")
-    logger.info(f"Batch Timeout: {int(os.getenv('BATCH_TIMEOUT', '5'))} seconds")
+    sizer = observation_queue.sizer
+    if sizer.adaptive:
+        logger.info(f"Batch Size: adaptive {sizer.min_size}-{sizer.max_size} (from arrival rate and batch latency)")
+    else:
+        logger.info(f"Batch Size: {sizer.max_size}")
+    logger.info(f"Batch Timeout: {sizer.max_wait_limit} seconds after the oldest message")
+    logger.info(f"In-flight Batches: {observation_queue.max_inflight} (prefetch: {observation_queue.prefetch_count})")
+    if observation_queue.congestion is not None:
+        logger.info(f"AIMD congestion control: {observation_queue.congestion.as_dict()}")
+    if observation_queue.scheduler is not None:
+        scheduler = observation_queue.scheduler
+        logger.info(f"Fair scheduling: quantum {scheduler.quantum}, default rate cap {scheduler.default_rate or 'none'}, per-topic caps {scheduler.rates or 'none'}")
+    if observation_queue.sharded:
+        logger.info(f"Shards: {observation_queue.shard_count} (owning {sorted(observation_queue.owned_shards)}, standby on the rest)")
     logger.info(f"API Retries: {MAX_RETRIES} attempts per batch")
-    logger.info(f"Message Retries: {MAX_MESSAGE_RETRIES} attempts before DLQ (delay: {RETRY_DELAY}s)")
-    logger.info(f"Topic Config Refresh: every {int(os.getenv('TOPIC_CONFIG_REFRESH_INTERVAL', '300'))} seconds")
+    if spool is not None:
+        logger.info(f"Disk Spool: {spool.directory} (max {spool.max_bytes} bytes, replay {SPOOL_REPLAY_RATE} rows/s)")
+    logger.info(f"Message Retries: {MAX_MESSAGE_RETRIES} attempts before DLQ (delays: {[retry_delay(a) for a in range(1, MAX_MESSAGE_RETRIES + 1)]}s)")
+    logger.info(f"API Client: http2={api_client.http2}, max_connections={api_client.limits.max_connections}, keepalive={api_client.limits.max_keepalive_connections}, compression={api_client.compression}")
+    logger.info(f"Topic Config Refresh: on change ({REDIS_TOPIC_CONFIG_CHANNEL}), safety-net poll every {TOPIC_CONFIG_REFRESH_INTERVAL} seconds")
+    logger.info(f"Metrics: /metrics on port {METRICS_PORT}" if METRICS_PORT else "Metrics: disabled")
     logger.info("=" * 60)
 
+    metrics_server = None
+    background_tasks: List[asyncio.Task] = []
     try:
+        # Expose /metrics first, so a worker stuck connecting still reports
+        if METRICS_PORT:
+            register_metric_gauges()
+            metrics_server, _ = start_http_server(METRICS_PORT, addr=METRICS_HOST)
+            logger.info(f"Serving Prometheus metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
         # Connect to Redis
         logger.info("Connecting to Redis...")
         redis_client = await aioredis.from_url(REDIS_URL, decode_responses=True)
         logger.info(" Connected to Redis")
 
+        if db_sink is not None:
+            # Rows go straight to the database; the sink publishes to Redis streams itself
+            db_sink.redis = redis_client
+            await db_sink.start()
+        else:
+            # Open the pooled API client (reused for token refreshes and bulk posts)
+            await api_client.start()
+
+        # Recover the disk spool left by a previous outage (replayed once the API is up)
+        if spool is not None:
+            await spool.open()
+
         # Fetch initial auth token (fails fast if credentials are wrong)
-        logger.info("Fetching API auth token...")
-        await token_manager.get_token()
-        logger.info("API auth token ready")
+        if db_sink is None:
+            logger.info("Fetching API auth token...")
+            await token_manager.get_token()
+            logger.info("API auth token ready")
 
         # Load topic configs from Redis (written by jobs sync)
         logger.info(f"Loading topic configs from Redis (key: {REDIS_TOPIC_CONFIG_KEY})...")
-        raw_configs = await redis_client.hgetall(REDIS_TOPIC_CONFIG_KEY)
-        topic_config_map = {topic: json.loads(cfg) for topic, cfg in raw_configs.items()}
-        logger.info(f"Loaded {len(topic_config_map)} topic configs:")
+        await load_topic_config()
+        logger.info(f"Loaded {len(topic_config_map)} topic configs (version {topic_config_version}):")
         for mqtt_topic, cfg in topic_config_map.items():
             logger.info(f"  {mqtt_topic} → model={cfg.get('model')}, datastreams={list(cfg.get('datastreams', {}).keys())}")
 
-        # Connect to RabbitMQ
-        logger.info("Connecting to RabbitMQ...")
+        # Connect to the message source
+        logger.info(f"Connecting to {SOURCE_NAME}...")
         await observation_queue.connect()
-        logger.info("Connected to RabbitMQ")
+        logger.info(f"Connected to {SOURCE_NAME}")
 
         # Register message processor
         observation_queue.register_handler(process_messages)
@@ -359,8 +788,14 @@ async def main():
         logger.info("Starting message consumption...")
         logger.info("Waiting for messages...")
         
-        # Start background task to refresh topic config periodically
-        refresh_task = asyncio.create_task(refresh_topic_config())
+        # Apply topic config changes as they are published; poll only as a safety net
+        background_tasks.append(asyncio.create_task(watch_topic_config_changes()))
+        background_tasks.append(asyncio.create_task(refresh_topic_config()))
+        if spool is not None:
+            background_tasks.append(asyncio.create_task(replay_spool()))
+        background_tasks.append(asyncio.create_task(flush_downsample_windows()))
+        if metrics_server is not None:
+            background_tasks.append(asyncio.create_task(poll_queue_lag()))
         
         # Start consuming messages (blocks indefinitely)
         await observation_queue.start_consuming()
@@ -371,13 +806,27 @@ async def main():
         logger.error(f"Fatal error in worker: {e}")
         sys.exit(1)
     finally:
-        # Cleanup
+        # Cleanup: stop the background tasks first, so none is still replaying the spool or
+        # flushing windows while the final flush runs and the spool and connections close
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+
         try:
             await observation_queue.disconnect()
-            logger.info("Disconnected from RabbitMQ")
+            logger.info(f"Disconnected from {SOURCE_NAME}")
         except Exception as e:
-            logger.error(f"Error disconnecting from RabbitMQ: {e}")
+            logger.error(f"Error disconnecting from {SOURCE_NAME}: {e}")
 
+        # Emit the partial windows still open
+        if len(downsampler):
+            try:
+                downsampler.close_all()
+                await submit_downsampled()
+            except Exception as e:
+                logger.error(f"Error flushing downsample windows: {e}")
+
+        # After the last flush: the database sink still publishes to Redis streams
         if redis_client:
             try:
                 await redis_client.close()
@@ -385,6 +834,26 @@ async def main():
             except Exception as e:
                 logger.error(f"Error disconnecting from Redis: {e}")
 
+        if db_sink is not None:
+            try:
+                await db_sink.close()
+            except Exception as e:
+                logger.error(f"Error closing TimescaleDB sink: {e}")
+
+        if spool is not None:
+            try:
+                await spool.close()
+            except Exception as e:
+                logger.error(f"Error closing spool: {e}")
+
+        try:
+            await api_client.close()
+        except Exception as e:
+            logger.error(f"Error closing API client: {e}")
+
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
         logger.info("Worker cleanup complete")
 
 
@@ -0,0 +1,130 @@
+"""
+In-process stand-in for the parts of aio_pika the ingestion queue uses
+
+FakeBroker holds one queue. It delivers messages through ``queue.iterator()``
+while fewer than ``prefetch`` deliveries are unacked, and implements
+ack/nack (including ``multiple``) and exchange publishes (retry and DLQ copies
+are counted, not redelivered). It is enough to drive ObservationQueue without
+a RabbitMQ server, so the numbers measure the worker, not the network.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+
+class FakeMessage:
+    def __init__(self, broker: "FakeBroker", delivery_tag: int, routing_key: str, body: bytes, headers: Optional[dict] = None):
+        self.broker = broker
+        self.delivery_tag = delivery_tag
+        self.routing_key = routing_key
+        self.body = body
+        self.headers = headers or {}
+        self.published_at = time.perf_counter()
+
+    async def ack(self, multiple: bool = False):
+        self.broker._ack(self.delivery_tag, multiple)
+
+    async def nack(self, requeue: bool = True, multiple: bool = False):
+        self.broker._nack(self.delivery_tag, requeue)
+
+    async def reject(self, requeue: bool = False):
+        self.broker._nack(self.delivery_tag, requeue)
+
+    @asynccontextmanager
+    async def process(self):
+        """Auto-ack mode: ack when the block completes"""
+        try:
+            yield self
+        finally:
+            await self.ack()
+
+
+class FakeExchange:
+    def __init__(self, broker: "FakeBroker", name: str):
+        self.broker = broker
+        self.name = name
+
+    async def publish(self, message, routing_key: str = ""):
+        # The worker republishes failed messages here (retry delay queues, DLQ)
+        target = routing_key if self.name == "" else self.name
+        self.broker.published[target] = self.broker.published.get(target, 0) + 1
+
+
+class FakeQueue:
+    def __init__(self, broker: "FakeBroker"):
+        self.broker = broker
+
+    @asynccontextmanager
+    async def iterator(self, **kwargs):
+        yield self.broker._deliveries()
+
+
+class FakeChannel:
+    def __init__(self, broker: "FakeBroker"):
+        self.broker = broker
+        self.default_exchange = FakeExchange(broker, "")
+
+    async def set_qos(self, prefetch_count: int = 0, **kwargs):
+        self.broker.prefetch = prefetch_count
+
+
+class FakeBroker:
+    def __init__(self, prefetch: int = 0):
+        self.prefetch = prefetch  # 0 = unlimited
+        self.channel = FakeChannel(self)
+        self.queue = FakeQueue(self)
+        self._ready: "asyncio.Queue[FakeMessage]" = asyncio.Queue()
+        self._unacked: "OrderedDict[int, FakeMessage]" = OrderedDict()
+        self._slot_freed = asyncio.Event()
+        self._next_tag = 1
+        self.published: Dict[str, int] = {}  # exchange or queue → messages republished by the worker
+        self.acked = 0
+        self.nacked = 0
+        self.settled = asyncio.Event()  # Set whenever acked + nacked reaches ``expected``
+        self.expected: Optional[int] = None
+        self.lags = []  # Seconds from publish to ack, per message
+
+    def exchange(self, name: str) -> FakeExchange:
+        return FakeExchange(self, name)
+
+    def publish(self, routing_key: str, body: bytes, headers: Optional[dict] = None):
+        """Publish one message into the queue (the MQTT side)"""
+        self._ready.put_nowait(FakeMessage(self, 0, routing_key, body, headers))
+
+    async def _deliveries(self):
+        while True:
+            while self.prefetch and len(self._unacked) >= self.prefetch:
+                self._slot_freed.clear()
+                await self._slot_freed.wait()
+            message = await self._ready.get()
+            message.delivery_tag = self._next_tag
+            self._next_tag += 1
+            self._unacked[message.delivery_tag] = message
+            yield message
+
+    def _ack(self, tag: int, multiple: bool):
+        now = time.perf_counter()
+        tags = [t for t in self._unacked if t <= tag] if multiple else [tag]
+        for t in tags:
+            message = self._unacked.pop(t, None)
+            if message is not None:
+                self.acked += 1
+                self.lags.append(now - message.published_at)
+        self._after_settle()
+
+    def _nack(self, tag: int, requeue: bool):
+        message = self._unacked.pop(tag, None)
+        if message is None:
+            return
+        if requeue:
+            self._ready.put_nowait(message)
+        else:
+            self.nacked += 1
+        self._after_settle()
+
+    def _after_settle(self):
+        self._slot_freed.set()
+        if self.expected is not None and self.acked + self.nacked >= self.expected:
+            self.settled.set()
@@ -0,0 +1,84 @@
+"""
+Synthetic Tasmota telemetry
+
+Devices of the SHT40 and A1T shapes publish on ``tele/<MODEL>_<n>/SENSOR``.
+Every device's ``Time`` advances one second per message, so no two payloads are
+duplicates (the dedupe cache would drop them otherwise).
+"""
+import json
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+MODEL_DATASTREAMS = {
+    "SHT40": ("Temperature", "Humidity", "DewPoint"),
+    "A1T": ("Power", "Voltage", "Total"),
+}
+
+
+def _sht40(rnd: random.Random, ts: str, n: int) -> dict:
+    temperature = round(20 + rnd.uniform(-3, 3), 1)
+    humidity = round(50 + rnd.uniform(-10, 10), 1)
+    return {"Time": ts, "SHT4X": {"Temperature": temperature, "Humidity": humidity, "DewPoint": round(temperature - 8, 1)}, "TempUnit": "C"}
+
+
+def _a1t(rnd: random.Random, ts: str, n: int) -> dict:
+    return {
+        "Time": ts,
+        "ENERGY": {
+            "TotalStartTime": "2026-01-01T00:00:00",
+            "Total": round(1000 + n * 0.001, 3),
+            "Yesterday": 2.1,
+            "Today": 0.8,
+            "Power": rnd.randint(0, 2500),
+            "ApparentPower": rnd.randint(0, 2600),
+            "ReactivePower": rnd.randint(0, 200),
+            "Factor": 0.95,
+            "Voltage": rnd.randint(225, 235),
+            "Current": round(rnd.uniform(0, 10), 3),
+        },
+    }
+
+
+PAYLOADS = {"SHT40": _sht40, "A1T": _a1t}
+
+
+class TasmotaGenerator:
+    """Round-robin telemetry from ``topics`` devices of the given models"""
+
+    def __init__(
+        self,
+        topics: int = 10,
+        models: Sequence[str] = ("SHT40", "A1T"),
+        seed: int = 0,
+        start: Optional[datetime] = None,
+    ):
+        self.rnd = random.Random(seed)
+        self.start = start or datetime(2026, 1, 1)
+        self.devices: List[Tuple[str, str]] = []  # (mqtt topic, model)
+        for n in range(topics):
+            model = models[n % len(models)]
+            self.devices.append((f"tele/{model}_{n:04d}/SENSOR", model))
+        self._sequence = [0] * len(self.devices)
+
+    def topic_configs(self) -> Dict[str, dict]:
+        """Topic configs in the shape the jobs sync writes to Redis"""
+        id_rnd = random.Random(self.rnd.random())
+        return {
+            topic: {
+                "model": model,
+                "datastreams": {key: str(uuid.UUID(int=id_rnd.getrandbits(128), version=4)) for key in MODEL_DATASTREAMS[model]},
+            }
+            for topic, model in self.devices
+        }
+
+    def messages(self, count: int) -> Iterator[Tuple[str, bytes]]:
+        """``count`` (routing key, body) pairs, cycling over the devices"""
+        for i in range(count):
+            index = i % len(self.devices)
+            topic, model = self.devices[index]
+            n = self._sequence[index]
+            self._sequence[index] += 1
+            ts = (self.start + timedelta(seconds=n)).isoformat()
+            yield topic.replace("/", "."), json.dumps(PAYLOADS[model](self.rnd, ts, n)).encode()
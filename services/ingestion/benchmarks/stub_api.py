@@ -0,0 +1,85 @@
+"""
+Stub of the telemetry API for benchmarks
+
+Serves ``/auth/token`` and ``/observations/bulk`` through an httpx
+MockTransport, so the worker's real ApiClient is used without a server. Latency
+and failures are injectable: ``error_rate`` answers 503 (transient, retried by
+the worker), ``reject_rate`` answers 422 (bisected and dead-lettered).
+``capacity`` mimics the API's bulk admission gate: at most that many requests
+are served at once, and one that waits longer than ``queue_timeout`` for a slot
+is shed with 503 and a Retry-After.
+"""
+import asyncio
+import math
+import random
+import httpx
+
+
+class StubApi:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        reject_rate: float = 0.0,
+        seed: int = 0,
+        capacity: int = 0,
+        queue_timeout: float = 0.05,
+    ):
+        self.latency = latency  # Seconds per bulk request
+        self.jitter = jitter  # Uniform +/- seconds added to latency
+        self.error_rate = error_rate
+        self.reject_rate = reject_rate
+        self.rnd = random.Random(seed)
+        self.requests = 0
+        self.bytes_received = 0
+        self.errors = 0
+        self.rejected = 0
+        self.shed = 0
+        self.capacity = capacity  # Concurrent bulk requests served (0 = unlimited)
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(capacity) if capacity > 0 else None
+        self.transport = httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/auth/token"):
+            return httpx.Response(200, json={"access_token": "bench", "expires_in": 3600})
+        if not request.url.path.endswith("/observations/bulk"):
+            return httpx.Response(404)
+
+        self.requests += 1
+        self.bytes_received += len(request.content)
+        if self._slots is None:
+            return await self._serve()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            retry_after = max(1, math.ceil(self.latency))
+            return httpx.Response(503, headers={"Retry-After": str(retry_after)}, text="stub at capacity")
+        try:
+            return await self._serve()
+        finally:
+            self._slots.release()
+
+    async def _serve(self) -> httpx.Response:
+        delay = self.latency + (self.rnd.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        roll = self.rnd.random()
+        if roll < self.error_rate:
+            self.errors += 1
+            return httpx.Response(503, text="stub overload")
+        if roll < self.error_rate + self.reject_rate:
+            self.rejected += 1
+            return httpx.Response(422, text="stub rejection")
+        return httpx.Response(201, content=b"[]")
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "bytes_received": self.bytes_received,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "shed": self.shed,
+        }
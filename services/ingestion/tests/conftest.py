@@ -1,6 +1,7 @@
 """
 Pytest fixtures and configuration for ingestion service tests
 """
+import importlib.util
 import os
 import sys
 from pathlib import Path
@@ -16,6 +17,14 @@ sys.modules['shared'] = MagicMock()
 sys.modules['shared.logger'] = MagicMock()
 sys.modules['shared.logger.logging_config'] = MagicMock()
 
+# ...but load the shared stream format for real: the tests check what gets published
+_streams_spec = importlib.util.spec_from_file_location(
+    "shared.streams.observation_streams",
+    Path(__file__).resolve().parents[3] / "shared" / "streams" / "observation_streams.py",
+)
+sys.modules['shared.streams.observation_streams'] = importlib.util.module_from_spec(_streams_spec)
+_streams_spec.loader.exec_module(sys.modules['shared.streams.observation_streams'])
+
 import pytest
 from uuid import uuid4
 
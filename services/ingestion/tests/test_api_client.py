@@ -0,0 +1,170 @@
+"""
+Tests for ApiClient - pooled keep-alive HTTP client
+"""
+import gzip
+import json
+import pytest
+import httpx
+
+from app.api_client import ApiClient, ConnectionStats
+
+
+def _transport(status_code=201):
+    return httpx.MockTransport(lambda request: httpx.Response(status_code, json=[]))
+
+
+class TestConnectionStats:
+    """Test connection reuse counters"""
+
+    def test_initial_stats(self):
+        """Test counters start at zero"""
+        stats = ConnectionStats()
+        assert stats.requests == 0
+        assert stats.connections_opened == 0
+        assert stats.connections_reused == 0
+        assert stats.reuse_ratio == 0.0
+
+    def test_reuse_computed_from_requests_and_connections(self):
+        """Test reused connections are requests minus opened connections"""
+        stats = ConnectionStats()
+        stats.requests = 10
+        stats.connections_opened = 2
+
+        assert stats.connections_reused == 8
+        assert stats.reuse_ratio == 0.8
+        assert stats.as_dict()["connections_reused"] == 8
+
+
+class TestApiClientLifecycle:
+    """Test client start/close lifecycle"""
+
+    @pytest.mark.asyncio
+    async def test_start_creates_single_client(self):
+        """Test start is idempotent and keeps one pool"""
+        api = ApiClient(transport=_transport())
+        await api.start()
+        client = api.client
+        await api.start()
+
+        assert client is not None
+        assert api.client is client
+        await api.close()
+
+    @pytest.mark.asyncio
+    async def test_close_releases_client(self):
+        """Test close drops the pool"""
+        api = ApiClient(transport=_transport())
+        await api.start()
+        await api.close()
+
+        assert api.client is None
+
+    @pytest.mark.asyncio
+    async def test_close_without_start(self):
+        """Test closing an unstarted client does not raise"""
+        api = ApiClient(transport=_transport())
+        await api.close()
+
+    def test_limits_configured(self):
+        """Test connection limits are applied"""
+        api = ApiClient(max_connections=4, max_keepalive_connections=2, keepalive_expiry=15)
+
+        assert api.limits.max_connections == 4
+        assert api.limits.max_keepalive_connections == 2
+        assert api.limits.keepalive_expiry == 15
+
+
+class TestApiClientRequests:
+    """Test requests share the pooled client"""
+
+    @pytest.mark.asyncio
+    async def test_requests_reuse_same_client(self):
+        """Test consecutive posts go through the same pooled client"""
+        api = ApiClient(transport=_transport())
+        await api.start()
+        client = api.client
+
+        for _ in range(3):
+            response = await api.post("http://api/observations/bulk", json=[])
+            assert response.status_code == 201
+
+        assert api.client is client
+        assert api.stats.requests == 3
+        await api.close()
+
+    @pytest.mark.asyncio
+    async def test_request_starts_client_lazily(self):
+        """Test a request on an unstarted client opens the pool"""
+        api = ApiClient(transport=_transport())
+        response = await api.get("http://api/health")
+
+        assert response.status_code == 201
+        assert api.client is not None
+        await api.close()
+
+    @pytest.mark.asyncio
+    async def test_trace_counts_new_connections(self):
+        """Test only TCP connect events count as opened connections"""
+        api = ApiClient(transport=_transport())
+
+        await api._trace("connection.connect_tcp.started", {})
+        await api._trace("connection.connect_tcp.complete", {})
+        await api._trace("http11.send_request_headers.complete", {})
+
+        assert api.stats.connections_opened == 1
+
+
+class TestBodyCompression:
+    """Test compressed JSON request bodies"""
+
+    @staticmethod
+    def _capture():
+        seen = []
+
+        def handler(request):
+            seen.append(request)
+            return httpx.Response(201)
+
+        return httpx.MockTransport(handler), seen
+
+    @pytest.mark.asyncio
+    async def test_gzip_body_round_trips(self):
+        """Test a large body is gzip-encoded and decodes to the same JSON"""
+        transport, seen = self._capture()
+        api = ApiClient(transport=transport, compression="gzip", compression_min_bytes=0)
+        rows = [{"datastream_id": "ds", "result_numeric": n} for n in range(100)]
+
+        await api.post_json("http://api/observations/bulk", rows, headers={"Prefer": "return=minimal"})
+
+        request = seen[0]
+        assert request.headers["Content-Encoding"] == "gzip"
+        assert request.headers["Prefer"] == "return=minimal"
+        assert json.loads(gzip.decompress(request.content)) == rows
+        assert api.stats.compression_ratio > 1
+        await api.close()
+
+    @pytest.mark.asyncio
+    async def test_small_body_sent_uncompressed(self):
+        """Test bodies under the threshold are not worth compressing"""
+        transport, seen = self._capture()
+        api = ApiClient(transport=transport, compression="gzip", compression_min_bytes=1024)
+
+        await api.post_json("http://api/observations/bulk", [{"n": 1}])
+
+        assert "Content-Encoding" not in seen[0].headers
+        assert json.loads(seen[0].content) == [{"n": 1}]
+        await api.close()
+
+    def test_fall_back_after_unsupported_media_type(self):
+        """Test a 415 steps zstd down to gzip, then to uncompressed bodies"""
+        api = ApiClient(compression="zstd")
+
+        assert api.fall_back_compression() is True
+        assert api.compression == "gzip"
+        assert api.fall_back_compression() is True
+        assert api.compression == "none"
+        assert api.fall_back_compression() is False
+
+    def test_unknown_codec_disables_compression(self):
+        """Test a typo in API_COMPRESSION does not break submission"""
+        assert ApiClient(compression="brotli").compression == "none"
@@ -0,0 +1,81 @@
+"""
+Tests for AdaptiveBatchSizer - batch size and flush deadline selection
+"""
+import math
+import pytest
+
+from app.batching import AdaptiveBatchSizer
+
+
+def _feed(sizer, gap, count, start=0.0):
+    now = start
+    for _ in range(count):
+        sizer.record_arrival(now)
+        now += gap
+    return now
+
+
+class TestStaticBatching:
+    """Test behaviour with adaptive batching disabled"""
+
+    def test_fixed_size_and_wait(self):
+        """Test the configured size and timeout are used as-is"""
+        sizer = AdaptiveBatchSizer(max_size=100, max_wait=5, adaptive=False)
+        _feed(sizer, 0.001, 50)
+        sizer.record_batch(0.5)
+
+        assert sizer.batch_size == 100
+        assert sizer.max_wait == 5
+
+
+class TestAdaptiveBatching:
+    """Test adaptive sizing from arrival rate and batch latency"""
+
+    def test_starts_at_min_size(self):
+        """Test no latency sample yet means smallest batches"""
+        sizer = AdaptiveBatchSizer(max_size=100, max_wait=5, min_size=1, adaptive=True)
+        assert sizer.batch_size == 1
+        assert sizer.max_wait == 5
+
+    def test_grows_under_load(self):
+        """Test size follows messages arriving during one submission"""
+        sizer = AdaptiveBatchSizer(max_size=100, max_wait=5, min_size=1, adaptive=True)
+        _feed(sizer, 0.01, 20)  # 100 msg/s
+        sizer.record_batch(0.2)
+
+        assert sizer.arrival_rate == pytest.approx(100)
+        assert sizer.batch_size == 20
+
+    def test_capped_at_max_size(self):
+        """Test a burst never exceeds the configured upper bound"""
+        sizer = AdaptiveBatchSizer(max_size=100, max_wait=5, min_size=1, adaptive=True)
+        _feed(sizer, 0.0, 20)
+        sizer.record_batch(1.0)
+
+        assert math.isinf(sizer.arrival_rate)
+        assert sizer.batch_size == 100
+
+    def test_shrinks_for_sparse_traffic(self):
+        """Test a sparse sensor flushes single readings without lingering"""
+        sizer = AdaptiveBatchSizer(max_size=100, max_wait=5, min_size=1, adaptive=True)
+        _feed(sizer, 30.0, 5)  # One reading every 30 s
+        sizer.record_batch(0.05)
+
+        assert sizer.batch_size == 1
+        assert sizer.max_wait == 5  # Flush by size long before the deadline matters
+
+    def test_wait_tracks_fill_time(self):
+        """Test the deadline is twice the expected fill time, floored at batch latency"""
+        sizer = AdaptiveBatchSizer(max_size=100, max_wait=5, min_size=1, adaptive=True)
+        _feed(sizer, 0.01, 20)
+        sizer.record_batch(0.2)
+
+        assert sizer.max_wait == pytest.approx(0.4)
+
+    def test_ewma_smooths_latency(self):
+        """Test a single slow batch only partly moves the latency estimate"""
+        sizer = AdaptiveBatchSizer(max_size=100, max_wait=5, adaptive=True, smoothing=0.5)
+        sizer.record_batch(0.1)
+        sizer.record_batch(0.3)
+
+        assert sizer.batch_latency == pytest.approx(0.2)
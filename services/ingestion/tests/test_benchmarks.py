@@ -0,0 +1,89 @@
+"""
+Smoke tests for the benchmark harness - generator, fake broker and a tiny run
+"""
+import asyncio
+import json
+import httpx
+import pytest
+
+from benchmarks.fake_amqp import FakeBroker
+from benchmarks.generator import TasmotaGenerator
+from benchmarks.stub_api import StubApi
+from benchmarks.run import run_benchmark, percentiles, format_report
+
+
+class TestGenerator:
+    """Test synthetic Tasmota payloads"""
+
+    def test_configs_cover_every_topic(self):
+        """Test each device gets a topic config with its model's datastreams"""
+        generator = TasmotaGenerator(topics=4)
+        configs = generator.topic_configs()
+
+        assert len(configs) == 4
+        assert configs["tele/A1T_0001/SENSOR"]["model"] == "A1T"
+        assert set(configs["tele/SHT40_0000/SENSOR"]["datastreams"]) == {"Temperature", "Humidity", "DewPoint"}
+
+    def test_payloads_are_not_duplicates(self):
+        """Test a device's Time advances so the dedupe cache keeps every message"""
+        generator = TasmotaGenerator(topics=1, models=("SHT40",))
+        times = [json.loads(body)["Time"] for _, body in generator.messages(3)]
+
+        assert len(set(times)) == 3
+
+
+class TestFakeBroker:
+    """Test the in-process AMQP stand-in"""
+
+    @pytest.mark.asyncio
+    async def test_multiple_ack_settles_prefix(self):
+        """Test ack(multiple=True) settles every delivery up to the tag"""
+        broker = FakeBroker()
+        broker.expected = 3
+        for n in range(3):
+            broker.publish("tele.X.SENSOR", b"{}")
+        async with broker.queue.iterator() as deliveries:
+            messages = [await deliveries.__anext__() for _ in range(3)]
+
+        await messages[2].ack(multiple=True)
+
+        assert broker.acked == 3
+        assert broker.settled.is_set()
+
+
+class TestStubApi:
+    """Test the stub API's admission gate"""
+
+    @pytest.mark.asyncio
+    async def test_over_capacity_is_shed_with_retry_after(self):
+        """Test a request that cannot get a slot in time gets 503 + Retry-After"""
+        stub = StubApi(latency=0.05, capacity=1, queue_timeout=0.01)
+        async with httpx.AsyncClient(transport=stub.transport) as client:
+            responses = await asyncio.gather(*(client.post("http://stub/observations/bulk", json=[]) for _ in range(2)))
+
+        assert sorted(r.status_code for r in responses) == [201, 503]
+        assert next(r for r in responses if r.status_code == 503).headers["Retry-After"] == "1"
+        assert stub.shed == 1
+
+
+class TestRun:
+    """Test a complete tiny benchmark run"""
+
+    @pytest.mark.asyncio
+    async def test_run_reports_throughput(self):
+        """Test every message is acked and the report has the headline metrics"""
+        result = await run_benchmark(messages=300, topics=6, batch_size=50, timeout=30)
+
+        assert result["messages"] == 300
+        assert result["api"]["requests"] == 6
+        assert result["msg_per_s"] > 0
+        assert result["batch_latency_ms"]["p50"] is not None
+        assert "msg_per_s" in format_report(result, baseline=result)
+
+    def test_percentiles_nearest_rank(self):
+        """Test percentiles are nearest-rank, in milliseconds"""
+        result = percentiles([i / 1000 for i in range(1, 101)])
+
+        assert result["p50"] == 50.0
+        assert result["p99"] == 99.0
+        assert result["max"] == 100.0
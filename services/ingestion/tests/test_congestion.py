@@ -0,0 +1,122 @@
+"""
+Tests for AimdController - congestion window over in-flight batches and batch size
+"""
+import time
+from datetime import datetime, timedelta, timezone
+import pytest
+
+from app.congestion import AimdController, parse_retry_after
+
+
+def _controller(**kwargs):
+    defaults = dict(max_inflight=4, max_batch_size=100, min_batch_size=10, increase=10, decrease=0.5, latency_target=1.0)
+    return AimdController(**{**defaults, **kwargs})
+
+
+class TestWindow:
+    """Test additive increase and multiplicative decrease"""
+
+    def test_starts_with_one_full_batch(self):
+        """Test the initial window is one batch in flight at full size"""
+        controller = _controller()
+
+        assert controller.inflight_limit == 1
+        assert controller.batch_size == 100
+
+    def test_successes_grow_to_max_inflight(self):
+        """Test fast successful requests open the window up to max_inflight batches"""
+        controller = _controller()
+        for _ in range(200):
+            controller.on_success(controller.begin(), 0.05)
+
+        assert controller.inflight_limit == 4
+        assert controller.window == 400
+
+    def test_increase_is_about_one_step_per_round(self):
+        """Test a full round of requests adds roughly ``increase`` messages"""
+        controller = _controller()
+        controller.window = 200.0
+        for _ in range(2):  # Two batches of 100 make one round
+            controller.on_success(controller.begin(), 0.05)
+
+        assert controller.window == pytest.approx(210, abs=0.5)
+
+    def test_congestion_halves_window(self):
+        """Test an overload signal halves the window"""
+        controller = _controller()
+        controller.window = 400.0
+        controller.on_congestion(controller.begin(), "API returned 503")
+
+        assert controller.window == 200
+        assert controller.inflight_limit == 2
+
+    def test_small_window_shrinks_batch_size(self):
+        """Test a window under one batch lowers the batch size, down to the minimum"""
+        controller = _controller()
+        for _ in range(5):
+            controller.on_congestion(controller.begin(), "request timeout")
+
+        assert controller.inflight_limit == 1
+        assert controller.batch_size == 10
+
+    def test_one_decrease_per_round(self):
+        """Test requests already in flight at a decrease do not cut the window again"""
+        controller = _controller()
+        controller.window = 400.0
+        tickets = [controller.begin() for _ in range(4)]
+        for ticket in tickets:
+            controller.on_congestion(ticket, "API returned 503")
+
+        assert controller.window == 200
+        assert controller.decreases == 1
+
+        controller.on_congestion(controller.begin(), "API returned 503")
+        assert controller.window == 100
+
+    def test_slow_request_counts_as_congestion(self):
+        """Test a success slower than the latency target shrinks the window"""
+        controller = _controller()
+        controller.window = 400.0
+        controller.on_success(controller.begin(), 2.5)
+
+        assert controller.window == 200
+
+    def test_auto_latency_target_from_baseline(self):
+        """Test the automatic target is a multiple of the fastest recent request"""
+        controller = _controller(latency_target=0, latency_tolerance=3)
+        assert controller.target_latency is None
+        for _ in range(10):
+            controller.on_success(controller.begin(), 0.1)
+
+        assert controller.target_latency == pytest.approx(0.3)
+
+
+class TestRetryAfter:
+    """Test Retry-After parsing and the shared pause"""
+
+    def test_delta_seconds(self):
+        assert parse_retry_after("7") == 7
+
+    def test_http_date(self):
+        now = datetime(2026, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+        value = (now + timedelta(seconds=30)).strftime("%a, %d %b %Y %H:%M:%S GMT")
+
+        assert parse_retry_after(value, now=now) == 30
+
+    def test_invalid_or_missing(self):
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("soon") is None
+
+    def test_capped(self):
+        """Test an absurd Retry-After is capped instead of stalling the worker"""
+        assert parse_retry_after("999999") == 120
+
+    @pytest.mark.asyncio
+    async def test_retry_after_pauses_senders(self):
+        """Test every sender waits out the pause the API asked for"""
+        controller = _controller()
+        controller.on_congestion(controller.begin(), "API returned 429", retry_after=0.05)
+
+        started = time.monotonic()
+        await controller.wait_ready()
+        assert time.monotonic() - started >= 0.04
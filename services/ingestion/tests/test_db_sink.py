@@ -0,0 +1,106 @@
+"""
+Tests for the direct-to-TimescaleDB sink - COPY records and Redis stream publication
+"""
+import json
+import uuid
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from app.db_sink import TimescaleSink, RowsRejected, COLUMNS, to_record, record_stream_entry
+
+
+def _row(ds_id, **fields):
+    return {"datastream_id": ds_id, "result_time": "2026-04-04T12:00:00+00:00", **fields}
+
+
+def _sink():
+    """Sink with a fake pool whose connection records COPY calls"""
+    sink = TimescaleSink(dsn="postgresql://test")
+    conn = AsyncMock()
+    acquire = MagicMock()
+    acquire.__aenter__ = AsyncMock(return_value=conn)
+    acquire.__aexit__ = AsyncMock(return_value=False)
+    sink.pool = MagicMock()
+    sink.pool.acquire.return_value = acquire
+    sink.redis = MagicMock()
+    sink.redis.pipeline.return_value.execute = AsyncMock()
+    return sink, conn
+
+
+class TestRecords:
+    """Test conversion of JSON-ready rows to COPY records"""
+
+    def test_record_in_column_order(self):
+        """Test each row becomes a typed record matching COLUMNS"""
+        ds_id = str(uuid.uuid4())
+        record = to_record(_row(ds_id, result_numeric=21.5, parameters={"unit": "C"}))
+
+        assert len(record) == len(COLUMNS)
+        assert isinstance(record[0], uuid.UUID)
+        assert record[1] == uuid.UUID(ds_id)
+        assert record[2].year == 2026
+        assert record[4] == 21.5
+        assert json.loads(record[7]) == {"unit": "C"}
+        assert record[3] is None
+
+    def test_stream_entry_matches_api_format(self):
+        """Test stream fields are strings, with empty strings for missing results"""
+        entry = record_stream_entry(to_record(_row(str(uuid.uuid4()), result_numeric=1.0, parameters={"unit": "C"})))
+
+        assert entry["result_numeric"] == "1.0"
+        assert entry["result_text"] == ""
+        assert entry["result_boolean"] == ""
+        assert json.loads(entry["parameters"]) == {"unit": "C"}
+        assert all(isinstance(v, str) for v in entry.values())
+
+
+class TestWrite:
+    """Test COPY and Redis publication"""
+
+    @pytest.mark.asyncio
+    async def test_one_copy_per_batch(self):
+        """Test a batch is written with a single COPY"""
+        sink, conn = _sink()
+        rows = [_row(str(uuid.uuid4()), result_numeric=n) for n in range(3)]
+
+        await sink.write(rows)
+
+        conn.copy_records_to_table.assert_awaited_once()
+        args, kwargs = conn.copy_records_to_table.call_args
+        assert args[0] == "observations"
+        assert len(kwargs["records"]) == 3
+        assert kwargs["columns"] == COLUMNS
+        assert sink.rows_written == 3
+
+    @pytest.mark.asyncio
+    async def test_streams_published_in_one_pipeline(self):
+        """Test every row is XADDed and each stream gets one EXPIRE"""
+        sink, _ = _sink()
+        ds_id = str(uuid.uuid4())
+
+        await sink.write([_row(ds_id, result_numeric=1), _row(ds_id, result_numeric=2)])
+
+        pipe = sink.redis.pipeline.return_value
+        assert pipe.xadd.call_count == 2
+        pipe.expire.assert_called_once_with(f"datastream:{ds_id}", 604800)
+        pipe.execute.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_redis_failure_does_not_fail_write(self):
+        """Test rows stored in the database count as written even if Redis is down"""
+        sink, _ = _sink()
+        sink.redis.pipeline.return_value.execute = AsyncMock(side_effect=ConnectionError("down"))
+
+        await sink.write([_row(str(uuid.uuid4()), result_numeric=1)])
+
+        assert sink.rows_written == 1
+
+    @pytest.mark.asyncio
+    async def test_invalid_row_rejected_before_copy(self):
+        """Test a row that cannot be converted is rejected without touching the database"""
+        sink, conn = _sink()
+
+        with pytest.raises(RowsRejected):
+            await sink.write([_row("not-a-uuid", result_numeric=1)])
+
+        conn.copy_records_to_table.assert_not_called()
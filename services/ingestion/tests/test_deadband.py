@@ -0,0 +1,95 @@
+"""
+Tests for DeadbandFilter - per-datastream deadband/heartbeat compression
+"""
+import pytest
+
+from app.deadband import DeadbandFilter
+
+DS = "11111111-1111-1111-1111-111111111111"
+
+
+def _row(value, second, ds=DS):
+    return {"datastream_id": ds, "result_time": f"2026-04-04T11:{second // 60:02d}:{second % 60:02d}+00:00",
+            "result_numeric": value}
+
+
+def _submit(deadband, *rows):
+    """Filter rows and commit the forwarded ones, as after a successful submission"""
+    kept = deadband.filter(list(rows))
+    deadband.commit(kept)
+    return kept
+
+
+@pytest.fixture
+def deadband():
+    f = DeadbandFilter()
+    f.configure({
+        "tele/SHT40_01/SENSOR": {
+            "model": "SHT40",
+            "datastreams": {"Humidity": DS},
+            "deadband": {"Humidity": {"deadband": 0.5, "heartbeat": 60}},
+        }
+    })
+    return f
+
+
+class TestDeadband:
+    """Test readings are forwarded only on change or heartbeat"""
+
+    def test_first_reading_forwarded(self, deadband):
+        """Test the first reading of a datastream always passes"""
+        assert _submit(deadband, _row(50.0, 0))
+
+    def test_small_moves_suppressed(self, deadband):
+        """Test readings within the band are dropped"""
+        _submit(deadband, _row(50.0, 0))
+        assert _submit(deadband, _row(50.3, 5), _row(49.6, 10)) == []
+        assert deadband.suppressed == 2
+
+    def test_band_measured_from_last_forwarded(self, deadband):
+        """Test slow drift is forwarded once it leaves the band around the last forwarded value"""
+        _submit(deadband, _row(50.0, 0))
+        _submit(deadband, _row(50.4, 5))
+        assert _submit(deadband, _row(50.8, 10))
+
+    def test_heartbeat_forwards_flat_line(self, deadband):
+        """Test an unchanged value is forwarded after the heartbeat interval"""
+        _submit(deadband, _row(50.0, 0))
+        assert not _submit(deadband, _row(50.0, 59))
+        assert _submit(deadband, _row(50.0, 60))
+
+    def test_redelivered_reading_forwarded(self, deadband):
+        """Test a reading not newer than the last forwarded one passes and leaves state alone"""
+        _submit(deadband, _row(50.0, 30))
+        assert _submit(deadband, _row(50.0, 30))
+        assert _submit(deadband, _row(50.1, 10))
+        assert deadband.last_forwarded(DS)[1] == 50.0
+
+    def test_batch_compared_within_itself(self, deadband):
+        """Test readings of one batch are measured against those forwarded earlier in it"""
+        rows = [_row(50.0, 0), _row(50.2, 5), _row(51.0, 10), _row(51.1, 15)]
+        assert deadband.filter(rows) == [rows[0], rows[2]]
+
+    def test_state_recorded_only_on_commit(self, deadband):
+        """Test a forwarded reading becomes the reference only once it was submitted"""
+        assert deadband.filter([_row(50.0, 0)])
+        assert deadband.last_forwarded(DS) is None
+        assert deadband.filter([_row(50.2, 5)])
+
+        deadband.commit([_row(50.2, 5)])
+        assert deadband.last_forwarded(DS)[1] == 50.2
+        deadband.commit([_row(50.0, 0)])
+        assert deadband.last_forwarded(DS)[1] == 50.2
+
+    def test_unconfigured_datastream_passes(self, deadband):
+        """Test datastreams without settings are not filtered"""
+        other = "22222222-2222-2222-2222-222222222222"
+        rows = [_row(1.0, 0, other), _row(1.0, 1, other)]
+        assert deadband.filter(rows) == rows
+
+    def test_reconfigure_drops_state_of_removed(self, deadband):
+        """Test removing a datastream's settings forgets its state"""
+        _submit(deadband, _row(50.0, 0))
+        deadband.configure({})
+        assert deadband.last_forwarded(DS) is None
+        assert deadband.filter([_row(50.0, 1)])
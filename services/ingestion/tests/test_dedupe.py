@@ -0,0 +1,141 @@
+"""
+Tests for DedupeCache - duplicate-reading suppression
+"""
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.dedupe import DedupeCache, dedupe_key
+from app.metrics import REGISTRY
+from app.queue import ObservationQueue, PendingBatch
+
+
+def _delivery(tag, payload, routing_key="tele.SHT40_01.SENSOR"):
+    return AsyncMock(delivery_tag=tag, body=json.dumps(payload).encode(), headers={}, routing_key=routing_key)
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+class TestDedupeKey:
+    """Test reading identity"""
+
+    def test_same_reading_same_key(self):
+        """Test identical bodies on the same topic and time collide"""
+        assert dedupe_key("a", "t", b"{}") == dedupe_key("a", "t", b"{}")
+
+    def test_topic_and_content_distinguish(self):
+        """Test a different topic or payload is a different reading"""
+        assert dedupe_key("a", "t", b"{}") != dedupe_key("b", "t", b"{}")
+        assert dedupe_key("a", "t", b"{}") != dedupe_key("a", "t", b"{ }")
+
+
+class TestDedupeCache:
+    """Test bounded LRU/TTL behaviour and counters"""
+
+    def test_hit_and_miss_counters(self):
+        """Test lookups are counted"""
+        cache = DedupeCache(max_size=10, ttl=60)
+        assert cache.seen("k") is False
+        cache.add("k")
+        assert cache.seen("k") is True
+
+        assert cache.as_dict()["hits"] == 1
+        assert cache.as_dict()["misses"] == 1
+
+    def test_lookups_exported_as_metrics(self):
+        """Test hits, misses and evictions reach the Prometheus counters"""
+        def sample(name, labels=None):
+            return REGISTRY.get_sample_value(name, labels or {}) or 0
+
+        before = (
+            sample("ingestion_dedupe_lookups_total", {"result": "hit"}),
+            sample("ingestion_dedupe_lookups_total", {"result": "miss"}),
+            sample("ingestion_dedupe_evictions_total"),
+        )
+        cache = DedupeCache(max_size=1, ttl=60)
+        cache.seen("a")
+        cache.add("a")
+        cache.seen("a")
+        cache.add("b")
+
+        assert sample("ingestion_dedupe_lookups_total", {"result": "hit"}) == before[0] + 1
+        assert sample("ingestion_dedupe_lookups_total", {"result": "miss"}) == before[1] + 1
+        assert sample("ingestion_dedupe_evictions_total") == before[2] + 1
+
+    def test_entries_expire(self):
+        """Test a reading is forgotten after its TTL"""
+        cache = DedupeCache(max_size=10, ttl=60)
+        with patch("app.dedupe.time.monotonic", return_value=1000.0):
+            cache.add("k")
+        with patch("app.dedupe.time.monotonic", return_value=1061.0):
+            assert cache.seen("k") is False
+        assert len(cache) == 0
+
+    def test_bounded_lru(self):
+        """Test the least recently seen reading is evicted first"""
+        cache = DedupeCache(max_size=2, ttl=60)
+        cache.add("a")
+        cache.add("b")
+        cache.seen("a")
+        cache.add("c")
+
+        assert cache.seen("a") is True
+        assert cache.seen("b") is False
+        assert cache.evictions == 1
+
+
+class TestQueueDeduplication:
+    """Test duplicates are dropped before reaching the batch"""
+
+    @pytest.mark.asyncio
+    async def test_duplicate_of_ingested_reading_dropped(self):
+        """Test a resent reading is acked without being batched again"""
+        queue = ObservationQueue(auto_ack=False)
+        queue.dedupe = DedupeCache()
+        payload = {"Time": "2026-04-04T12:00:00", "SHT4X": {"Temperature": 21.0}}
+        first = _delivery(1, payload)
+
+        queue.queue = MagicMock()
+        queue.queue.iterator.return_value.__aenter__.return_value = _aiter([first])
+        await queue.consume_messages()
+        await queue.ack_batch(_pending(queue))
+
+        resent = _delivery(2, payload)
+        queue.queue.iterator.return_value.__aenter__.return_value = _aiter([resent])
+        await queue.consume_messages()
+
+        assert queue.batch == []
+        resent.ack.assert_called_once_with(multiple=True)
+        assert queue.dedupe.hits == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_reading_not_remembered(self):
+        """Test a reading that was never acked is not treated as a duplicate on retry"""
+        queue = ObservationQueue(auto_ack=False)
+        queue.dedupe = DedupeCache()
+        queue.channel = AsyncMock()
+        queue.retry_exchange = AsyncMock()
+        payload = {"Time": "2026-04-04T12:00:00", "SHT4X": {"Temperature": 21.0}}
+
+        queue.queue = MagicMock()
+        queue.queue.iterator.return_value.__aenter__.return_value = _aiter([_delivery(1, payload)])
+        await queue.consume_messages()
+        await queue.move_batch_to_dlq(_pending(queue))
+
+        queue.queue.iterator.return_value.__aenter__.return_value = _aiter([_delivery(2, payload)])
+        await queue.consume_messages()
+
+        assert len(queue.batch) == 1
+        assert queue.dedupe.hits == 0
+
+
+def _pending(queue):
+    """Detach the open batch the way _flush_batch does"""
+    batch = PendingBatch(queue.batch.copy(), queue.batch_messages.copy(), queue.batch_keys.copy())
+    queue.batch.clear()
+    queue.batch_messages.clear()
+    queue.batch_keys.clear()
+    return batch
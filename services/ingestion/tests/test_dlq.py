@@ -1,11 +1,16 @@
 """
 Tests for Dead Letter Queue (DLQ) functionality
 """
+import asyncio
 import pytest
 from datetime import datetime, timezone
 from unittest.mock import Mock, patch, AsyncMock, MagicMock
 
-from app.queue import ObservationQueue, DLQ_NAME, QUEUE_NAME, MAX_MESSAGE_RETRIES
+from app.queue import (
+    ObservationQueue, PendingBatch, DLQ_NAME, QUEUE_NAME, MAX_MESSAGE_RETRIES,
+    RETRY_EXCHANGE, REQUEUE_EXCHANGE, retry_delay, retry_queue_name,
+)
+from app.dlq import DlqBrowser, DlqFilter
 
 
 class TestDLQConfiguration:
@@ -132,15 +137,18 @@ class TestDLQMovement:
         
         queue.pending_ack_messages.append(mock_message)
         
-        # Mock the publish method
+        # Mock the publish methods
         queue.channel.default_exchange.publish = AsyncMock()
+        queue.retry_exchange = AsyncMock()
         
         await queue.move_batch_to_dlq()
         
-        # Verify message was published back to main queue
-        assert queue.channel.default_exchange.publish.called
-        routing_keys = [call[1].get('routing_key') for call in queue.channel.default_exchange.publish.call_args_list]
-        assert QUEUE_NAME in routing_keys
+        # Verify message was parked in the delay queue for its next attempt, not the DLQ
+        assert not queue.channel.default_exchange.publish.called
+        queue.retry_exchange.publish.assert_called_once()
+        message = queue.retry_exchange.publish.call_args[0][0]
+        assert message.headers["retry-attempt"] == str(MAX_MESSAGE_RETRIES)
+        assert queue.retry_exchange.publish.call_args[1]["routing_key"] == QUEUE_NAME
 
     @pytest.mark.asyncio
     async def test_dlq_message_contains_metadata(self):
@@ -202,17 +210,14 @@ class TestRetryLogic:
         mock_message.ack = AsyncMock()
         
         queue.pending_ack_messages.append(mock_message)
-        queue.channel.default_exchange.publish = AsyncMock()
+        queue.retry_exchange = AsyncMock()
         
         await queue.move_batch_to_dlq()
         
-        # Verify message was requeued to main queue with incremented count
-        if queue.channel.default_exchange.publish.called:
-            for call in queue.channel.default_exchange.publish.call_args_list:
-                routing_key = call[1].get('routing_key')
-                if routing_key == QUEUE_NAME:
-                    # Found the requeue call
-                    break
+        # Verify message was scheduled for retry with incremented count and a growing delay
+        message = queue.retry_exchange.publish.call_args[0][0]
+        assert message.headers["x-retry-count"] == original_retry_count + 1
+        assert message.expiration == retry_delay(original_retry_count + 1)
 
 
 class TestDLQEdgeCases:
@@ -258,16 +263,17 @@ class TestDLQEdgeCases:
         queue.channel = AsyncMock()
         queue.pending_ack_messages = []
         queue.channel.default_exchange.publish = AsyncMock()
+        queue.retry_exchange = AsyncMock()
         
         # Message that should be requeued
-        msg1 = AsyncMock()
+        msg1 = AsyncMock(delivery_tag=1)
         msg1.headers = {"x-retry-count": 1}
         msg1.routing_key = QUEUE_NAME
         msg1.body = b"data1"
         msg1.ack = AsyncMock()
         
         # Message that should go to DLQ
-        msg2 = AsyncMock()
+        msg2 = AsyncMock(delivery_tag=2)
         msg2.headers = {"x-retry-count": MAX_MESSAGE_RETRIES}
         msg2.routing_key = QUEUE_NAME
         msg2.body = b"data2"
@@ -279,9 +285,9 @@ class TestDLQEdgeCases:
         
         # Both should be processed
         assert len(queue.pending_ack_messages) == 0
-        # Both should be acknowledged
-        assert msg1.ack.called
-        assert msg2.ack.called
+        # Both are acknowledged by one multi-ack on the highest delivery tag
+        msg2.ack.assert_called_once_with(multiple=True)
+        assert not msg1.ack.called
 
     @pytest.mark.asyncio
     async def test_message_ack_after_dlq_move(self):
@@ -324,3 +330,299 @@ class TestDLQQueueIntegration:
         
         # Lock should be available
         assert not queue.batch_lock.locked()
+
+
+class TestDelayedRetryTopology:
+    """Test TTL delay queues that dead-letter back to the main queue"""
+
+    def test_retry_delay_grows_per_attempt(self):
+        """Test each attempt waits longer than the previous one, up to the cap"""
+        delays = [retry_delay(attempt) for attempt in range(1, 6)]
+        assert delays == sorted(delays)
+
+    def test_retry_delay_is_capped(self):
+        """Test the delay never exceeds the configured maximum"""
+        assert retry_delay(100) == retry_delay(200)
+
+    def test_retry_queue_names(self):
+        """Test delay queue naming"""
+        assert retry_queue_name(1) == f"{QUEUE_NAME}.retry.1"
+        assert retry_queue_name(1) != retry_queue_name(2)
+
+    @pytest.mark.asyncio
+    async def test_connect_declares_delay_queues(self):
+        """Test connect declares one delay queue per attempt dead-lettering into the requeue exchange"""
+        queue = ObservationQueue()
+        mock_connection = AsyncMock()
+        mock_channel = AsyncMock()
+
+        with patch('app.queue.aio_pika') as mock_pika:
+            mock_pika.connect = AsyncMock(return_value=mock_connection)
+            mock_connection.channel = AsyncMock(return_value=mock_channel)
+            await queue.connect()
+
+        exchanges = [c[0][0] for c in mock_channel.declare_exchange.call_args_list]
+        assert REQUEUE_EXCHANGE in exchanges
+        assert RETRY_EXCHANGE in exchanges
+
+        delay_queues = {
+            c[0][0]: c[1]["arguments"]
+            for c in mock_channel.declare_queue.call_args_list
+            if c[0][0] != QUEUE_NAME
+        }
+        assert set(delay_queues) == {retry_queue_name(a) for a in range(1, MAX_MESSAGE_RETRIES + 1)}
+        for arguments in delay_queues.values():
+            assert arguments["x-dead-letter-exchange"] == REQUEUE_EXCHANGE
+
+    @pytest.mark.asyncio
+    async def test_retry_preserves_original_routing_key(self):
+        """Test a retried message keeps its topic routing key"""
+        queue = ObservationQueue()
+        queue.channel = AsyncMock()
+        queue.retry_exchange = AsyncMock()
+
+        mock_message = AsyncMock(delivery_tag=1)
+        mock_message.headers = {}
+        mock_message.routing_key = "tele.SHT40_01.SENSOR"
+        mock_message.body = b"{}"
+        queue.pending_ack_messages.append(mock_message)
+
+        await queue.move_batch_to_dlq()
+
+        call_kwargs = queue.retry_exchange.publish.call_args[1]
+        assert call_kwargs["routing_key"] == "tele.SHT40_01.SENSOR"
+
+    def test_original_routing_key_prefers_header(self):
+        """Test messages republished via the default exchange recover their topic from headers"""
+        message = MagicMock()
+        message.routing_key = QUEUE_NAME
+        message.headers = {"x-original-routing-key": "tele.A1T_01.SENSOR"}
+
+        assert ObservationQueue.original_routing_key(message) == "tele.A1T_01.SENSOR"
+
+
+class TestPartialBatchSettlement:
+    """Test settling individual messages of a batch (poison isolation)"""
+
+    @staticmethod
+    def _batch(count):
+        messages = []
+        for tag in range(1, count + 1):
+            msg = AsyncMock(delivery_tag=tag)
+            msg.headers = {}
+            msg.routing_key = "tele.SHT40_01.SENSOR"
+            msg.body = b"{}"
+            messages.append(msg)
+        return PendingBatch([{}] * count, messages)
+
+    @pytest.mark.asyncio
+    async def test_dead_letter_only_given_indices(self):
+        """Test only the poison messages are published to the DLQ"""
+        queue = ObservationQueue()
+        queue.channel = AsyncMock()
+        batch = self._batch(3)
+        for msg in batch.messages:
+            queue.deliveries.track(msg)
+
+        await queue.dead_letter_batch([1], reason="api-rejected", batch=batch)
+
+        queue.channel.default_exchange.publish.assert_called_once()
+        headers = queue.channel.default_exchange.publish.call_args[0][0].headers
+        assert headers["x-failure-reason"] == "api-rejected"
+        assert batch.unsettled == {0, 2}
+        assert not batch.settled
+
+    @pytest.mark.asyncio
+    async def test_partial_settlement_completes_batch(self):
+        """Test ack + retry of disjoint subsets settles the whole batch exactly once"""
+        queue = ObservationQueue()
+        queue.channel = AsyncMock()
+        queue.retry_exchange = AsyncMock()
+        batch = self._batch(4)
+        for msg in batch.messages:
+            queue.deliveries.track(msg)
+
+        await queue.ack_batch(batch, indices=[0, 1, 3])
+        await queue.move_batch_to_dlq(batch, indices=[2, 3])  # 3 already settled - ignored
+
+        assert batch.settled
+        assert queue.retry_exchange.publish.call_count == 1
+        batch.messages[3].ack.assert_called_once_with(multiple=True)
+
+    @pytest.mark.asyncio
+    async def test_dead_letter_batch_requires_batch(self):
+        """Test poison isolation outside a batch handler is refused"""
+        queue = ObservationQueue()
+
+        with pytest.raises(RuntimeError):
+            await queue.dead_letter_batch([0])
+
+
+class TestConfirmBatching:
+    """Test failed messages are republished concurrently and multi-acked after their confirms"""
+
+    @staticmethod
+    def _tracked(queue, count, retry_count=0):
+        batch = TestPartialBatchSettlement._batch(count)
+        for msg in batch.messages:
+            msg.headers = {"x-retry-count": retry_count}
+            queue.deliveries.track(msg)
+        return batch
+
+    @pytest.mark.asyncio
+    async def test_publishes_before_awaiting_confirms(self):
+        """Test every copy is in flight before any confirm arrives"""
+        queue = ObservationQueue()
+        queue.channel = AsyncMock()
+        queue.retry_exchange = MagicMock()
+        batch = self._tracked(queue, 5)
+        started, confirm = [], asyncio.Event()
+
+        async def publish(message, routing_key):
+            started.append(routing_key)
+            await confirm.wait()
+
+        queue.retry_exchange.publish = publish
+        task = asyncio.create_task(queue.move_batch_to_dlq(batch))
+        await asyncio.sleep(0.01)
+        assert len(started) == 5  # All published, none confirmed yet
+        confirm.set()
+        await task
+
+        assert batch.settled
+        batch.messages[-1].ack.assert_called_once_with(multiple=True)
+        for msg in batch.messages[:-1]:
+            msg.ack.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_unconfirmed_copy_is_requeued(self):
+        """Test a message whose copy was not confirmed is nacked, the rest acked"""
+        queue = ObservationQueue()
+        queue.channel = AsyncMock()
+        queue.channel.default_exchange.publish = AsyncMock(side_effect=[None, RuntimeError("nack"), None])
+        batch = self._tracked(queue, 3, retry_count=MAX_MESSAGE_RETRIES)
+
+        await queue.move_batch_to_dlq(batch)
+
+        batch.messages[1].nack.assert_called_once_with(requeue=True)
+        batch.messages[2].ack.assert_called_once_with(multiple=True)
+
+    @pytest.mark.asyncio
+    async def test_dead_letter_confirms_together(self):
+        """Test poison messages are dead-lettered with one multi-ack"""
+        queue = ObservationQueue()
+        queue.channel = AsyncMock()
+        batch = self._tracked(queue, 3)
+
+        await queue.dead_letter_batch([0, 1, 2], reason="no-data", batch=batch)
+
+        assert queue.channel.default_exchange.publish.await_count == 3
+        batch.messages[2].ack.assert_called_once_with(multiple=True)
+        batch.messages[0].ack.assert_not_called()
+
+
+def _dlq_message(routing_key="tele.SHT40_01.SENSOR", failed_at="2026-04-04T12:00:00+00:00", reason="api-rejected"):
+    message = MagicMock()
+    message.body = b'{"Time": "2026-04-04T12:00:00"}'
+    message.routing_key = DLQ_NAME
+    message.headers = {
+        "x-original-routing-key": routing_key,
+        "x-failed-at": failed_at,
+        "x-retry-count": 3,
+        "x-failure-reason": reason,
+    }
+    message.ack = AsyncMock()
+    message.nack = AsyncMock()
+    return message
+
+
+def _browser(messages):
+    """DlqBrowser over a fake DLQ serving ``messages`` through basic.get"""
+    browser = DlqBrowser(MagicMock())
+    browser.queue = MagicMock()
+    browser.queue.declaration_result.message_count = len(messages)
+    browser.queue.get = AsyncMock(side_effect=list(messages) + [None])
+    exchange = MagicMock()
+    exchange.publish = AsyncMock()
+    browser.channel.get_exchange = AsyncMock(return_value=exchange)
+    return browser, exchange
+
+
+class TestDlqBrowser:
+    """Test non-destructive peek, filtering and confirmed replay"""
+
+    @pytest.mark.asyncio
+    async def test_peek_returns_every_message_to_the_queue(self):
+        """Test peeking nacks every fetched message back instead of acking it"""
+        messages = [_dlq_message() for _ in range(3)]
+        browser, _ = _browser(messages)
+
+        found = await browser.peek(count=2)
+
+        assert len(found) == 2
+        assert found[0]["original_routing_key"] == "tele.SHT40_01.SENSOR"
+        for message in messages[:2]:
+            message.nack.assert_awaited_once_with(requeue=True)
+            message.ack.assert_not_called()
+
+    def test_filter_by_routing_key_and_time(self):
+        """Test routing key globs and failure time bounds"""
+        selector = DlqFilter(
+            routing_key="tele.A1T_*.SENSOR",
+            since=datetime(2026, 4, 4, 11, tzinfo=timezone.utc),
+        )
+
+        assert selector.matches(_dlq_message("tele.A1T_01.SENSOR"))
+        assert not selector.matches(_dlq_message("tele.SHT40_01.SENSOR"))
+        assert not selector.matches(_dlq_message("tele.A1T_01.SENSOR", failed_at="2026-04-04T10:00:00+00:00"))
+        assert not selector.matches(_dlq_message("tele.A1T_01.SENSOR", failed_at=None))
+
+    @pytest.mark.asyncio
+    async def test_replay_acks_only_confirmed_matches(self):
+        """Test matching messages are republished and acked, the rest requeued"""
+        match, other = _dlq_message("tele.A1T_01.SENSOR"), _dlq_message("tele.SHT40_01.SENSOR")
+        browser, exchange = _browser([match, other])
+
+        stats = await browser.replay(DlqFilter(routing_key="tele.A1T_*"))
+
+        assert stats == {"replayed": 1, "failed": 0, "skipped": 1}
+        published, kwargs = exchange.publish.call_args
+        assert kwargs["routing_key"] == "tele.A1T_01.SENSOR"
+        assert published[0].headers["x-retry-count"] == 0
+        match.ack.assert_awaited_once()
+        other.ack.assert_not_called()
+        other.nack.assert_awaited_once_with(requeue=True)
+
+    @pytest.mark.asyncio
+    async def test_replay_goes_through_requeue_exchange(self):
+        """Test replays enter where delayed retries do (sharding-aware)"""
+        browser, _ = _browser([_dlq_message()])
+
+        await browser.replay()
+
+        browser.channel.get_exchange.assert_awaited_once_with(REQUEUE_EXCHANGE)
+
+    @pytest.mark.asyncio
+    async def test_unconfirmed_replay_stays_in_dlq(self):
+        """Test a message whose publish was not confirmed is kept"""
+        message = _dlq_message()
+        browser, exchange = _browser([message])
+        exchange.publish.side_effect = RuntimeError("nack from broker")
+
+        stats = await browser.replay()
+
+        assert stats["failed"] == 1
+        message.ack.assert_not_called()
+        message.nack.assert_awaited_once_with(requeue=True)
+
+    @pytest.mark.asyncio
+    async def test_replay_limit(self):
+        """Test replay stops after the limit and leaves the rest untouched"""
+        messages = [_dlq_message() for _ in range(5)]
+        browser, exchange = _browser(messages)
+
+        stats = await browser.replay(limit=2)
+
+        assert stats["replayed"] == 2
+        assert exchange.publish.await_count == 2
+        assert browser.queue.get.await_count == 2
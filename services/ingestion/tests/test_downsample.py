@@ -0,0 +1,135 @@
+"""
+Tests for Downsampler - windowed aggregation of high-frequency datastreams
+"""
+import pytest
+
+from app.downsample import Downsampler
+
+DS = "11111111-1111-1111-1111-111111111111"
+OTHER = "22222222-2222-2222-2222-222222222222"
+
+
+def _row(value, second, ds=DS):
+    return {"datastream_id": ds, "result_time": f"2026-04-04T11:{second // 60:02d}:{second % 60:02d}+00:00",
+            "result_numeric": value}
+
+
+@pytest.fixture
+def downsampler():
+    d = Downsampler(grace=5)
+    d.configure({
+        "tele/A1T_01/SENSOR": {
+            "model": "A1T",
+            "datastreams": {"Power": DS, "Voltage": OTHER},
+            "downsample": {"Power": {"window": 60, "value": "mean"}},
+        }
+    })
+    return d
+
+
+class TestWindowing:
+    """Test readings are folded into clock-aligned windows"""
+
+    def test_raw_rows_absorbed(self, downsampler):
+        """Test downsampled datastreams produce no raw rows; others pass through"""
+        passed = downsampler.filter([_row(100.0, 1), _row(230.0, 1, OTHER)], now=0)
+
+        assert passed == [_row(230.0, 1, OTHER)]
+        assert downsampler.outbox == []
+        assert len(downsampler) == 1
+
+    def test_next_window_closes_previous(self, downsampler):
+        """Test a reading in a later window emits the previous window's aggregates"""
+        for i, value in enumerate([100.0, 300.0, 200.0]):
+            downsampler.filter([_row(value, 10 + i * 10)], now=0)
+        downsampler.filter([_row(50.0, 61)], now=1)
+
+        (row,) = downsampler.take_outbox()
+        assert row["result_time"] == "2026-04-04T11:00:00+00:00"
+        assert row["result_numeric"] == pytest.approx(200.0)
+        assert row["parameters"]["aggregation"] == {
+            "window": 60, "mean": pytest.approx(200.0), "min": 100.0, "max": 300.0, "last": 200.0, "count": 3,
+        }
+
+    def test_value_aggregate_configurable(self, downsampler):
+        """Test result_numeric follows the configured aggregate"""
+        downsampler.configure({
+            "t": {"datastreams": {"Power": DS}, "downsample": {"Power": {"window": 60, "value": "max"}}}
+        })
+        downsampler.filter([_row(1.0, 1), _row(5.0, 2), _row(3.0, 3)], now=0)
+        downsampler.close_all()
+
+        assert downsampler.take_outbox()[0]["result_numeric"] == 5.0
+
+    def test_redelivered_sample_not_double_counted(self, downsampler):
+        """Test a sample not newer than the last absorbed one is ignored"""
+        downsampler.filter([_row(100.0, 10), _row(200.0, 20)], now=0)
+        downsampler.filter([_row(100.0, 10)], now=0)
+        downsampler.close_all()
+
+        assert downsampler.take_outbox()[0]["parameters"]["aggregation"]["count"] == 2
+        assert downsampler.late == 1
+
+
+class TestFlushDeadline:
+    """Test quiet windows are flushed by their deadline"""
+
+    def test_window_closed_at_deadline(self, downsampler):
+        """Test a window with no further readings closes once window + grace has passed"""
+        downsampler.filter([_row(100.0, 10)], now=1000.0)
+
+        assert downsampler.next_deadline == 1065.0
+        assert downsampler.close_due(now=1064.0) == 0
+        assert downsampler.close_due(now=1065.0) == 1
+        assert len(downsampler.take_outbox()) == 1
+
+    def test_stale_deadline_skipped(self, downsampler):
+        """Test a deadline of a window already closed by a newer reading is ignored"""
+        downsampler.filter([_row(100.0, 10)], now=1000.0)
+        downsampler.filter([_row(100.0, 70)], now=1050.0)
+        downsampler.take_outbox()
+
+        assert downsampler.close_due(now=1070.0) == 0
+        assert len(downsampler) == 1
+
+    def test_late_sample_for_closed_window_dropped(self, downsampler):
+        """Test a sample arriving after its window was force-closed does not emit that window again"""
+        downsampler.filter([_row(100.0, 10)], now=1000.0)
+        downsampler.close_due(now=1065.0)
+        downsampler.filter([_row(200.0, 45)], now=1066.0)
+        downsampler.filter([_row(300.0, 70)], now=1070.0)
+        downsampler.close_all()
+
+        assert [r["result_time"] for r in downsampler.take_outbox()] == [
+            "2026-04-04T11:00:00+00:00", "2026-04-04T11:01:00+00:00",
+        ]
+        assert downsampler.late == 1
+
+    def test_requeue_keeps_failed_rows_first(self, downsampler):
+        """Test rows that failed to submit are retried before newer ones"""
+        downsampler.filter([_row(1.0, 1)], now=0)
+        downsampler.close_all()
+        failed = downsampler.take_outbox()
+        downsampler.filter([_row(2.0, 61)], now=0)
+        downsampler.close_all()
+        downsampler.requeue(failed)
+
+        assert [r["result_numeric"] for r in downsampler.take_outbox()] == [1.0, 2.0]
+
+
+class TestReconfigure:
+    """Test config reloads"""
+
+    def test_removed_setting_closes_window(self, downsampler):
+        """Test a datastream that stops being downsampled emits its partial window"""
+        downsampler.filter([_row(100.0, 10)], now=0)
+        downsampler.configure({})
+
+        assert len(downsampler) == 0
+        assert len(downsampler.outbox) == 1
+
+    def test_invalid_setting_ignored(self):
+        """Test a bad window config is skipped"""
+        d = Downsampler()
+        d.configure({"t": {"datastreams": {"Power": DS}, "downsample": {"Power": {"window": 0}}}})
+        assert d.settings == {}
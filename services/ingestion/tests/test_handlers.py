@@ -4,7 +4,10 @@ Unit tests for message handlers - sensor data transformation
 import pytest
 from datetime import datetime, timezone, timedelta
 from uuid import uuid4
-from app.handlers import handle_sensor_SHT40, handle_sensor_A1T, _parse_time
+from app.handlers import (
+    handle_sensor_SHT40, handle_sensor_A1T, _parse_time,
+    compile_extractor, compile_topic_config, MODEL_EXTRACTORS,
+)
 
 
 class TestParseTime:
@@ -338,3 +341,67 @@ class TestHandlerDataValidation:
         # Should only have Temperature observation
         assert len(observations) == 1
         assert observations[0].result_numeric == 22.5
+
+
+class TestCompiledExtractor:
+    """Test declarative extractor specs compiled per topic"""
+
+    def test_extracts_json_ready_rows(self, sample_datastreams, sample_sht40_payload):
+        """Test rows are plain dicts with string ids and ISO timestamps"""
+        extract = compile_extractor(MODEL_EXTRACTORS["SHT40"], sample_datastreams)
+        rows = []
+
+        added = extract(sample_sht40_payload, rows)
+
+        assert added == 3
+        assert rows[0] == {
+            "datastream_id": sample_datastreams["Temperature"],
+            "result_time": "2026-04-04T11:00:00+00:00",
+            "result_numeric": 22.5,
+        }
+
+    def test_appends_to_shared_batch(self, sample_datastreams, sample_sht40_payload, sample_a1t_payload):
+        """Test several payloads extend one row list in a single pass"""
+        rows = []
+        compile_extractor(MODEL_EXTRACTORS["SHT40"], sample_datastreams)(sample_sht40_payload, rows)
+        compile_extractor(MODEL_EXTRACTORS["A1T"], sample_datastreams)(sample_a1t_payload, rows)
+
+        assert len(rows) == 6
+
+    def test_nested_path(self):
+        """Test field paths can go deeper than one section"""
+        ds_id = str(uuid4())
+        extract = compile_extractor({"A.B.C": "Deep"}, {"Deep": ds_id})
+        rows = []
+
+        extract({"A": {"B": {"C": 7}}}, rows)
+
+        assert rows[0]["result_numeric"] == 7.0
+
+    def test_invalid_datastream_id_rejected_at_compile_time(self):
+        """Test datastream ids are validated once when compiling"""
+        with pytest.raises(ValueError):
+            compile_extractor({"SHT4X.Temperature": "Temperature"}, {"Temperature": "not-a-uuid"})
+
+    def test_non_numeric_value_raises(self):
+        """Test a non-numeric reading fails the message like validation would"""
+        extract = compile_extractor({"SHT4X.Temperature": "Temperature"}, {"Temperature": str(uuid4())})
+        with pytest.raises(ValueError):
+            extract({"SHT4X": {"Temperature": "warm"}}, [])
+
+    def test_topic_config_uses_own_spec(self):
+        """Test a topic config's extractor entry overrides the model default"""
+        ds_id = str(uuid4())
+        extract = compile_topic_config({
+            "model": "SHT40",
+            "extractor": {"Custom.T": "Temperature"},
+            "datastreams": {"Temperature": ds_id},
+        })
+        rows = []
+        extract({"Custom": {"T": 1.5}, "SHT4X": {"Temperature": 9.9}}, rows)
+
+        assert [row["result_numeric"] for row in rows] == [1.5]
+
+    def test_topic_config_without_spec(self):
+        """Test unknown models without an extractor entry do not compile"""
+        assert compile_topic_config({"model": "UNKNOWN", "datastreams": {}}) is None
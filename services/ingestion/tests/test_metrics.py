@@ -0,0 +1,78 @@
+"""
+Tests for the Prometheus metrics - label series cap and queue lag estimate
+"""
+import math
+import pytest
+from prometheus_client import CollectorRegistry, Counter, generate_latest
+
+from app.metrics import CappedLabels, queue_lag, REGISTRY
+
+
+class TestSeriesCap:
+    """Test label sets beyond the cap are folded into ``other``"""
+
+    def _counter(self, labelnames=("topic",), max_series=2):
+        registry = CollectorRegistry()
+        return registry, CappedLabels(Counter("test_capped_total", "Capped", list(labelnames), registry=registry), max_series)
+
+    def test_label_series_capped(self):
+        registry, counter = self._counter()
+        for topic in ("a", "b", "c", "d"):
+            counter.labels(topic).inc()
+
+        assert registry.get_sample_value("test_capped_total", {"topic": "a"}) == 1
+        assert registry.get_sample_value("test_capped_total", {"topic": "b"}) == 1
+        assert registry.get_sample_value("test_capped_total", {"topic": "c"}) is None
+        assert registry.get_sample_value("test_capped_total", {"topic": "other"}) == 2
+
+    def test_known_series_kept_after_cap(self):
+        registry, counter = self._counter()
+        for topic in ("a", "b", "c", "a"):
+            counter.labels(topic).inc()
+
+        assert registry.get_sample_value("test_capped_total", {"topic": "a"}) == 2
+
+    def test_other_spans_every_label(self):
+        registry, counter = self._counter(labelnames=("topic", "reason"), max_series=1)
+        counter.labels("a", "no-data").inc()
+        counter.labels("b", "undecodable").inc()
+
+        assert registry.get_sample_value("test_capped_total", {"topic": "other", "reason": "other"}) == 1
+
+    def test_clear_resets_cap(self):
+        registry, counter = self._counter(max_series=1)
+        counter.labels("a").inc()
+        counter.clear()
+        counter.labels("b").inc()
+
+        assert registry.get_sample_value("test_capped_total", {"topic": "b"}) == 1
+
+    def test_wrong_label_count(self):
+        _, counter = self._counter(labelnames=("topic", "reason"))
+
+        with pytest.raises(ValueError):
+            counter.labels("only-topic")
+
+
+class TestExposition:
+    """Test the worker's metrics are registered for /metrics"""
+
+    def test_worker_metrics_registered(self):
+        body = generate_latest(REGISTRY).decode()
+
+        assert "# TYPE ingestion_messages_consumed_total counter" in body
+        assert "# TYPE ingestion_batch_size histogram" in body
+        assert "# TYPE ingestion_queue_lag_seconds gauge" in body
+
+
+class TestQueueLag:
+    """Test the drain time estimate"""
+
+    def test_lag_from_rate(self):
+        assert queue_lag(depth=100, consumed=50, interval=10) == 20
+
+    def test_empty_queue(self):
+        assert queue_lag(depth=0, consumed=0, interval=10) == 0
+
+    def test_stalled_consumer(self):
+        assert math.isinf(queue_lag(depth=10, consumed=0, interval=10))
@@ -0,0 +1,266 @@
+"""
+Tests for MqttObservationQueue - native MQTT source with acks tied to settlement
+"""
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+import pytest
+
+from app.metrics import MESSAGES_CONSUMED
+from app.mqtt_source import MqttDelivery, MqttObservationQueue, SpooledRetry, shared_subscription
+from app.queue import MAX_MESSAGE_RETRIES
+
+
+def _queue(**kwargs):
+    kwargs.setdefault("retry_dir", "")
+    queue = MqttObservationQueue(topics=["tele/+/SENSOR"], client_id="test-worker", auto_ack=False, **kwargs)
+    queue.client = MagicMock()
+    return queue
+
+
+def _delivery(queue, tag=1, topic="tele/SHT40_01/SENSOR", body=None):
+    payload = json.dumps(body or {"Time": f"2026-04-04T12:00:{tag:02d}", "SHT40": {"Temperature": 21.5}}).encode()
+    return MqttDelivery(queue.client, tag, topic, payload, mid=100 + tag, qos=1)
+
+
+class TestSubscription:
+    """Test subscription topics"""
+
+    def test_shared_subscription(self):
+        assert shared_subscription("tele/+/SENSOR", "ingestion") == "$share/ingestion/tele/+/SENSOR"
+        assert shared_subscription("tele/+/SENSOR", "") == "tele/+/SENSOR"
+
+    def test_subscriptions_use_group(self):
+        queue = _queue(shared_group="workers")
+
+        assert queue.subscriptions == ["$share/workers/tele/+/SENSOR"]
+
+    @pytest.mark.asyncio
+    async def test_messages_handed_over_from_network_thread(self):
+        """Test paho's on_message callback queues the message for the event loop"""
+        queue = _queue()
+        queue._loop = asyncio.get_running_loop()
+
+        queue._on_message(None, None, SimpleNamespace(topic="tele/A/SENSOR", payload=b"{}", mid=7, qos=1))
+
+        assert await asyncio.wait_for(queue._inbox.get(), timeout=1) == ("tele/A/SENSOR", b"{}", 7, 1)
+
+
+class TestAcknowledgement:
+    """Test PUBACKs are sent only once messages are settled"""
+
+    @pytest.mark.asyncio
+    async def test_message_batched_under_routing_key(self):
+        """Test MQTT topics are batched under the routing key the RabbitMQ bridge would give them"""
+        queue = _queue()
+
+        await queue._receive(_delivery(queue))
+
+        assert queue.batch[0]["topic"] == "tele.SHT40_01.SENSOR"
+        assert len(queue.deliveries) == 1
+        queue.client.ack.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_ack_after_handler_accepts(self):
+        """Test the batch's messages are PUBACKed when the handler acknowledges them"""
+        queue = _queue()
+
+        async def handler(payloads):
+            await queue.ack_batch()
+
+        queue.register_handler(handler)
+        await queue._receive(_delivery(queue, tag=1))
+        await queue._receive(_delivery(queue, tag=2))
+
+        await queue._flush_batch()
+
+        assert [c.args for c in queue.client.ack.call_args_list] == [(101, 1), (102, 1)]
+        assert len(queue.deliveries) == 0
+
+    @pytest.mark.asyncio
+    async def test_acks_follow_receive_order(self):
+        """Test a message settled early is PUBACKed only once every earlier message is settled"""
+        queue = _queue()
+        first, second, third = (_delivery(queue, tag=tag) for tag in (1, 2, 3))
+        for delivery in (first, second, third):
+            queue.deliveries.track(delivery)
+
+        await queue._settle([third])
+        queue.client.ack.assert_not_called()
+
+        await queue._settle([first])
+        assert [c.args for c in queue.client.ack.call_args_list] == [(101, 1)]
+
+        await queue._settle([second])
+        assert [c.args for c in queue.client.ack.call_args_list] == [(101, 1), (102, 1), (103, 1)]
+        assert len(queue.deliveries) == 0
+
+    @pytest.mark.asyncio
+    async def test_auto_ack_leaves_acks_to_paho(self):
+        """Test auto-ack mode does not track deliveries (paho acknowledges on receipt)"""
+        queue = _queue()
+        queue.auto_ack = True
+
+        await queue._receive(_delivery(queue))
+
+        assert len(queue.batch) == 1
+        assert len(queue.deliveries) == 0
+        assert queue.batch_messages == []
+
+
+async def _wait_for_batch(queue, size=1):
+    while len(queue.batch) < size:
+        await asyncio.sleep(0.01)
+
+
+class TestRetries:
+    """Test failed messages are handed to the retry spools, then dead-lettered"""
+
+    @pytest.mark.asyncio
+    async def test_consumed_counted_on_first_receipt_only(self):
+        """Test a retried message is not counted as consumed again"""
+        queue = _queue()
+        queue._inbox.put_nowait(("tele/COUNT_01/SENSOR", b'{"Time": "2026-04-04T12:00:00"}', 1, 1))
+        consumer = asyncio.create_task(queue.consume_messages())
+        await asyncio.wait_for(_wait_for_batch(queue), timeout=1)
+        consumer.cancel()
+        queue.register_handler(AsyncMock(side_effect=RuntimeError("API down")))
+
+        with patch("app.mqtt_source.retry_delay", return_value=0):
+            await queue._flush_batch()
+            await asyncio.gather(*queue._retry_tasks)
+
+        assert len(queue.batch) == 1
+        assert MESSAGES_CONSUMED.metric.labels("tele.COUNT_01.SENSOR")._value.get() == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_message_spooled_and_acked(self, tmp_path):
+        """Test a failed message is PUBACKed once spooled, so later PUBACKs go out, and comes back when due"""
+        queue = _queue(retry_dir=str(tmp_path))
+        await queue.open_retry_spools()
+        failed, later = _delivery(queue, tag=1), _delivery(queue, tag=2)
+        queue.deliveries.track(failed)
+        queue.deliveries.track(later)
+        await queue._receive(failed)
+        queue.register_handler(AsyncMock(side_effect=RuntimeError("API down")))
+
+        try:
+            with patch("app.mqtt_source.retry_delay", return_value=0):
+                await queue._flush_batch()
+                await queue._settle([later])
+
+                assert [c.args for c in queue.client.ack.call_args_list] == [(101, 1), (102, 1)]
+                await asyncio.wait_for(_wait_for_batch(queue), timeout=1)
+
+            retry = queue.batch_messages[0]
+            assert isinstance(retry, SpooledRetry)
+            assert retry.headers["x-retry-count"] == 1
+            assert queue.batch[0]["topic"] == "tele.SHT40_01.SENSOR"
+            spool = queue.retry_spools[1]
+            assert not spool.is_empty()
+
+            async def handler(payloads):
+                await queue.ack_batch()
+
+            queue.register_handler(handler)
+            await queue._flush_batch()
+
+            assert spool.is_empty()
+            assert queue.client.ack.call_count == 2
+        finally:
+            await queue.close_retry_spools()
+
+    @pytest.mark.asyncio
+    async def test_spooled_retry_fed_again_after_restart(self, tmp_path):
+        """Test a spooled retry that was never settled is fed again by the next worker"""
+        queue = _queue(retry_dir=str(tmp_path))
+        await queue.open_retry_spools()
+        delivery = _delivery(queue)
+        delivery.headers["x-retry-count"] = 2
+        with patch("app.mqtt_source.retry_delay", return_value=0):
+            assert await queue._spool_retries([delivery], attempt=2)
+        await asyncio.wait_for(_wait_for_batch(queue), timeout=1)
+        await queue.close_retry_spools()
+
+        restarted = _queue(retry_dir=str(tmp_path))
+        await restarted.open_retry_spools()
+        try:
+            await asyncio.wait_for(_wait_for_batch(restarted), timeout=1)
+            assert restarted.batch_messages[0].body == delivery.body
+            assert restarted.batch_messages[0].headers["x-retry-count"] == 2
+        finally:
+            await restarted.close_retry_spools()
+
+    @pytest.mark.asyncio
+    async def test_failed_message_retried_unacked(self):
+        """Test without a retry spool a failed message comes back into the batch after its delay without being acknowledged"""
+        queue = _queue()
+        delivery = _delivery(queue)
+        await queue._receive(delivery)
+        queue.register_handler(AsyncMock(side_effect=RuntimeError("API down")))
+
+        with patch("app.mqtt_source.retry_delay", return_value=0):
+            await queue._flush_batch()
+            await asyncio.gather(*queue._retry_tasks)
+
+        assert delivery.headers["x-retry-count"] == 1
+        assert queue.batch[0]["topic"] == "tele.SHT40_01.SENSOR"
+        assert len(queue.deliveries) == 1
+        queue.client.ack.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_out_of_retries_dead_lettered(self):
+        """Test a message out of retries is published to the DLQ topic, then acknowledged"""
+        queue = _queue()
+        delivery = _delivery(queue)
+        delivery.headers["x-retry-count"] = MAX_MESSAGE_RETRIES
+        queue.pending_ack_messages = [delivery]
+        queue.deliveries.track(delivery)
+
+        with patch.object(queue, "_publish_dead_letter", AsyncMock()) as publish:
+            await queue.move_batch_to_dlq()
+
+        publish.assert_awaited_once()
+        assert publish.await_args.args[:2] == (delivery, "retries-exhausted")
+        queue.client.ack.assert_called_once_with(101, 1)
+        assert queue._retry_tasks == set()
+
+    @pytest.mark.asyncio
+    async def test_failed_dead_letter_left_unacked(self):
+        """Test without a retry spool a message whose DLQ publish failed stays unacknowledged, holding back later PUBACKs, and is tried again"""
+        queue = _queue()
+        delivery, later = _delivery(queue, tag=1), _delivery(queue, tag=2)
+        queue.deliveries.track(delivery)
+        queue.deliveries.track(later)
+
+        with patch.object(queue, "_publish_dead_letter", AsyncMock(side_effect=RuntimeError("not connected"))):
+            with patch.object(queue, "_schedule_retry") as schedule:
+                await queue.dead_letter([delivery], reason="no-data")
+        await queue._settle([later])
+
+        queue.client.ack.assert_not_called()
+        assert schedule.call_args.args[0] is delivery
+        assert len(queue.deliveries) == 2
+
+    @pytest.mark.asyncio
+    async def test_undecodable_message_dead_lettered(self):
+        """Test a payload that is not JSON goes straight to the DLQ"""
+        queue = _queue()
+        delivery = MqttDelivery(queue.client, 1, "tele/A/SENSOR", b"not json", mid=9, qos=1)
+
+        with patch.object(queue, "_publish_dead_letter", AsyncMock()) as publish:
+            await queue._receive(delivery)
+
+        assert publish.await_args.args[:2] == (delivery, "undecodable")
+        queue.client.ack.assert_called_once_with(9, 1)
+        assert queue.batch == []
+
+
+class TestQueueDepth:
+    """Test the backlog gauge source"""
+
+    @pytest.mark.asyncio
+    async def test_queue_depth_unknown(self):
+        """Test the backlog is reported as unknown rather than failing the lag poller"""
+        assert await _queue().queue_depth() is None
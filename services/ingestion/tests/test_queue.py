@@ -6,7 +6,15 @@ import asyncio
 from datetime import datetime, timezone
 from unittest.mock import Mock, patch, AsyncMock, MagicMock, call
 
-from app.queue import ObservationQueue, QUEUE_NAME, BATCH_SIZE, BATCH_TIMEOUT, MAX_MESSAGE_RETRIES
+from app.queue import (
+    ObservationQueue, DeliveryTracker, QUEUE_NAME, DLQ_NAME, BATCH_SIZE, BATCH_TIMEOUT,
+    MAX_MESSAGE_RETRIES, PREFETCH_COUNT, SHARD_EXCHANGE, SHARD_OWNER_PRIORITY,
+    owned_shards, shard_queue_name,
+)
+from app.batching import AdaptiveBatchSizer
+from app.congestion import AimdController
+from app.scheduling import FairScheduler
+from app.metrics import MESSAGES_ACKED, REGISTRY
 
 
 class TestQueueInitialization:
@@ -93,7 +101,8 @@ class TestQueueConnection:
             await queue.connect()
             
             # Verify queue was declared as durable with max-length enforcement
-            mock_channel.declare_queue.assert_called_once_with(
+            # (the remaining declarations are the retry delay queues)
+            assert mock_channel.declare_queue.call_args_list[0] == call(
                 QUEUE_NAME,
                 durable=True,
                 arguments={"x-max-length": 50000, "x-overflow": "reject-publish"}
@@ -242,21 +251,22 @@ class TestBatchManagement:
         """Test ack_batch acknowledges all pending messages"""
         queue = ObservationQueue()
         
-        mock_msgs = [AsyncMock() for _ in range(3)]
-        queue.pending_ack_messages = mock_msgs
+        mock_msgs = [AsyncMock(delivery_tag=tag, headers={}) for tag in range(1, 4)]
+        queue.pending_ack_messages = list(mock_msgs)
         
         await queue.ack_batch()
         
-        # All messages should be acknowledged
-        for msg in mock_msgs:
-            msg.ack.assert_called_once()
+        # All messages are acknowledged with one multi-ack on the highest delivery tag
+        mock_msgs[-1].ack.assert_called_once_with(multiple=True)
+        for msg in mock_msgs[:-1]:
+            msg.ack.assert_not_called()
 
     @pytest.mark.asyncio
     async def test_ack_batch_clears_pending(self):
         """Test ack_batch clears pending messages after ack"""
         queue = ObservationQueue()
         
-        mock_msgs = [AsyncMock() for _ in range(3)]
+        mock_msgs = [AsyncMock(headers={}) for _ in range(3)]
         queue.pending_ack_messages = mock_msgs
         
         await queue.ack_batch()
@@ -264,6 +274,21 @@ class TestBatchManagement:
         # Pending messages should be cleared after acking
         assert len(queue.pending_ack_messages) == 0
 
+    @pytest.mark.asyncio
+    async def test_ack_batch_counts_acked_per_topic(self):
+        """Test acked messages are counted under their original routing key"""
+        queue = ObservationQueue()
+        MESSAGES_ACKED.clear()
+        retried = AsyncMock(delivery_tag=2, routing_key=QUEUE_NAME, headers={"x-original-routing-key": "tele.A.SENSOR"})
+        queue.pending_ack_messages = [
+            AsyncMock(delivery_tag=1, routing_key="tele.A.SENSOR", headers={}),
+            retried,
+        ]
+
+        await queue.ack_batch()
+
+        assert REGISTRY.get_sample_value("ingestion_messages_acked_total", {"topic": "tele.A.SENSOR"}) == 2
+
     @pytest.mark.asyncio
     async def test_ack_empty_batch(self):
         """Test acking empty batch doesn't cause error"""
@@ -375,3 +400,553 @@ class TestConnectionErrorHandling:
             await queue.reconnect()
             
             assert queue.connection == mock_connection
+
+
+class TestPipelinedBatches:
+    """Test bounded pipeline of in-flight batches"""
+
+    def _message(self, tag):
+        msg = AsyncMock(delivery_tag=tag)
+        msg.headers = {}
+        msg.body = b"{}"
+        return msg
+
+    async def _fill(self, queue, count=2):
+        msgs = []
+        for i in range(count):
+            self._tag += 1
+            msg = self._message(self._tag)
+            msgs.append(msg)
+            await queue.add_to_batch({"n": i}, rabbitmq_message=msg)
+        return msgs
+
+    @pytest.fixture(autouse=True)
+    def _reset_tags(self):
+        self._tag = 0
+
+    def test_default_is_inline(self):
+        """Test a single in-flight batch is the default"""
+        queue = ObservationQueue()
+        assert queue.max_inflight == 1
+        assert queue.inflight_count == 0
+
+    @pytest.mark.asyncio
+    async def test_flush_does_not_wait_for_handler(self):
+        """Test flushing hands the batch off and returns while the handler runs"""
+        queue = ObservationQueue(max_inflight=2)
+        release = asyncio.Event()
+
+        async def handler(batch):
+            await release.wait()
+            await queue.ack_batch()
+
+        queue.register_handler(handler)
+        await self._fill(queue)
+        await queue._flush_batch()
+
+        assert queue.inflight_count == 1
+        assert queue.batch == []
+
+        release.set()
+        await queue.wait_inflight()
+        await asyncio.sleep(0)
+        assert queue.inflight_count == 0
+
+    @pytest.mark.asyncio
+    async def test_ack_settles_only_own_batch(self):
+        """Test each handler acknowledges only the messages of its batch"""
+        queue = ObservationQueue(max_inflight=2)
+        release_first = asyncio.Event()
+        calls = []
+
+        async def handler(batch):
+            calls.append(batch)
+            if len(calls) == 1:
+                await release_first.wait()
+            await queue.ack_batch()
+
+        queue.register_handler(handler)
+        first = await self._fill(queue)
+        await queue._flush_batch()
+        second = await self._fill(queue)
+        await queue._flush_batch()
+        await asyncio.sleep(0.01)
+
+        # Second batch completed while the first is still in flight: its ack is
+        # deferred so a multiple=True ack never covers the first batch
+        for msg in first + second:
+            msg.ack.assert_not_called()
+        assert queue.pending_ack_messages == first
+
+        release_first.set()
+        await queue.wait_inflight()
+        # One multi-ack covers both batches once the older one settles
+        second[-1].ack.assert_called_once_with(multiple=True)
+        for msg in first + second[:-1]:
+            msg.ack.assert_not_called()
+        assert queue.pending_ack_messages == []
+        assert len(queue.deliveries) == 0
+
+    @pytest.mark.asyncio
+    async def test_pipeline_depth_is_bounded(self):
+        """Test flushing blocks once max_inflight batches are outstanding"""
+        queue = ObservationQueue(max_inflight=2)
+        release = asyncio.Event()
+
+        async def handler(batch):
+            await release.wait()
+            await queue.ack_batch()
+
+        queue.register_handler(handler)
+        for _ in range(2):
+            await self._fill(queue)
+            await queue._flush_batch()
+        await self._fill(queue)
+
+        third = asyncio.create_task(queue._flush_batch())
+        await asyncio.sleep(0.01)
+        assert not third.done()
+        assert queue.inflight_count == 2
+
+        release.set()
+        await asyncio.wait_for(third, timeout=1)
+        await queue.wait_inflight()
+
+    @pytest.mark.asyncio
+    async def test_congestion_window_limits_pipeline(self):
+        """Test the AIMD window caps in-flight batches and batch size below the configured maximum"""
+        queue = ObservationQueue(max_inflight=4)
+        queue.congestion = AimdController(max_inflight=4, max_batch_size=100, min_batch_size=1)
+        queue.congestion.window = 150.0
+        assert queue.inflight_limit == 1
+        assert queue.batch_size == 100
+
+        queue.congestion.window = 2.0
+        release = asyncio.Event()
+
+        async def handler(batch):
+            await release.wait()
+            await queue.ack_batch()
+
+        queue.register_handler(handler)
+        await self._fill(queue)  # Two messages fill a batch of two and flush it
+        assert queue.inflight_count == 1
+
+        second = asyncio.create_task(self._fill(queue))
+        await asyncio.sleep(0.01)
+        assert not second.done()  # Blocked behind the one batch the window allows
+
+        release.set()
+        await asyncio.wait_for(second, timeout=1)
+        await queue.wait_inflight()
+
+    @pytest.mark.asyncio
+    async def test_failed_handler_requeues_its_batch(self):
+        """Test a batch left unsettled by a crashing handler is sent to retry"""
+        queue = ObservationQueue(max_inflight=2)
+        queue.channel = AsyncMock()
+        queue.retry_exchange = AsyncMock()
+
+        async def handler(batch):
+            raise RuntimeError("boom")
+
+        queue.register_handler(handler)
+        msgs = await self._fill(queue)
+        await queue._flush_batch()
+        await queue.wait_inflight()
+
+        assert queue.retry_exchange.publish.call_count == len(msgs)
+        assert queue.pending_ack_messages == []
+
+
+class TestPrefetchAndMultiAck:
+    """Test channel QoS and multi-ack of settled deliveries"""
+
+    def test_prefetch_defaults_to_batch_pipeline(self):
+        """Test default prefetch covers the filling batch plus in-flight batches"""
+        queue = ObservationQueue()
+        assert queue.prefetch_count == PREFETCH_COUNT
+        assert PREFETCH_COUNT >= BATCH_SIZE
+
+    @pytest.mark.asyncio
+    async def test_connect_sets_qos(self):
+        """Test connect applies the configured prefetch count"""
+        queue = ObservationQueue(prefetch_count=250)
+        mock_connection = AsyncMock()
+        mock_channel = AsyncMock()
+
+        with patch('app.queue.aio_pika') as mock_pika:
+            mock_pika.connect = AsyncMock(return_value=mock_connection)
+            mock_connection.channel = AsyncMock(return_value=mock_channel)
+            await queue.connect()
+
+        mock_channel.set_qos.assert_called_once_with(prefetch_count=250)
+
+    def test_tracker_acks_settled_prefix(self):
+        """Test the tracker returns the highest tag of the settled prefix"""
+        tracker = DeliveryTracker()
+        msgs = [AsyncMock(delivery_tag=tag) for tag in range(1, 5)]
+        for msg in msgs:
+            tracker.track(msg)
+
+        # Later deliveries settled first: nothing can be acked yet
+        assert tracker.settle(msgs[2:]) is None
+        assert len(tracker) == 4
+
+        # Oldest settle: one ack covers everything
+        assert tracker.settle(msgs[:2]) is msgs[3]
+        assert len(tracker) == 0
+
+    def test_tracker_returns_whole_prefix(self):
+        """Test the settled prefix is returned message by message, in delivery order"""
+        tracker = DeliveryTracker()
+        msgs = [AsyncMock(delivery_tag=tag) for tag in range(1, 4)]
+        for msg in msgs:
+            tracker.track(msg)
+
+        assert tracker.settle_prefix([msgs[1]]) == []
+        assert tracker.settle_prefix([msgs[0]]) == msgs[:2]
+        assert len(tracker) == 1
+
+    def test_tracker_forget_unblocks_prefix(self):
+        """Test a forgotten (individually nacked) delivery does not block later acks"""
+        tracker = DeliveryTracker()
+        msgs = [AsyncMock(delivery_tag=tag) for tag in range(1, 3)]
+        for msg in msgs:
+            tracker.track(msg)
+
+        tracker.forget(msgs[0])
+        assert tracker.settle([msgs[1]]) is msgs[1]
+
+    @pytest.mark.asyncio
+    async def test_undecodable_message_is_settled(self):
+        """Test an undecodable delivery goes to the DLQ instead of blocking acks"""
+        queue = ObservationQueue(auto_ack=False)
+        queue.channel = AsyncMock()
+        queue.channel.default_exchange.publish = AsyncMock()
+        bad = AsyncMock(delivery_tag=1, body=b"not json", headers={}, routing_key="tele.x.SENSOR")
+
+        queue.queue = MagicMock()
+        queue.queue.iterator.return_value.__aenter__.return_value = _aiter([bad])
+        await queue.consume_messages()
+
+        routing_keys = [c[1].get("routing_key") for c in queue.channel.default_exchange.publish.call_args_list]
+        assert routing_keys == [DLQ_NAME]
+        bad.ack.assert_called_once_with(multiple=True)
+
+
+class TestSharding:
+    """Test consistent-hash shard queues"""
+
+    def test_owned_shards_round_robin(self):
+        """Test shards are spread round-robin over worker indices"""
+        assert owned_shards(8, 3, 0) == [0, 3, 6]
+        assert owned_shards(8, 3, 2) == [2, 5]
+        assert sorted(sum((owned_shards(8, 3, i) for i in range(3)), [])) == list(range(8))
+
+    def test_unsharded_by_default(self):
+        """Test the single queue is used unless SHARD_COUNT is set"""
+        queue = ObservationQueue(shard_count=0)
+        assert not queue.sharded
+
+    @pytest.mark.asyncio
+    async def test_connect_declares_shard_topology(self):
+        """Test connect declares the hash exchange and single-active-consumer quorum shard queues"""
+        queue = ObservationQueue(shard_count=4, shard_workers=2, shard_index=1)
+        mock_connection = AsyncMock()
+        mock_channel = AsyncMock()
+
+        with patch('app.queue.aio_pika') as mock_pika:
+            mock_pika.connect = AsyncMock(return_value=mock_connection)
+            mock_connection.channel = AsyncMock(return_value=mock_channel)
+            await queue.connect()
+
+        mock_channel.set_qos.assert_called_once_with(prefetch_count=queue.prefetch_count // 2)
+        assert mock_channel.declare_exchange.call_args_list[0] == call(SHARD_EXCHANGE, "x-consistent-hash", durable=True)
+        declared = [c.args[0] for c in mock_channel.declare_queue.call_args_list]
+        assert declared[:4] == [shard_queue_name(i) for i in range(4)]
+        assert QUEUE_NAME not in declared
+        arguments = mock_channel.declare_queue.call_args_list[0].kwargs["arguments"]
+        assert arguments["x-queue-type"] == "quorum"
+        assert arguments["x-single-active-consumer"] is True
+        assert queue.queue is None
+        assert set(queue.shard_queues) == {0, 1, 2, 3}
+        assert queue.owned_shards == {1, 3}
+
+    @pytest.mark.asyncio
+    async def test_retries_rehash_through_shard_exchange(self):
+        """Test expired retries are routed back through the hash exchange"""
+        queue = ObservationQueue(shard_count=2)
+        mock_connection = AsyncMock()
+        mock_channel = AsyncMock()
+        shard_exchange, requeue_exchange, retry_exchange = AsyncMock(), AsyncMock(), AsyncMock()
+        mock_channel.declare_exchange.side_effect = [shard_exchange, requeue_exchange, retry_exchange]
+
+        with patch('app.queue.aio_pika') as mock_pika:
+            mock_pika.connect = AsyncMock(return_value=mock_connection)
+            mock_connection.channel = AsyncMock(return_value=mock_channel)
+            await queue.connect()
+
+        shard_exchange.bind.assert_any_call(requeue_exchange)
+
+    @pytest.mark.asyncio
+    async def test_consumes_every_shard_with_priority(self):
+        """Test all shards are consumed, owned ones with a higher consumer priority"""
+        queue = ObservationQueue(shard_count=2, shard_workers=2, shard_index=0)
+        queue.channel = AsyncMock()
+        queue.shard_queues = {0: MagicMock(), 1: MagicMock()}
+        for shard, shard_queue in queue.shard_queues.items():
+            shard_queue.iterator.return_value.__aenter__.return_value = _aiter([])
+
+        await queue.consume_messages()
+
+        queue.shard_queues[0].iterator.assert_called_once_with(arguments={"x-priority": SHARD_OWNER_PRIORITY})
+        queue.shard_queues[1].iterator.assert_called_once_with(arguments={"x-priority": 0})
+
+    @pytest.mark.asyncio
+    async def test_interleaved_shards_acked_individually(self):
+        """Test a settled delivery never acks a lower tag still waiting in another shard's iterator"""
+        queue = ObservationQueue(auto_ack=False, shard_count=2)
+        queue.channel = AsyncMock()
+        queue.shard_queues = {0: MagicMock(), 1: MagicMock()}
+        first, second = (AsyncMock(delivery_tag=tag, headers={}, routing_key=f"tele.{tag}.SENSOR") for tag in (1, 2))
+        first.body = second.body = b'{"Time": "2026-04-04T12:00:00"}'
+        second_acked = asyncio.Event()
+
+        async def handler(payloads):
+            await queue.ack_batch()
+            second_acked.set()
+
+        async def shard_0():
+            yield second
+
+        async def shard_1():
+            # Tag 1 reached the channel first but its iterator only hands it over later
+            await second_acked.wait()
+            yield first
+
+        queue.register_handler(handler)
+        queue.shard_queues[0].iterator.return_value.__aenter__.return_value = shard_0()
+        queue.shard_queues[1].iterator.return_value.__aenter__.return_value = shard_1()
+        async def add_and_flush(*args, **kwargs):
+            # Flush every message as its own batch
+            await ObservationQueue.add_to_batch(queue, *args, **kwargs)
+            await queue._flush_batch()
+            await asyncio.gather(*queue.inflight_tasks)
+
+        queue.add_to_batch = add_and_flush
+        await asyncio.wait_for(queue.consume_messages(), timeout=5)
+
+        second.ack.assert_called_once_with()
+        first.ack.assert_called_once_with()
+        assert len(queue.deliveries) == 0
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+class TestDeadlineFlush:
+    """Test the event-driven batch deadline timer"""
+
+    @pytest.mark.asyncio
+    async def test_first_message_sets_deadline(self):
+        """Test the deadline is anchored to the oldest message of the batch"""
+        queue = ObservationQueue()
+        queue.sizer.max_wait_limit = 5
+        loop = asyncio.get_running_loop()
+
+        await queue.add_to_batch({"n": 1})
+        deadline = queue.batch_deadline
+        await queue.add_to_batch({"n": 2})
+
+        assert deadline == pytest.approx(loop.time() + 5, abs=0.5)
+        assert queue.batch_deadline == deadline
+
+    @pytest.mark.asyncio
+    async def test_partial_batch_flushed_at_deadline(self):
+        """Test a sparse batch is flushed at its deadline, not on a polling tick"""
+        queue = ObservationQueue()
+        queue.sizer.max_wait_limit = 0.05
+        handler = AsyncMock()
+        queue.register_handler(handler)
+
+        timer = asyncio.create_task(queue.flush_on_deadline())
+        try:
+            await queue.add_to_batch({"n": 1})
+            await asyncio.sleep(0.2)
+        finally:
+            timer.cancel()
+            await asyncio.gather(timer, return_exceptions=True)
+
+        handler.assert_awaited_once_with([{"n": 1}])
+        assert queue.batch_deadline is None
+
+    @pytest.mark.asyncio
+    async def test_timer_idle_without_batch(self):
+        """Test the timer does not flush while no batch is open"""
+        queue = ObservationQueue()
+        handler = AsyncMock()
+        queue.register_handler(handler)
+
+        timer = asyncio.create_task(queue.flush_on_deadline())
+        await asyncio.sleep(0.05)
+        timer.cancel()
+        await asyncio.gather(timer, return_exceptions=True)
+
+        handler.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_adaptive_size_triggers_flush(self):
+        """Test add_to_batch flushes at the sizer's current batch size"""
+        queue = ObservationQueue()
+        queue.sizer.adaptive = True
+        queue.sizer.batch_latency = None  # No latency sample yet → min size
+        handler = AsyncMock()
+        queue.register_handler(handler)
+
+        await queue.add_to_batch({"n": 1})
+
+        handler.assert_awaited_once_with([{"n": 1}])
+        assert queue.sizer.batch_latency is not None
+
+
+class TestFairScheduling:
+    """Test FAIR_SCHEDULING: per-topic queues drained into batches by DRR"""
+
+    def _queue(self, batch_size=3, quantum=1):
+        queue = ObservationQueue()
+        queue.scheduler = FairScheduler(quantum=quantum, rates=[])
+        queue.sizer = AdaptiveBatchSizer(batch_size, 0.05)
+        return queue
+
+    def _message(self, tag):
+        msg = AsyncMock(delivery_tag=tag)
+        msg.headers = {}
+        return msg
+
+    @pytest.mark.asyncio
+    async def test_add_does_not_flush_inline(self):
+        """Test consumption only queues messages; batches are formed by the scheduler"""
+        queue = self._queue()
+        handler = AsyncMock()
+        queue.register_handler(handler)
+
+        for n in range(5):
+            await queue.add_to_batch({"topic": "chatty", "n": n})
+
+        handler.assert_not_called()
+        assert len(queue.scheduler) == 5
+
+    @pytest.mark.asyncio
+    async def test_quiet_topic_in_next_batch(self):
+        """Test a quiet topic's reading is batched ahead of a chatty topic's backlog"""
+        queue = self._queue()
+        handler = AsyncMock()
+        queue.register_handler(handler)
+        for n in range(6):
+            await queue.add_to_batch({"topic": "chatty", "n": n})
+        await queue.add_to_batch({"topic": "quiet", "n": 0})
+
+        await queue._flush_batch()
+
+        handler.assert_awaited_once_with([
+            {"topic": "chatty", "n": 0}, {"topic": "quiet", "n": 0}, {"topic": "chatty", "n": 1},
+        ])
+
+    @pytest.mark.asyncio
+    async def test_out_of_order_settlement_acked_individually(self):
+        """Test messages settled behind an older queued one are acked without waiting for it"""
+        queue = self._queue(batch_size=2)
+        queue.auto_ack = False
+        msgs = [self._message(tag) for tag in range(1, 5)]
+
+        async def handler(batch):
+            await queue.ack_batch()
+
+        queue.register_handler(handler)
+        for msg, topic in zip(msgs, ["a", "a", "a", "b"]):
+            await queue.add_to_batch({"topic": topic}, rabbitmq_message=msg)
+
+        await queue._flush_batch()  # Takes tags 1 (a) and 4 (b)
+
+        msgs[0].ack.assert_called_once_with(multiple=True)
+        msgs[3].ack.assert_called_once_with()
+        msgs[1].ack.assert_not_called()
+        assert len(queue.deliveries) == 2
+
+    @pytest.mark.asyncio
+    async def test_drain_flushes_full_and_due_batches(self):
+        """Test the scheduler flushes a full batch at once and the remainder at its deadline"""
+        queue = self._queue()
+        batches = []
+
+        async def handler(batch):
+            batches.append(batch)
+
+        queue.register_handler(handler)
+        drain = asyncio.create_task(queue.drain_fair())
+        try:
+            for n in range(4):
+                await queue.add_to_batch({"topic": "a", "n": n})
+            await asyncio.sleep(0.01)
+            assert len(batches) == 1  # The full batch, not yet the partial one
+
+            await asyncio.sleep(0.1)
+            assert [len(b) for b in batches] == [3, 1]
+        finally:
+            drain.cancel()
+            await asyncio.gather(drain, return_exceptions=True)
+
+    @pytest.mark.asyncio
+    async def test_cancel_drains_topic_queues(self):
+        """Test stopping the scheduler flushes every queued message"""
+        queue = self._queue()
+        queue.sizer.max_wait_limit = 60
+        handler = AsyncMock()
+        queue.register_handler(handler)
+        for n in range(2):
+            await queue.add_to_batch({"topic": "a", "n": n})
+
+        drain = asyncio.create_task(queue.drain_fair())
+        await asyncio.sleep(0.01)
+        drain.cancel()
+        await asyncio.gather(drain, return_exceptions=True)
+
+        handler.assert_awaited_once()
+        assert len(queue.scheduler) == 0
+
+
+class TestQueueDepth:
+    """Test the backlog poll stays off the consuming channel"""
+
+    def _queue(self, channel):
+        queue = ObservationQueue()
+        queue.channel = AsyncMock()
+        queue.connection = MagicMock()
+        queue.connection.channel = AsyncMock(return_value=channel)
+        return queue
+
+    @pytest.mark.asyncio
+    async def test_depth_polled_on_own_channel(self):
+        channel = AsyncMock(is_closed=False)
+        channel.declare_queue.return_value = MagicMock(declaration_result=MagicMock(message_count=7))
+        queue = self._queue(channel)
+
+        assert await queue.queue_depth() == 7
+        channel.declare_queue.assert_awaited_once_with(queue.queue_name, passive=True)
+        channel.close.assert_awaited_once()
+        queue.channel.declare_queue.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_missing_queue_leaves_consuming_channel_alone(self):
+        """Test a 404 on the passive declare only costs the poll's own channel"""
+        channel = AsyncMock(is_closed=True)
+        channel.declare_queue.side_effect = RuntimeError("NOT_FOUND - no queue 'observations'")
+        queue = self._queue(channel)
+
+        with pytest.raises(RuntimeError):
+            await queue.queue_depth()
+        channel.close.assert_not_called()
+        queue.channel.declare_queue.assert_not_called()
@@ -0,0 +1,112 @@
+"""
+Tests for TopicIndex - routing-key resolution, wildcards and negative cache
+"""
+import pytest
+from uuid import uuid4
+
+from app.routing import TopicIndex, mqtt_topic_to_routing_key
+
+
+def _config(model="SHT40"):
+    return {"model": model, "datastreams": {"Temperature": str(uuid4())}}
+
+
+class TestExactRoutes:
+    """Test exact topic lookups"""
+
+    def test_indexed_by_routing_key(self):
+        """Test exact topics are keyed by the AMQP routing key"""
+        index = TopicIndex.build({"tele/SHT40_01/SENSOR": _config()})
+
+        route = index.resolve("tele.SHT40_01.SENSOR")
+
+        assert route is not None
+        assert route.model == "SHT40"
+        assert route.topic == "tele/SHT40_01/SENSOR"
+        assert "Temperature" in route.datastreams
+
+    def test_routing_key_conversion(self):
+        """Test MQTT topic to routing key conversion"""
+        assert mqtt_topic_to_routing_key("tele/A/SENSOR") == "tele.A.SENSOR"
+
+    def test_config_without_spec_not_indexed(self):
+        """Test a model without extractor spec is not routable"""
+        index = TopicIndex.build({"tele/X/SENSOR": _config("UNKNOWN")})
+        assert index.resolve("tele.X.SENSOR") is None
+
+
+class TestWildcardRoutes:
+    """Test MQTT-style wildcard topic patterns"""
+
+    def test_single_level_wildcard(self):
+        """Test + matches exactly one level"""
+        index = TopicIndex.build({"tele/+/SENSOR": _config()})
+
+        assert index.resolve("tele.SHT40_01.SENSOR") is not None
+        assert index.resolve("tele.a.b.SENSOR") is None
+
+    def test_multi_level_wildcard(self):
+        """Test # matches the remaining levels"""
+        index = TopicIndex.build({"tele/#": _config()})
+
+        assert index.resolve("tele.SHT40_01.SENSOR") is not None
+        assert index.resolve("stat.SHT40_01.SENSOR") is None
+
+    def test_exact_beats_wildcard(self):
+        """Test exact entries win over wildcard families"""
+        index = TopicIndex.build({
+            "tele/+/SENSOR": _config("SHT40"),
+            "tele/A1T_01/SENSOR": _config("A1T"),
+        })
+
+        assert index.resolve("tele.A1T_01.SENSOR").model == "A1T"
+        assert index.resolve("tele.SHT40_01.SENSOR").model == "SHT40"
+
+    def test_literal_beats_plus_beats_hash(self):
+        """Test the most specific pattern wins"""
+        index = TopicIndex.build({
+            "tele/#": _config("A1T"),
+            "tele/+/SENSOR": _config("SHT40"),
+        })
+
+        assert index.resolve("tele.dev.SENSOR").model == "SHT40"
+        assert index.resolve("tele.dev.STATE").model == "A1T"
+
+    def test_invalid_hash_position_ignored(self):
+        """Test # in the middle of a pattern is rejected"""
+        index = TopicIndex.build({"tele/#/SENSOR": _config()})
+        assert len(index) == 0
+
+
+class TestNegativeCache:
+    """Test unknown-topic caching and bounded memory"""
+
+    def test_unknown_topic_cached(self):
+        """Test repeated unknown keys are counted, not re-resolved"""
+        index = TopicIndex.build({})
+
+        for _ in range(5):
+            assert index.resolve("tele.ROGUE.SENSOR") is None
+
+        assert index.unknown_topics == {"tele.ROGUE.SENSOR": 4}
+
+    def test_negative_cache_bounded(self):
+        """Test the negative cache evicts the oldest unknown keys"""
+        index = TopicIndex.build({}, negative_cache_size=3)
+
+        for i in range(10):
+            index.resolve(f"tele.dev{i}.SENSOR")
+
+        assert len(index.unknown_topics) == 3
+        assert "tele.dev9.SENSOR" in index.unknown_topics
+
+    def test_unknown_logged_once(self):
+        """Test only the first message of an unknown topic logs a warning"""
+        index = TopicIndex.build({})
+        from app import routing
+        routing.logger.warning.reset_mock()
+
+        for _ in range(100):
+            index.resolve("tele.ROGUE.SENSOR")
+
+        assert routing.logger.warning.call_count == 1
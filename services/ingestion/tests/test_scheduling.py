@@ -0,0 +1,101 @@
+"""
+Tests for FairScheduler - per-topic queues, deficit round robin and rate caps
+"""
+import pytest
+
+from app.scheduling import FairScheduler, parse_topic_rates
+
+
+def _push(scheduler, topic, count, now=0.0):
+    for i in range(count):
+        scheduler.push(topic, {"topic": topic, "n": i}, now=now)
+
+
+def _topics(entries):
+    return [payload["topic"] for payload, _, _, _ in entries]
+
+
+class TestDeficitRoundRobin:
+    """Test batches are drawn fairly across topics"""
+
+    def test_quiet_topic_not_stuck_behind_backlog(self):
+        """Test a single reading makes the next batch however much a chatty topic has queued"""
+        scheduler = FairScheduler(quantum=5, rates=[])
+        _push(scheduler, "tele.A1T_01.SENSOR", 100)
+        _push(scheduler, "tele.SHT40_01.SENSOR", 1, now=1.0)
+
+        batch = scheduler.take(10, now=1.0)
+
+        assert len(batch) == 10
+        assert "tele.SHT40_01.SENSOR" in _topics(batch)
+        assert len(scheduler) == 91
+
+    def test_quantum_shares_batch(self):
+        """Test busy topics take turns of ``quantum`` messages"""
+        scheduler = FairScheduler(quantum=2, rates=[])
+        _push(scheduler, "a", 10)
+        _push(scheduler, "b", 10)
+
+        assert _topics(scheduler.take(6)) == ["a", "a", "b", "b", "a", "a"]
+
+    def test_order_within_topic_kept(self):
+        """Test each topic's messages leave in arrival order, across batches"""
+        scheduler = FairScheduler(quantum=3, rates=[])
+        _push(scheduler, "a", 5)
+        _push(scheduler, "b", 5)
+
+        taken = scheduler.take(4) + scheduler.take(10)
+
+        assert [p["n"] for p, _, _, _ in taken if p["topic"] == "a"] == list(range(5))
+        assert [p["n"] for p, _, _, _ in taken if p["topic"] == "b"] == list(range(5))
+        assert len(scheduler) == 0
+        assert scheduler.oldest is None
+
+    def test_oldest_arrival(self):
+        """Test the flush deadline follows the longest-waiting message"""
+        scheduler = FairScheduler(rates=[])
+        scheduler.push("a", {}, now=5.0)
+        scheduler.push("b", {}, now=3.0)
+
+        assert scheduler.oldest == 3.0
+
+
+class TestRateCaps:
+    """Test work-conserving per-topic rate caps"""
+
+    def test_capped_topic_yields_to_others(self):
+        """Test a topic over its cap is batched after topics within theirs"""
+        scheduler = FairScheduler(quantum=10, rates=[("meter", 1.0)], burst=2)
+        _push(scheduler, "meter", 20)
+        _push(scheduler, "sensor", 5)
+
+        batch = scheduler.take(10, now=0.0)
+
+        # Two tokens of burst, then the sensor, then the meter fills the spare room
+        assert _topics(batch) == ["meter", "meter"] + ["sensor"] * 5 + ["meter"] * 3
+
+    def test_cap_does_not_idle_capacity(self):
+        """Test a capped topic alone still gets full batches"""
+        scheduler = FairScheduler(quantum=10, rates=[("meter", 1.0)], burst=1)
+        _push(scheduler, "meter", 20)
+
+        assert len(scheduler.take(10, now=0.0)) == 10
+
+    def test_tokens_refill_with_time(self):
+        """Test a capped topic regains priority at its rate"""
+        scheduler = FairScheduler(quantum=10, default_rate=1.0, burst=1, rates=[])
+        _push(scheduler, "meter", 5)
+        scheduler.take(1, now=0.0)  # Spends the only token
+        _push(scheduler, "sensor", 5, now=0.0)
+
+        assert _topics(scheduler.take(1, now=0.5)) == ["sensor"]
+        assert _topics(scheduler.take(1, now=5.0)) == ["meter"]
+
+    def test_parse_topic_rates(self):
+        """Test FAIR_TOPIC_RATES globs parse in order and bad entries are skipped"""
+        rates = parse_topic_rates("tele.A1T_*.SENSOR=1, tele.*.SENSOR=0.2,broken,x=fast")
+
+        assert rates == [("tele.A1T_*.SENSOR", 1.0), ("tele.*.SENSOR", 0.2)]
+        scheduler = FairScheduler(rates=rates)
+        assert scheduler.rate_for("tele.A1T_01.SENSOR") == 1.0
+        assert scheduler.rate_for("tele.SHT40_01.SENSOR") == 0.2
@@ -0,0 +1,125 @@
+"""
+Tests for ObservationSpool - append-only disk spool for API outages
+"""
+import os
+import pytest
+
+from app.spool import ObservationSpool, SEGMENT_SUFFIX
+
+
+def _rows(start, count):
+    return [{"datastream_id": "ds", "result_time": "2026-04-04T11:00:00+00:00", "result_numeric": float(i)}
+            for i in range(start, start + count)]
+
+
+def _segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+
+@pytest.fixture
+async def spool(tmp_path):
+    spool = ObservationSpool(str(tmp_path), segment_bytes=1024, max_bytes=1024 * 1024)
+    await spool.open()
+    yield spool
+    await spool.close()
+
+
+class TestSpoolAppendAndReplay:
+    """Test spooling and replaying rows in order"""
+
+    @pytest.mark.asyncio
+    async def test_empty_on_open(self, spool):
+        """Test a fresh spool has nothing to replay"""
+        assert spool.is_empty()
+        assert not spool.data_available.is_set()
+
+    @pytest.mark.asyncio
+    async def test_roundtrip_in_order(self, spool):
+        """Test rows come back in append order"""
+        await spool.append(_rows(0, 3))
+        await spool.append(_rows(3, 2))
+
+        rows, position = await spool.read(100)
+
+        assert [r["result_numeric"] for r in rows] == [0.0, 1.0, 2.0, 3.0, 4.0]
+        assert spool.data_available.is_set()
+        await spool.commit(position)
+        assert spool.is_empty()
+        assert not spool.data_available.is_set()
+
+    @pytest.mark.asyncio
+    async def test_read_stops_near_max_rows(self, spool):
+        """Test replay chunks are bounded by whole spooled batches"""
+        for i in range(5):
+            await spool.append(_rows(i * 2, 2))
+
+        rows, position = await spool.read(3)
+        assert len(rows) == 4  # Two whole batches
+        await spool.commit(position)
+
+        rows, _ = await spool.read(100)
+        assert [r["result_numeric"] for r in rows] == [4.0, 5.0, 6.0, 7.0, 8.0, 9.0]
+
+    @pytest.mark.asyncio
+    async def test_segments_roll_and_are_deleted(self, spool, tmp_path):
+        """Test segments roll at the size limit and replayed ones are removed"""
+        for i in range(20):
+            await spool.append(_rows(i * 5, 5))
+        assert len(_segments(tmp_path)) > 1
+
+        while not spool.is_empty():
+            _, position = await spool.read(50)
+            await spool.commit(position)
+
+        assert len(_segments(tmp_path)) == 1  # Only the segment still open for writing
+
+    @pytest.mark.asyncio
+    async def test_full_spool_refuses(self, tmp_path):
+        """Test appends beyond the size cap are refused, not truncated"""
+        spool = ObservationSpool(str(tmp_path), max_bytes=100)
+        await spool.open()
+
+        assert await spool.append(_rows(0, 10)) is False
+        assert spool.is_empty()
+        await spool.close()
+
+
+class TestSpoolRecovery:
+    """Test a restarted worker resumes from the cursor"""
+
+    @pytest.mark.asyncio
+    async def test_resume_from_cursor(self, tmp_path):
+        """Test committed rows are not replayed again after a restart"""
+        spool = ObservationSpool(str(tmp_path))
+        await spool.open()
+        await spool.append(_rows(0, 2))
+        await spool.append(_rows(2, 2))
+        _, position = await spool.read(2)
+        await spool.commit(position)
+        await spool.close()
+
+        reopened = ObservationSpool(str(tmp_path))
+        await reopened.open()
+        rows, _ = await reopened.read(100)
+
+        assert reopened.data_available.is_set()
+        assert [r["result_numeric"] for r in rows] == [2.0, 3.0]
+        await reopened.close()
+
+    @pytest.mark.asyncio
+    async def test_torn_tail_skipped(self, tmp_path):
+        """Test a partially written last record is not replayed"""
+        spool = ObservationSpool(str(tmp_path))
+        await spool.open()
+        await spool.append(_rows(0, 2))
+        await spool.close()
+        with open(tmp_path / _segments(tmp_path)[-1], "ab") as f:
+            f.write(b'[{"datastream_id":')
+
+        reopened = ObservationSpool(str(tmp_path))
+        await reopened.open()
+        await reopened.append(_rows(2, 1))
+        rows, _ = await reopened.read(100)
+
+        assert [r["result_numeric"] for r in rows] == [0.0, 1.0, 2.0]
+        await reopened.close()
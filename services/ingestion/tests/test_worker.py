@@ -0,0 +1,625 @@
+"""
+Tests for the ingestion worker - message processing and API submission
+"""
+import asyncio
+import json
+import httpx
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from app import worker
+from app.congestion import AimdController
+
+
+@pytest.fixture
+def topic_configs(sample_datastreams):
+    """Install SHT40 and A1T topic configs in the worker cache"""
+    worker._set_topic_configs({
+        "tele/SHT40_01/SENSOR": {
+            "model": "SHT40",
+            "datastreams": {k: sample_datastreams[k] for k in ("Temperature", "Humidity", "DewPoint")},
+        },
+        "tele/A1T_01/SENSOR": {
+            "model": "A1T",
+            "datastreams": {k: sample_datastreams[k] for k in ("Power", "Voltage", "Total")},
+        },
+    })
+    yield
+    worker._set_topic_configs({})
+
+
+@pytest.fixture
+def mock_queue():
+    with patch.object(worker, "observation_queue") as queue:
+        queue.ack_batch = AsyncMock()
+        queue.move_batch_to_dlq = AsyncMock()
+        queue.dead_letter_batch = AsyncMock()
+        queue.congestion = None
+        yield queue
+
+
+class TestTopicConfigCompilation:
+    """Test topic configs are compiled into extractors once"""
+
+    def test_extractor_compiled_per_topic(self, topic_configs):
+        """Test each configured topic is indexed by its routing key"""
+        assert set(worker.topic_index.exact) == {"tele.SHT40_01.SENSOR", "tele.A1T_01.SENSOR"}
+
+    def test_config_with_custom_extractor_spec(self, sample_datastreams):
+        """Test a model without built-in spec works from the config's own extractor"""
+        worker._set_topic_configs({
+            "tele/BME_01/SENSOR": {
+                "model": "BME280",
+                "extractor": {"BME280.Temperature": "Temperature"},
+                "datastreams": {"Temperature": sample_datastreams["Temperature"]},
+            },
+        })
+        route = worker.topic_index.resolve("tele.BME_01.SENSOR")
+        rows = []
+        route.extractor({"BME280": {"Temperature": 19.5}}, rows)
+
+        assert route.model == "BME280"
+        assert rows[0]["result_numeric"] == 19.5
+        worker._set_topic_configs({})
+
+    def test_unknown_model_not_compiled(self):
+        """Test a model with no spec gets no extractor"""
+        worker._set_topic_configs({"tele/X/SENSOR": {"model": "UNKNOWN", "datastreams": {}}})
+        assert len(worker.topic_index) == 0
+        worker._set_topic_configs({})
+
+
+class TestProcessMessages:
+    """Test batch processing through compiled extractors"""
+
+    @pytest.mark.asyncio
+    async def test_batch_sent_as_plain_rows(self, topic_configs, mock_queue, sample_sht40_payload, sample_a1t_payload):
+        """Test a mixed batch becomes one list of JSON-ready rows"""
+        messages = [
+            {**sample_sht40_payload, "topic": "tele.SHT40_01.SENSOR"},
+            {**sample_a1t_payload, "topic": "tele.A1T_01.SENSOR"},
+        ]
+        with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=True)) as send:
+            await worker.process_messages(messages)
+
+        rows = send.call_args[0][0]
+        assert len(rows) == 6
+        assert all(isinstance(row["datastream_id"], str) for row in rows)
+        assert all(isinstance(row["result_time"], str) for row in rows)
+        mock_queue.ack_batch.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_unknown_topic_fails_batch(self, topic_configs, mock_queue):
+        """Test a message without config marks the batch as failed"""
+        messages = [{"Time": "2026-04-04T12:00:00", "topic": "tele.UNKNOWN.SENSOR"}]
+        with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=True)) as send:
+            await worker.process_messages(messages)
+
+        send.assert_not_called()
+        mock_queue.move_batch_to_dlq.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_api_failure_sends_batch_to_retry(self, topic_configs, mock_queue, sample_sht40_payload):
+        """Test a failed submission schedules the batch for retry without sleeping"""
+        messages = [{**sample_sht40_payload, "topic": "tele.SHT40_01.SENSOR"}]
+        with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=False)):
+            with patch("app.worker.asyncio.sleep", AsyncMock()) as sleep:
+                await worker.process_messages(messages)
+
+        sleep.assert_not_called()
+        mock_queue.move_batch_to_dlq.assert_called_once()
+        mock_queue.ack_batch.assert_not_called()
+
+
+
+class TestDeadbandAtIngest:
+    """Test deadband settings from topic configs are applied before submission"""
+
+    @pytest.mark.asyncio
+    async def test_unchanged_reading_not_sent(self, sample_datastreams, mock_queue):
+        """Test a repeat reading within the band is acked without being sent"""
+        worker._set_topic_configs({
+            "tele/SHT40_01/SENSOR": {
+                "model": "SHT40",
+                "datastreams": {"Humidity": sample_datastreams["Humidity"]},
+                "deadband": {"Humidity": {"deadband": 1.0, "heartbeat": 600}},
+            },
+        })
+        messages = [
+            {"Time": "2026-04-04T12:00:00", "SHT4X": {"Humidity": 50.0}, "topic": "tele.SHT40_01.SENSOR"},
+            {"Time": "2026-04-04T12:00:10", "SHT4X": {"Humidity": 50.2}, "topic": "tele.SHT40_01.SENSOR"},
+        ]
+        try:
+            with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=True)) as send:
+                await worker.process_messages(messages)
+        finally:
+            worker._set_topic_configs({})
+
+        assert [row["result_numeric"] for row in send.call_args[0][0]] == [50.0]
+        mock_queue.ack_batch.assert_awaited_once_with(indices=[0, 1])
+
+    @pytest.mark.asyncio
+    async def test_state_kept_until_submitted(self, sample_datastreams, mock_queue):
+        """Test a reading the API never took does not suppress the next one"""
+        worker._set_topic_configs({
+            "tele/SHT40_01/SENSOR": {
+                "model": "SHT40",
+                "datastreams": {"Humidity": sample_datastreams["Humidity"]},
+                "deadband": {"Humidity": {"deadband": 1.0, "heartbeat": 600}},
+            },
+        })
+        first = [{"Time": "2026-04-04T12:00:00", "SHT4X": {"Humidity": 50.0}, "topic": "tele.SHT40_01.SENSOR"}]
+        second = [{"Time": "2026-04-04T12:00:10", "SHT4X": {"Humidity": 50.2}, "topic": "tele.SHT40_01.SENSOR"}]
+        try:
+            with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=False)):
+                await worker.process_messages(first)
+            with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=True)) as send:
+                await worker.process_messages(second)
+        finally:
+            worker._set_topic_configs({})
+
+        assert [row["result_numeric"] for row in send.call_args[0][0]] == [50.2]
+
+    @pytest.mark.asyncio
+    async def test_downsampled_before_deadband(self, sample_datastreams, mock_queue):
+        """Test every raw sample reaches its window; the deadband only sees the window's row"""
+        worker._set_topic_configs({
+            "tele/SHT40_01/SENSOR": {
+                "model": "SHT40",
+                "datastreams": {"Humidity": sample_datastreams["Humidity"]},
+                "downsample": {"Humidity": {"window": 60}},
+                "deadband": {"Humidity": {"deadband": 1.0, "heartbeat": 600}},
+            },
+        })
+        messages = [
+            {"Time": f"2026-04-04T12:0{m}:{s:02d}", "SHT4X": {"Humidity": h}, "topic": "tele.SHT40_01.SENSOR"}
+            for m, s, h in ((0, 0, 50.0), (0, 20, 50.4), (0, 40, 50.8), (1, 0, 50.8))
+        ]
+        try:
+            with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=True)) as send:
+                await worker.process_messages(messages)
+        finally:
+            worker._set_topic_configs({})
+            worker.downsampler.take_outbox()
+
+        (rows,), _ = send.call_args
+        assert rows[0]["parameters"]["aggregation"]["count"] == 3
+        assert rows[0]["result_numeric"] == pytest.approx(50.4)
+
+class TestDownsamplingAtIngest:
+    """Test closed downsampling windows are submitted separately from raw rows"""
+
+    @pytest.mark.asyncio
+    async def test_closed_window_submitted(self, sample_datastreams, mock_queue):
+        """Test raw samples are acked and the closed window is sent as one aggregate row"""
+        worker._set_topic_configs({
+            "tele/A1T_01/SENSOR": {
+                "model": "A1T",
+                "datastreams": {"Power": sample_datastreams["Power"]},
+                "downsample": {"Power": {"window": 60}},
+            },
+        })
+        messages = [
+            {"Time": f"2026-04-04T12:00:{s:02d}", "ENERGY": {"Power": p}, "topic": "tele.A1T_01.SENSOR"}
+            for s, p in ((0, 100.0), (30, 200.0))
+        ] + [{"Time": "2026-04-04T12:01:00", "ENERGY": {"Power": 50.0}, "topic": "tele.A1T_01.SENSOR"}]
+        try:
+            with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=True)) as send:
+                await worker.process_messages(messages)
+        finally:
+            worker._set_topic_configs({})
+            worker.downsampler.take_outbox()
+
+        mock_queue.ack_batch.assert_awaited_once_with(indices=[0, 1, 2])
+        (rows,), _ = send.call_args
+        assert len(rows) == 1
+        assert rows[0]["result_numeric"] == pytest.approx(150.0)
+
+    @pytest.mark.asyncio
+    async def test_failed_window_kept_for_retry(self, sample_datastreams):
+        """Test an aggregate row that could not be sent stays in the outbox"""
+        worker.downsampler.outbox.append({"datastream_id": "x", "result_time": "t", "result_numeric": 1.0})
+        try:
+            with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=False)):
+                await worker.submit_downsampled()
+
+            assert len(worker.downsampler.outbox) == 1
+        finally:
+            worker.downsampler.take_outbox()
+
+class TestPoisonIsolation:
+    """Test failed batches are bisected so only offending messages reach the DLQ"""
+
+    @staticmethod
+    def _rejecting(bad_values):
+        """Fake API rejecting any batch that contains one of the given readings"""
+        calls = []
+
+        async def send(rows, **kwargs):
+            calls.append(len(rows))
+            if any(row["result_numeric"] in bad_values for row in rows):
+                raise worker.BatchRejected(422, "bad row")
+            return True
+
+        return send, calls
+
+    @staticmethod
+    def _messages(count):
+        return [
+            {"Time": "2026-04-04T12:00:00", "SHT4X": {"Temperature": float(i)}, "topic": "tele.SHT40_01.SENSOR"}
+            for i in range(count)
+        ]
+
+    @pytest.mark.asyncio
+    async def test_rejected_message_isolated(self, topic_configs, mock_queue):
+        """Test one bad row sends only its message to the DLQ"""
+        send, calls = self._rejecting({5.0})
+        with patch.object(worker, "send_observations_to_api", side_effect=send):
+            await worker.process_messages(self._messages(8))
+
+        mock_queue.dead_letter_batch.assert_awaited_once_with([5], reason="api-rejected")
+        assert sorted(mock_queue.ack_batch.call_args.kwargs["indices"]) == [0, 1, 2, 3, 4, 6, 7]
+        mock_queue.move_batch_to_dlq.assert_not_called()
+        assert len(calls) <= 1 + 2 * 3  # One bad message among 8 costs at most two sends per level
+
+    @pytest.mark.asyncio
+    async def test_extract_error_isolated_without_resend(self, topic_configs, mock_queue, sample_sht40_payload):
+        """Test a payload the extractor chokes on does not fail the good messages"""
+        messages = [
+            {**sample_sht40_payload, "topic": "tele.SHT40_01.SENSOR"},
+            {"Time": "2026-04-04T12:00:00", "SHT4X": {"Temperature": "n/a"}, "topic": "tele.SHT40_01.SENSOR"},
+        ]
+        with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=True)) as send:
+            await worker.process_messages(messages)
+
+        send.assert_awaited_once()
+        mock_queue.ack_batch.assert_awaited_once_with(indices=[0])
+        mock_queue.dead_letter_batch.assert_awaited_once_with([1], reason="extract-error")
+
+    @pytest.mark.asyncio
+    async def test_transient_failure_not_bisected(self, topic_configs, mock_queue):
+        """Test an unavailable API retries the whole group without splitting it"""
+        with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=False)) as send:
+            await worker.process_messages(self._messages(4))
+
+        send.assert_awaited_once()
+        mock_queue.move_batch_to_dlq.assert_awaited_once_with(indices=[0, 1, 2, 3])
+        mock_queue.dead_letter_batch.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_rejection_not_retried(self, mock_queue):
+        """Test a 422 from the API raises immediately instead of backing off"""
+        response = MagicMock(status_code=422, text="invalid")
+        response.raise_for_status.side_effect = httpx.HTTPStatusError("422", request=MagicMock(), response=response)
+        with patch.object(worker.token_manager, "get_token", AsyncMock(return_value="t")):
+            with patch.object(worker.api_client, "post", AsyncMock(return_value=response)) as post:
+                with pytest.raises(worker.BatchRejected):
+                    await worker.send_observations_to_api([{"result_numeric": 1}])
+
+        post.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_body_too_large_rejected(self, mock_queue):
+        """Test a 413 is bisected like a rejection rather than retried unchanged"""
+        response = MagicMock(status_code=413, text="Request body too large")
+        response.raise_for_status.side_effect = httpx.HTTPStatusError("413", request=MagicMock(), response=response)
+        with patch.object(worker.token_manager, "get_token", AsyncMock(return_value="t")):
+            with patch.object(worker.api_client, "post", AsyncMock(return_value=response)) as post:
+                with pytest.raises(worker.BatchRejected):
+                    await worker.send_observations_to_api([{"result_numeric": 1}])
+
+        post.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_unsupported_encoding_falls_back(self, mock_queue):
+        """Test a 415 for a compressed body is resent at once with the next simpler codec"""
+        refused = MagicMock(status_code=415, text="Unsupported Content-Encoding: gzip")
+        refused.raise_for_status.side_effect = httpx.HTTPStatusError("415", request=MagicMock(), response=refused)
+        ok = MagicMock(status_code=201)
+        with patch.object(worker.api_client, "compression", "gzip"), \
+                patch.object(worker.api_client, "compression_min_bytes", 0):
+            with patch.object(worker.token_manager, "get_token", AsyncMock(return_value="t")):
+                with patch.object(worker.api_client, "post", AsyncMock(side_effect=[refused, ok])) as post:
+                    with patch("app.worker.asyncio.sleep", AsyncMock()) as sleep:
+                        assert await worker.send_observations_to_api([{"result_numeric": 1}]) is True
+
+            assert worker.api_client.compression == "none"
+        assert "Content-Encoding" in post.await_args_list[0].kwargs["headers"]
+        assert "Content-Encoding" not in post.await_args_list[1].kwargs["headers"]
+        sleep.assert_not_called()
+
+
+class TestBackpressure:
+    """Test Retry-After handling and congestion feedback from API submissions"""
+
+    def _overloaded(self, status_code=503, retry_after="7"):
+        response = MagicMock(status_code=status_code, text="overloaded", headers={"Retry-After": retry_after})
+        response.raise_for_status.side_effect = httpx.HTTPStatusError(str(status_code), request=MagicMock(), response=response)
+        return response
+
+    @pytest.mark.asyncio
+    async def test_retry_after_replaces_fixed_backoff(self, mock_queue):
+        """Test a 503 with Retry-After is retried after the delay the API asked for"""
+        ok = MagicMock(status_code=201)
+        with patch.object(worker.token_manager, "get_token", AsyncMock(return_value="t")):
+            with patch.object(worker.api_client, "post", AsyncMock(side_effect=[self._overloaded(), ok])):
+                with patch("app.worker.asyncio.sleep", AsyncMock()) as sleep:
+                    assert await worker.send_observations_to_api([{"result_numeric": 1}], max_retries=2) is True
+
+        sleep.assert_awaited_once_with(7.0)
+
+    @pytest.mark.asyncio
+    async def test_overload_shrinks_congestion_window(self, mock_queue):
+        """Test a 429 and a success feed the queue's AIMD controller"""
+        mock_queue.congestion = AimdController(max_inflight=4, max_batch_size=100, latency_target=10)
+        mock_queue.congestion.window = 400.0
+        ok = MagicMock(status_code=201)
+        with patch.object(worker.token_manager, "get_token", AsyncMock(return_value="t")):
+            with patch.object(worker.api_client, "post", AsyncMock(side_effect=[self._overloaded(429, "0"), ok])):
+                with patch("app.worker.asyncio.sleep", AsyncMock()):
+                    assert await worker.send_observations_to_api([{"result_numeric": 1}], max_retries=2) is True
+
+        assert mock_queue.congestion.decreases == 1
+        assert 200 < mock_queue.congestion.window < 210
+
+
+@pytest.fixture
+def disk_spool(tmp_path):
+    spool = worker.ObservationSpool(str(tmp_path))
+    with patch.object(worker, "spool", spool):
+        yield spool
+    worker.api_outage = False
+
+
+class TestDiskSpool:
+    """Test outage spooling and replay"""
+
+    @pytest.mark.asyncio
+    async def test_failed_batch_spooled_and_acked(self, topic_configs, mock_queue, disk_spool, sample_sht40_payload):
+        """Test rows the API could not take are spooled and their messages acked"""
+        await disk_spool.open()
+        messages = [{**sample_sht40_payload, "topic": "tele.SHT40_01.SENSOR"}]
+        with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=False)):
+            await worker.process_messages(messages)
+
+        mock_queue.ack_batch.assert_awaited_once_with(indices=[0])
+        mock_queue.move_batch_to_dlq.assert_not_called()
+        rows, _ = await disk_spool.read(100)
+        assert len(rows) == 3
+        assert worker.api_outage is True
+
+    @pytest.mark.asyncio
+    async def test_outage_skips_api(self, topic_configs, mock_queue, disk_spool, sample_sht40_payload):
+        """Test batches go straight to disk while the API is known to be down"""
+        await disk_spool.open()
+        worker.api_outage = True
+        messages = [{**sample_sht40_payload, "topic": "tele.SHT40_01.SENSOR"}]
+        with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=True)) as send:
+            await worker.process_messages(messages)
+
+        send.assert_not_called()
+        mock_queue.ack_batch.assert_awaited_once_with(indices=[0])
+
+    @pytest.mark.asyncio
+    async def test_full_spool_falls_back_to_retry(self, topic_configs, mock_queue, disk_spool, sample_sht40_payload):
+        """Test messages are retried through RabbitMQ when the spool cannot take them"""
+        disk_spool.max_bytes = 0
+        await disk_spool.open()
+        messages = [{**sample_sht40_payload, "topic": "tele.SHT40_01.SENSOR"}]
+        with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=False)):
+            await worker.process_messages(messages)
+
+        mock_queue.move_batch_to_dlq.assert_awaited_once_with(indices=[0])
+        mock_queue.ack_batch.assert_not_called()
+        assert worker.api_outage is False
+
+    @pytest.mark.asyncio
+    async def test_failed_append_keeps_api_path(self, topic_configs, mock_queue, disk_spool, sample_sht40_payload):
+        """Test an unwritable spool does not start an outage that nothing would end"""
+        await disk_spool.open()
+        messages = [{**sample_sht40_payload, "topic": "tele.SHT40_01.SENSOR"}]
+        with patch.object(disk_spool, "append", AsyncMock(side_effect=OSError("disk full"))):
+            with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=False)):
+                await worker.process_messages(messages)
+            with patch.object(worker, "send_observations_to_api", AsyncMock(return_value=True)) as send:
+                await worker.process_messages(messages)
+
+        assert worker.api_outage is False
+        assert disk_spool.is_empty()
+        send.assert_called()
+        mock_queue.move_batch_to_dlq.assert_awaited_once_with(indices=[0])
+        mock_queue.ack_batch.assert_awaited_once_with(indices=[0])
+
+    @pytest.mark.asyncio
+    async def test_replay_drains_spool_and_ends_outage(self, disk_spool):
+        """Test replay sends spooled rows once the API accepts them"""
+        await disk_spool.open()
+        await disk_spool.append([{"result_numeric": 1.0}, {"result_numeric": 2.0}])
+        worker.api_outage = True
+        sent = []
+
+        async def send(rows, **kwargs):
+            sent.extend(rows)
+            return True
+
+        with patch.object(worker, "send_observations_to_api", side_effect=send):
+            task = asyncio.create_task(worker.replay_spool())
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        assert [r["result_numeric"] for r in sent] == [1.0, 2.0]
+        assert disk_spool.is_empty()
+        assert worker.api_outage is False
+
+@pytest.fixture
+def mock_redis():
+    with patch.object(worker, "redis_client") as redis_client:
+        redis_client.hmget = AsyncMock(return_value=[])
+        yield redis_client
+
+
+@pytest.fixture
+def versioned(topic_configs):
+    worker.topic_config_version = 5
+    yield
+    worker.topic_config_version = None
+
+
+class TestTopicConfigNotifications:
+    """Test event-driven topic config invalidation"""
+
+    @pytest.mark.asyncio
+    async def test_new_topic_fetched_by_field(self, versioned, mock_redis, sample_datastreams):
+        """Test only the changed fields are re-fetched and the new topic becomes routable"""
+        cfg = {"model": "SHT40", "datastreams": {"Temperature": sample_datastreams["Temperature"]}}
+        mock_redis.hmget.return_value = [json.dumps(cfg)]
+
+        await worker.handle_topic_config_notification(
+            json.dumps({"version": 6, "changed": ["tele/SHT40_02/SENSOR"], "removed": []})
+        )
+
+        mock_redis.hmget.assert_awaited_once_with(worker.REDIS_TOPIC_CONFIG_KEY, ["tele/SHT40_02/SENSOR"])
+        mock_redis.hgetall.assert_not_called()
+        assert worker.topic_index.resolve("tele.SHT40_02.SENSOR") is not None
+        assert worker.topic_config_version == 6
+
+    @pytest.mark.asyncio
+    async def test_removed_topic_dropped(self, versioned, mock_redis):
+        """Test removed topics leave the index without a fetch"""
+        await worker.handle_topic_config_notification(
+            json.dumps({"version": 6, "changed": [], "removed": ["tele/A1T_01/SENSOR"]})
+        )
+
+        mock_redis.hmget.assert_not_called()
+        assert "tele/A1T_01/SENSOR" not in worker.topic_config_map
+        assert worker.topic_index.resolve("tele.A1T_01.SENSOR") is None
+
+    @pytest.mark.asyncio
+    async def test_stale_notification_ignored(self, versioned, mock_redis):
+        """Test a version already applied is ignored"""
+        await worker.handle_topic_config_notification(
+            json.dumps({"version": 5, "changed": [], "removed": ["tele/A1T_01/SENSOR"]})
+        )
+
+        assert "tele/A1T_01/SENSOR" in worker.topic_config_map
+
+    @pytest.mark.asyncio
+    async def test_version_gap_triggers_full_reload(self, versioned, mock_redis):
+        """Test a missed notification falls back to a full reload"""
+        with patch.object(worker, "load_topic_config", AsyncMock()) as load:
+            await worker.handle_topic_config_notification(
+                json.dumps({"version": 8, "changed": ["tele/A1T_01/SENSOR"], "removed": []})
+            )
+
+        load.assert_awaited_once()
+        mock_redis.hmget.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_load_reads_version_and_hash(self, mock_redis, sample_datastreams):
+        """Test a full load installs the hash and records its version"""
+        cfg = {"model": "A1T", "datastreams": {"Power": sample_datastreams["Power"]}}
+        pipe = MagicMock()
+        pipe.execute = AsyncMock(return_value=["3", {"tele/A1T_09/SENSOR": json.dumps(cfg)}])
+        mock_redis.pipeline.return_value.__aenter__ = AsyncMock(return_value=pipe)
+        mock_redis.pipeline.return_value.__aexit__ = AsyncMock(return_value=False)
+
+        try:
+            await worker.load_topic_config()
+
+            assert worker.topic_config_version == 3
+            assert worker.topic_index.resolve("tele.A1T_09.SENSOR").model == "A1T"
+        finally:
+            worker._set_topic_configs({})
+            worker.topic_config_version = None
+
+
+class TestDatabaseSink:
+    """Test the INGESTION_SINK=timescale path"""
+
+    @pytest.mark.asyncio
+    async def test_rows_routed_to_database_sink(self):
+        """Test rows go to the database sink instead of the API when configured"""
+        sink = MagicMock(write=AsyncMock())
+        with patch.object(worker, "db_sink", sink):
+            with patch.object(worker, "send_observations_to_api", AsyncMock()) as api:
+                assert await worker.send_observations([{"result_numeric": 1}]) is True
+
+        sink.write.assert_awaited_once_with([{"result_numeric": 1}])
+        api.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_refused_rows_raise_batch_rejected(self):
+        """Test rows the database refuses are bisected like an API rejection"""
+        sink = MagicMock(write=AsyncMock(side_effect=worker.RowsRejected("23503", "unknown datastream")))
+        with patch.object(worker, "db_sink", sink):
+            with pytest.raises(worker.BatchRejected):
+                await worker.send_observations([{"result_numeric": 1}])
+
+        sink.write.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_transient_failure_retried(self):
+        """Test connection errors are retried and reported as a failed batch"""
+        sink = MagicMock(write=AsyncMock(side_effect=OSError("connection refused")))
+        with patch.object(worker, "db_sink", sink), patch.object(worker, "BASE_DELAY", 0):
+            assert await worker.send_observations([{"result_numeric": 1}], max_retries=2) is False
+
+        assert sink.write.await_count == 2
+
+
+class TestQueueLagPolling:
+    """Test the queue depth and lag gauges"""
+
+    @pytest.mark.asyncio
+    async def test_unknown_depth_skipped(self, mock_queue):
+        """Test a source that cannot report its backlog (MQTT) leaves the gauges unset"""
+        mock_queue.queue_depth = AsyncMock(return_value=None)
+        with patch.object(worker, "QUEUE_DEPTH") as depth, patch.object(worker, "QUEUE_LAG_SECONDS") as lag:
+            with patch("app.worker.asyncio.sleep", AsyncMock(side_effect=[None, None, asyncio.CancelledError])):
+                with pytest.raises(asyncio.CancelledError):
+                    await worker.poll_queue_lag()
+
+        assert mock_queue.queue_depth.await_count == 2
+        depth.set.assert_not_called()
+        lag.set.assert_not_called()
+
+
+class TestShutdown:
+    """Test the worker's background tasks are stopped before its resources close"""
+
+    @pytest.mark.asyncio
+    async def test_background_tasks_cancelled_before_spool_closes(self, mock_queue):
+        order = []
+
+        async def background(name):
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                order.append(f"{name} cancelled")
+                raise
+
+        spool = MagicMock(open=AsyncMock(), close=AsyncMock(side_effect=lambda: order.append("spool closed")))
+        mock_queue.connect = AsyncMock()
+        mock_queue.disconnect = AsyncMock(side_effect=lambda: order.append("queue disconnected"))
+
+        async def consume():
+            await asyncio.sleep(0)  # Let the background tasks start
+            raise KeyboardInterrupt
+
+        mock_queue.start_consuming = consume
+        with patch.object(worker, "spool", spool), patch.object(worker, "db_sink", None), \
+                patch.object(worker, "redis_client", None), patch.object(worker, "METRICS_PORT", 0), \
+                patch.object(worker.aioredis, "from_url", AsyncMock(return_value=AsyncMock())), \
+                patch.object(worker.api_client, "start", AsyncMock()), \
+                patch.object(worker.api_client, "close", AsyncMock()), \
+                patch.object(worker.token_manager, "get_token", AsyncMock(return_value="t")), \
+                patch.object(worker, "load_topic_config", AsyncMock()), \
+                patch.object(worker, "watch_topic_config_changes", lambda: background("watch")), \
+                patch.object(worker, "refresh_topic_config", lambda: background("refresh")), \
+                patch.object(worker, "replay_spool", lambda: background("replay")), \
+                patch.object(worker, "flush_downsample_windows", lambda: background("downsample")):
+            await worker.main()
+
+        assert sorted(order[:4]) == ["downsample cancelled", "refresh cancelled", "replay cancelled", "watch cancelled"]
+        assert order[4:] == ["queue disconnected", "spool closed"]
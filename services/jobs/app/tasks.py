@@ -22,6 +22,8 @@ SYSTEMS_API_URL = f"{API_URL}/api/v1/systems/"
 DATASTREAMS_API_URL = f"{API_URL}/api/v1/datastreams/"
 OBSERVATIONS_API_URL = f"{API_URL}/api/v1/observations/"
 REDIS_TOPIC_CONFIG_KEY = "mqtt:topic_config"
+REDIS_TOPIC_CONFIG_VERSION_KEY = "mqtt:topic_config:version"  # Bumped on every change
+REDIS_TOPIC_CONFIG_CHANNEL = "mqtt:topic_config:changes"  # Pub/sub: {"version", "changed", "removed"}
 BATCH_SIZE = 100
 
 # Open Meteo configuration
@@ -123,11 +125,25 @@ def sync_mqtt_topics_to_redis() -> None:
                     datastreams = ds_response.json()
 
                     ds_by_system: Dict[str, Dict[str, str]] = {}
+                    deadband_by_system: Dict[str, Dict[str, Dict[str, float]]] = {}
+                    downsample_by_system: Dict[str, Dict[str, Dict[str, Any]]] = {}
                     for ds in datastreams:
                         sid = ds.get("system_id")
-                        mqtt_key = ds.get("properties", {}).get("mqtt_key")
+                        props = ds.get("properties") or {}
+                        mqtt_key = props.get("mqtt_key")
                         if sid and mqtt_key:
                             ds_by_system.setdefault(sid, {})[mqtt_key] = ds["id"]
+                            # Optional ingest compression: forward only moves beyond the deadband,
+                            # or a heartbeat after this many seconds of silence
+                            band = {k: props[k] for k in ("deadband", "heartbeat") if props.get(k) is not None}
+                            if band:
+                                deadband_by_system.setdefault(sid, {})[mqtt_key] = band
+                            # Optional windowed aggregation: one row per downsample_window seconds
+                            if props.get("downsample_window"):
+                                downsample_by_system.setdefault(sid, {})[mqtt_key] = {
+                                    "window": props["downsample_window"],
+                                    "value": props.get("downsample_value", "mean"),
+                                }
 
                     for s in valid_systems:
                         topic = s["external_id"]
@@ -135,6 +151,15 @@ def sync_mqtt_topics_to_redis() -> None:
                             "model": s["model"],
                             "datastreams": ds_by_system.get(s["id"], {}),
                         }
+                        # Optional declarative extractor spec (payload path → mqtt_key) for models
+                        # the ingestion worker has no built-in spec for
+                        extractor = (s.get("properties") or {}).get("extractor")
+                        if extractor:
+                            config["extractor"] = extractor
+                        if s["id"] in deadband_by_system:
+                            config["deadband"] = deadband_by_system[s["id"]]
+                        if s["id"] in downsample_by_system:
+                            config["downsample"] = downsample_by_system[s["id"]]
                         all_topic_config[topic] = json.dumps(config)
                         total_topics += 1
 
@@ -161,14 +186,31 @@ def sync_mqtt_topics_to_redis() -> None:
     r = redis.from_url(REDIS_URL, decode_responses=True)
     
     if all_topic_config:
-        current = r.hkeys(REDIS_TOPIC_CONFIG_KEY)
-        stale = set(current) - set(all_topic_config.keys())
-        if stale:
-            logger.info("Removing stale topic configs", extra={"count": len(stale)})
-            r.hdel(REDIS_TOPIC_CONFIG_KEY, *stale)
-
-        r.hset(REDIS_TOPIC_CONFIG_KEY, mapping=all_topic_config)
-        logger.info("MQTT topic config synced to Redis", extra={"total_topics": total_topics})
+        current = r.hgetall(REDIS_TOPIC_CONFIG_KEY)
+        stale = sorted(set(current) - set(all_topic_config.keys()))
+        changed = sorted(topic for topic, cfg in all_topic_config.items() if current.get(topic) != cfg)
+
+        if changed or stale:
+            pipe = r.pipeline()
+            if stale:
+                logger.info("Removing stale topic configs", extra={"count": len(stale)})
+                pipe.hdel(REDIS_TOPIC_CONFIG_KEY, *stale)
+            if changed:
+                pipe.hset(REDIS_TOPIC_CONFIG_KEY, mapping={topic: all_topic_config[topic] for topic in changed})
+            pipe.incr(REDIS_TOPIC_CONFIG_VERSION_KEY)
+            version = pipe.execute()[-1]
+
+            # Notify ingestion workers so they re-fetch only these fields
+            r.publish(
+                REDIS_TOPIC_CONFIG_CHANNEL,
+                json.dumps({"version": version, "changed": changed, "removed": stale}),
+            )
+            logger.info(
+                "MQTT topic config synced to Redis",
+                extra={"total_topics": total_topics, "changed": len(changed), "removed": len(stale), "version": version},
+            )
+        else:
+            logger.info("MQTT topic config unchanged", extra={"total_topics": total_topics})
     else:
         logger.warning("No valid topics found — Redis not updated")
     
@@ -3,7 +3,14 @@ from unittest.mock import MagicMock, patch, call
 from datetime import datetime, timezone, timedelta
 import json
 
-from app.tasks import fetch_open_meteo_data, sync_mqtt_topics_to_redis, train_temperature_model
+from app.tasks import (
+    fetch_open_meteo_data,
+    sync_mqtt_topics_to_redis,
+    train_temperature_model,
+    REDIS_TOPIC_CONFIG_KEY,
+    REDIS_TOPIC_CONFIG_VERSION_KEY,
+    REDIS_TOPIC_CONFIG_CHANNEL,
+)
 
 
 class TestFetchOpenMeteoData:
@@ -227,6 +234,70 @@ class TestSyncMqttTopics:
                     assert result is None or isinstance(result, dict)
 
 
+    def _sync_with_redis(self, current, ds_properties=None):
+        """Run the sync against one SENSOR system with the given hash already in Redis."""
+        sys_response = MagicMock(status_code=200)
+        sys_response.json.return_value = [
+            {"id": "sys-1", "external_id": "tele/SHT40_01/SENSOR", "model": "SHT40"}
+        ]
+        ds_response = MagicMock(status_code=200)
+        ds_response.json.return_value = [
+            {"id": "ds-1", "system_id": "sys-1", "properties": {"mqtt_key": "Temperature", **(ds_properties or {})}}
+        ]
+        with patch("app.tasks.httpx.Client") as mock_client_cls:
+            client = mock_client_cls.return_value.__enter__.return_value
+            client.get.side_effect = [sys_response, ds_response]
+            with patch("app.tasks.token_manager") as mock_token_mgr:
+                mock_token_mgr.get_token.return_value = "test-token"
+                with patch("redis.from_url") as mock_redis:
+                    mock_r = MagicMock()
+                    mock_r.hgetall.return_value = current
+                    mock_r.pipeline.return_value.execute.return_value = [1, 1, 7]
+                    mock_redis.return_value = mock_r
+                    sync_mqtt_topics_to_redis()
+        return mock_r
+
+    def test_sync_publishes_changed_and_removed_topics(self):
+        """Test changes bump the version and notify ingestion workers."""
+        mock_r = self._sync_with_redis({"tele/OLD/SENSOR": "{}"})
+        pipe = mock_r.pipeline.return_value
+
+        pipe.hdel.assert_called_once_with(REDIS_TOPIC_CONFIG_KEY, "tele/OLD/SENSOR")
+        pipe.incr.assert_called_once_with(REDIS_TOPIC_CONFIG_VERSION_KEY)
+        channel, payload = mock_r.publish.call_args[0]
+        assert channel == REDIS_TOPIC_CONFIG_CHANNEL
+        assert json.loads(payload) == {
+            "version": 7,
+            "changed": ["tele/SHT40_01/SENSOR"],
+            "removed": ["tele/OLD/SENSOR"],
+        }
+
+    def test_sync_unchanged_config_not_published(self):
+        """Test an unchanged config is neither rewritten nor announced."""
+        current = {
+            "tele/SHT40_01/SENSOR": json.dumps({"model": "SHT40", "datastreams": {"Temperature": "ds-1"}})
+        }
+        mock_r = self._sync_with_redis(current)
+
+        mock_r.pipeline.assert_not_called()
+        mock_r.publish.assert_not_called()
+
+    def test_sync_copies_deadband_settings(self):
+        """Test datastream deadband/heartbeat properties reach the topic config."""
+        mock_r = self._sync_with_redis({}, ds_properties={"deadband": 0.5, "heartbeat": 300})
+
+        mapping = mock_r.pipeline.return_value.hset.call_args[1]["mapping"]
+        config = json.loads(mapping["tele/SHT40_01/SENSOR"])
+        assert config["deadband"] == {"Temperature": {"deadband": 0.5, "heartbeat": 300}}
+
+    def test_sync_copies_downsample_settings(self):
+        """Test datastream downsample properties reach the topic config."""
+        mock_r = self._sync_with_redis({}, ds_properties={"downsample_window": 60, "downsample_value": "max"})
+
+        mapping = mock_r.pipeline.return_value.hset.call_args[1]["mapping"]
+        config = json.loads(mapping["tele/SHT40_01/SENSOR"])
+        assert config["downsample"] == {"Temperature": {"window": 60, "value": "max"}}
+
 class TestTrainTemperatureModel:
     """Test temperature model training."""
     
@@ -0,0 +1,40 @@
+"""
+Redis stream format for new observations
+
+Every writer of observations (the API and the ingestion worker's database
+sink) publishes them to the same per-datastream streams, read by WebSocket
+clients and the Notifier.
+"""
+import json
+from typing import Any, Dict, Optional
+
+STREAM_MAXLEN = 1000  # Entries kept per datastream stream (approximate trimming)
+STREAM_TTL = 604800  # 7 days
+
+
+def stream_key(datastream_id: Any) -> str:
+    """Redis key of a datastream's observation stream"""
+    return f"datastream:{datastream_id}"
+
+
+def stream_entry(
+    obs_id: Any,
+    datastream_id: Any,
+    result_time: Any,
+    result_complex: Optional[Any] = None,
+    result_numeric: Optional[float] = None,
+    result_text: Optional[str] = None,
+    result_boolean: Optional[bool] = None,
+    parameters: Optional[dict] = None,
+) -> Dict[str, str]:
+    """Stream fields for one observation: every value a string, empty for a missing result"""
+    return {
+        "id": str(obs_id),
+        "datastream_id": str(datastream_id),
+        "result_time": result_time.isoformat(),
+        "result_complex": str(result_complex) if result_complex is not None else "",
+        "result_numeric": str(result_numeric) if result_numeric is not None else "",
+        "result_text": result_text or "",
+        "result_boolean": str(result_boolean) if result_boolean is not None else "",
+        "parameters": json.dumps(parameters) if parameters else "{}",
+    }
@@ -0,0 +1,30 @@
+import json
+from datetime import datetime, timezone
+from uuid import uuid4
+from streams.observation_streams import stream_entry, stream_key
+
+
+class TestObservationStreams:
+    """Test the Redis stream format shared by every observation writer"""
+
+    def test_stream_key(self):
+        ds_id = uuid4()
+        assert stream_key(ds_id) == f"datastream:{ds_id}"
+
+    def test_stream_entry_fields_are_strings(self):
+        """Test every field is a string, with empty strings for missing results"""
+        entry = stream_entry(uuid4(), uuid4(), datetime(2026, 4, 4, 12, tzinfo=timezone.utc), result_numeric=21.5)
+
+        assert entry["result_time"] == "2026-04-04T12:00:00+00:00"
+        assert entry["result_numeric"] == "21.5"
+        assert entry["result_complex"] == ""
+        assert entry["result_text"] == ""
+        assert entry["result_boolean"] == ""
+        assert entry["parameters"] == "{}"
+        assert all(isinstance(v, str) for v in entry.values())
+
+    def test_stream_entry_parameters_json(self):
+        entry = stream_entry(uuid4(), uuid4(), datetime.now(), result_boolean=False, parameters={"unit": "C"})
+
+        assert entry["result_boolean"] == "False"
+        assert json.loads(entry["parameters"]) == {"unit": "C"}